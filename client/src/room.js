@@ -12,12 +12,21 @@ export class Room extends React.Component {
             roomLayout: [], // List of widgets
             answers: {}
         };
+        // Widgets whose answers changed since the last update sent
+        this.dirtyWidgets = new Set();
+        // Widgets whose answers were sent but not confirmed by the server yet
+        this.sentWidgets = new Set();
+        // Tags of the layout and answers we hold, sent on (re)join so the
+        // server can leave out what has not changed
+        this.known = {};
     }
 
     componentDidMount() {
         let server = window.location.protocol + "//" + window.location.host;
         this.io = socketIOClient.connect(server, {path: process.env.PUBLIC_URL + "/socket.io"});
         this.io.on("roomUpdate", this.onRoomUpdate);
+        // The session is gone after a reconnect; join again with the tags we
+        // hold and resend changes the server might have missed
         this.io.on("reconnect", attemptNumber => {
             this.joinRoom();
         });
@@ -33,35 +42,100 @@ export class Room extends React.Component {
     joinRoom = () => {
         this.io.emit('joinRoom',
             this.props.match.params.roomId,
-            this.onRoomUpdate);
+            this.known,
+            this.onJoin);
     }
 
     forceJoinRoom = () => {
         this.io.emit('forceJoinRoom',
             this.props.match.params.roomId,
-            this.onRoomUpdate);
+            this.known,
+            this.onJoin);
+    }
+
+    onJoin = response => {
+        this.onRoomUpdate(response);
+        if (response.status !== "success")
+            return;
+        // Changes made while disconnected were not accepted by the server
+        for (let widgetId of this.sentWidgets)
+            this.dirtyWidgets.add(widgetId);
+        this.sentWidgets.clear();
+        if (this.dirtyWidgets.size > 0) {
+            clearTimeout(this.serverUpdateTimeout);
+            this.sendDataUpdate();
+        }
     }
 
     sendDataUpdate = () => {
-        this.io.emit("answerUpdate",
+        // The reconnect resends the changes
+        if (!this.io.connected)
+            return;
+        let patch = {};
+        let widgets = new Set(this.dirtyWidgets);
+        for (let widgetId of widgets) {
+            let answer = this.state.answers[widgetId];
+            patch[widgetId] = answer !== undefined ? answer : null;
+            this.sentWidgets.add(widgetId);
+        }
+        this.dirtyWidgets.clear();
+        this.io.emit("answerPatch",
             this.props.match.params.roomId,
-            this.state.answers);
+            patch,
+            response => {
+                if (!response || response.status !== "success") {
+                    // Not joined anymore, resent after the next join
+                    return;
+                }
+                for (let widgetId of widgets)
+                    this.sentWidgets.delete(widgetId);
+                if (this.sentWidgets.size === 0 && this.dirtyWidgets.size === 0)
+                    this.known.answersTag = response.answersTag;
+            });
+    }
+
+    localChanges() {
+        return new Set([...this.dirtyWidgets, ...this.sentWidgets]);
     }
 
     onRoomUpdate = response => {
         if (response.status === "success") {
-            document.title = response.roomLayout.name;
+            // Layout broadcasts do not carry answers and joins leave out
+            // parts we already have
+            let layout = response.roomLayout !== undefined
+                ? response.roomLayout
+                : this.state.layout;
+            document.title = layout.name;
+            this.known = {
+                layoutTag: response.layoutTag,
+                answersTag: response.answersTag !== undefined
+                    ? response.answersTag
+                    : this.known.answersTag
+            };
+            let answers = this.state.answers;
+            if (response.answers !== undefined) {
+                // Keep our changes the server has not confirmed yet
+                answers = {...response.answers};
+                for (let widgetId of this.localChanges()) {
+                    if (this.state.answers[widgetId] !== undefined)
+                        answers[widgetId] = this.state.answers[widgetId];
+                    else
+                        delete answers[widgetId];
+                }
+            }
             this.setState({
-                layout: response.roomLayout,
-                answers: response.answers,
+                layout: layout,
+                answers: answers,
                 error: undefined
             });
         }
-        else
+        else {
+            this.known = {};
             this.setState({
                 layout: undefined,
                 error: response.reason
             });
+        }
     }
 
     onConnectError = () => {
@@ -75,6 +149,9 @@ export class Room extends React.Component {
         this.setState(produce(this.state, draft => {
             draft.answers[widgetId] = value;
         }), () => {
+            // Our answers differ from the version the server tagged
+            this.known.answersTag = undefined;
+            this.dirtyWidgets.add(widgetId);
             clearTimeout(this.serverUpdateTimeout);
             this.serverUpdateTimeout = setTimeout(this.sendDataUpdate, 1000);
         });
@@ -87,6 +87,27 @@ export class Teacher extends React.Component {
     }
 }
 
+function decodeColumnarOverview(overview) {
+    let columns = overview.columns;
+    let answers = {};
+    let members = {};
+    columns.login.forEach((login, i) => {
+        answers[login] = {};
+        for (let [widgetId, column] of Object.entries(columns.answers)) {
+            if (column[i] !== null)
+                answers[login][widgetId] = column[i];
+        }
+        if (columns.known[i])
+            members[login] = {
+                uco: columns.uco[i],
+                name: columns.name[i],
+                teacher: columns.teacher[i],
+                active: columns.active[i]
+            };
+    });
+    return {...overview, answers: answers, members: members};
+}
+
 class TeacherRoomOverview extends React.Component {
     constructor(props) {
         super(props);
@@ -99,14 +120,14 @@ class TeacherRoomOverview extends React.Component {
 
     componentDidMount() {
         let io = this.props.io;
-        io.on("rooms", this.onRooms);
+        io.on("roomsDelta", this.onRoomsDelta);
         io.emit("subscribeRooms", this.onRooms);
     }
 
     componentWillUnmount() {
         let io = this.props.io;
         io.emit("unsubscribeRooms");
-        io.off("rooms");
+        io.off("roomsDelta");
     }
 
     onRooms = (rooms) => {
@@ -114,6 +135,24 @@ class TeacherRoomOverview extends React.Component {
         this.setState({rooms: rooms});
     }
 
+    onRoomsDelta = (delta) => {
+        this.setState((state) => {
+            if (state.rooms === undefined)
+                return {};
+            let updated = {};
+            for (let room of delta.updated)
+                updated[room.id] = room;
+            let rooms = state.rooms
+                .filter(room => !delta.deleted.includes(room.id))
+                .map(room => {
+                    let newRoom = updated[room.id];
+                    delete updated[room.id];
+                    return newRoom !== undefined ? newRoom : room;
+                });
+            return {rooms: rooms.concat(Object.values(updated))};
+        });
+    }
+
     getRoom = (roomId) => {
         for (let room of this.state.rooms) {
             if (roomId === room.id)
@@ -256,18 +295,27 @@ class TeacherRoomView extends React.Component {
     componentDidMount() {
         let io = this.props.io;
         io.on("room", this.onRoom);
-        io.emit("subscribeRoom", this.props.match.params.roomId, this.onRoom);
+        io.on("roomDelta", this.onRoomDelta);
+        // Prefer compact member columns, the server falls back to JSON objects
+        io.emit("negotiateEncoding", ["columnar", "json"], () => this.subscribe());
     }
 
     componentWillUnmount() {
         let io = this.props.io;
         io.emit("unsubscribeRoom", this.props.match.params.roomId);
         io.off("room");
+        io.off("roomDelta");
+    }
+
+    subscribe = () => {
+        this.props.io.emit("subscribeRoom", this.props.match.params.roomId, this.onRoom);
     }
 
     onRoom = (response) => {
         if (response === undefined)
             return;
+        if (response.encoding === "columnar")
+            response = decodeColumnarOverview(response);
         if (response.status === "error") {
             this.setState({
                 layout: undefined,
@@ -281,11 +329,28 @@ class TeacherRoomView extends React.Component {
                 layout: response.roomLayout,
                 answers: response.answers,
                 members: response.members,
+                revision: response.revision,
                 error: undefined
             })
         }
     }
 
+    onRoomDelta = (delta) => {
+        if (delta.roomId !== this.props.match.params.roomId || this.state.answers === undefined)
+            return;
+        if (delta.revision <= this.state.revision)
+            return;
+        if (delta.revision !== this.state.revision + 1) {
+            // We missed an update, ask for the full state
+            this.subscribe();
+            return;
+        }
+        this.setState(produce(this.state, draft => {
+            Object.assign(draft.answers, delta.answers);
+            draft.revision = delta.revision;
+        }));
+    }
+
     renderStudentTable = () => {
         if (this.state.layout)
             return <StudentAnswerOverview
@@ -0,0 +1,68 @@
+#!/usr/bin/env python3
+"""
+Memory footprint of member answers in a room with 10 single-choice, 5
+multiple-choice and 5 text widgets where every member answered everything.
+
+Usage: python3 -m benchmarks.answerStore (from the server directory)
+"""
+
+import random
+import tracemalloc
+from benchmarks.common import importModel, report
+
+importModel()
+from quickPoll.room import Room
+from quickPoll.widgets import ChoiceWidget, TextWidget, Choice
+
+PHRASES = ["answer {}".format(i) for i in range(200)]
+
+def buildRoom():
+    room = Room("bench", "Benchmark", "bench", "")
+    for i in range(10):
+        room.addWidget(ChoiceWidget("Single", False, [Choice("Choice") for _ in range(5)]))
+    for i in range(5):
+        room.addWidget(ChoiceWidget("Multiple", True, [Choice("Choice") for _ in range(8)]))
+    for i in range(5):
+        room.addWidget(TextWidget("Text"))
+    return room
+
+def randomAnswers(room, rnd):
+    answers = {}
+    for widget in room.widgets:
+        if widget.type() == "text":
+            # Mostly repeated short answers, some unique ones
+            if rnd.random() < 0.8:
+                answers[str(widget.id)] = rnd.choice(PHRASES)
+            else:
+                answers[str(widget.id)] = "unique answer {}".format(rnd.random())
+        elif widget.multiple:
+            answers[str(widget.id)] = sorted(rnd.sample(range(1, 9), rnd.randint(0, 4)))
+        else:
+            answers[str(widget.id)] = rnd.randint(1, 5)
+    return answers
+
+def answersMemory(memberCount):
+    rnd = random.Random(42)
+    room = buildRoom()
+    submitted = [("xlogin{}".format(i), randomAnswers(room, rnd)) for i in range(memberCount)]
+    tracemalloc.start()
+    before = tracemalloc.take_snapshot()
+    for username, answers in submitted:
+        room.restoreAnswers(username, answers)
+    after = tracemalloc.take_snapshot()
+    tracemalloc.stop()
+    return sum(x.size_diff for x in after.compare_to(before, "filename"))
+
+def main():
+    results = []
+    for memberCount in [1000, 5000, 10000]:
+        size = answersMemory(memberCount)
+        results.append({
+            "members": memberCount,
+            "answersBytes": size,
+            "bytesPerMember": size // memberCount
+        })
+    report("answerStore", results)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,247 @@
+#!/usr/bin/env python3
+"""
+End-to-end load benchmark with simulated classrooms.
+
+Boots the whole server, by default with an in-memory stand-in for the
+database (benchmarks.memoryDb), and drives simulated students and teachers
+through the Socket.IO test client. For each scenario it reports the latency
+from a student answer to the answer delta becoming visible to the teachers,
+the duration of a teacher layout edit including its broadcast to the
+students, processed events per second and emitted bytes per event, one JSON
+line per scenario.
+
+Usage (from the server directory):
+
+    python3 -m benchmarks.classroom --students 50,500,2000 \\
+        --rooms choice,text --output results.jsonl
+
+Pass --db postgres --dsn "dbname=quickpoll_bench" to include a real
+PostgreSQL database. Never point --dsn to a production database: the
+benchmark creates people, teachers and rooms there.
+"""
+
+import argparse
+import json
+import os
+import random
+import tempfile
+import time
+from benchmarks.common import importServer, report
+import benchmarks.memoryDb as memoryDb
+
+TEACHER = "benchTeacher"
+
+def percentile(values, p):
+    if len(values) == 0:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p / 100))]
+
+class Simulation:
+    def __init__(self, app, socketio, encoding):
+        self.app = app
+        self.socketio = socketio
+        self.encoding = encoding
+        self.emittedBytes = 0
+        self.emittedPackets = 0
+
+    def connect(self, login):
+        client = self.socketio.test_client(self.app)
+        # The test client cannot pass the authenticated user as the web server
+        # does, so inject it into the session environment
+        sid = getattr(client, "eio_sid", None) or client.sid
+        self.socketio.server.environ[sid]["AUTH_USER"] = login
+        return client
+
+    def received(self, client):
+        """
+        Collect events received by the client and account for their size
+        """
+        events = client.get_received()
+        for event in events:
+            self.emittedPackets += 1
+            self.emittedBytes += len(self.encoding.dumps([event["name"]] + event["args"],
+                separators=(",", ":")))
+        return events
+
+    def wait(self, duration):
+        """
+        Let background tasks (broadcasts, persistence) run
+        """
+        self.socketio.sleep(duration)
+
+def prepareDatabase(db, students):
+    if isinstance(db, memoryDb.MemoryPool):
+        db.teachers.add(TEACHER)
+        for i, login in enumerate(students):
+            db.people.setdefault(login, ("Student {}".format(i), 100000 + i))
+        return
+    with db.transaction() as cursor:
+        cursor.execute("""
+            INSERT INTO teachers (login) VALUES (%s)
+                ON CONFLICT (login) DO NOTHING;""", [TEACHER])
+        for i, login in enumerate(students):
+            cursor.execute("""
+                INSERT INTO people (login, name, uco) VALUES (%s, %s, %s)
+                    ON CONFLICT (login) DO NOTHING;""",
+                [login, "Student {}".format(i), 100000 + i])
+
+def layoutOf(overview):
+    """
+    Return the room layout of an overview, which might still be pre-encoded
+    """
+    layout = overview["roomLayout"]
+    return json.loads(layout.json) if hasattr(layout, "json") else layout
+
+def createRoom(sim, teacher, roomType, widgetCount):
+    roomId = teacher.emit("createRoom", callback=True)
+    for _ in range(widgetCount):
+        overview = teacher.emit("addWidget", roomId, roomType, callback=True)
+        widgetId = layoutOf(overview)["widgets"][-1]["id"]
+        teacher.emit("changeWidgetVisibility", roomId, widgetId, True, callback=True)
+        if roomType == "choice":
+            for _ in range(4):
+                teacher.emit("addChoice", roomId, widgetId, callback=True)
+    overview = teacher.emit("subscribeRoom", roomId, callback=True)
+    return roomId, layoutOf(overview)["widgets"]
+
+def randomAnswers(widgets, rnd):
+    answers = {}
+    for widget in widgets:
+        if widget["type"] == "text":
+            answers[str(widget["id"])] = "".join(rnd.choice("abcdefgh ") for _ in range(rnd.randint(5, 40)))
+        elif widget["multiple"]:
+            answers[str(widget["id"])] = [ch["id"] for ch in widget["choices"] if rnd.random() < 0.3]
+        else:
+            answers[str(widget["id"])] = rnd.choice(widget["choices"])["id"]
+    return answers
+
+def runScenario(sim, db, roomType, studentCount, teacherCount, rounds, widgetCount, settle):
+    rnd = random.Random(studentCount)
+    students = ["benchStudent{}".format(i) for i in range(studentCount)]
+    prepareDatabase(db, students)
+
+    teachers = [sim.connect(TEACHER) for _ in range(teacherCount)]
+    roomId, widgets = createRoom(sim, teachers[0], roomType, widgetCount)
+    for teacher in teachers[1:]:
+        teacher.emit("subscribeRoom", roomId, callback=True)
+
+    studentClients = []
+    for login in students:
+        client = sim.connect(login)
+        client.emit("joinRoom", roomId, callback=True)
+        studentClients.append((login, client))
+    sim.wait(settle)
+    for client in teachers + [c for _, c in studentClients]:
+        client.get_received()
+    sim.emittedBytes = 0
+    sim.emittedPackets = 0
+
+    latencies = []
+    editDurations = []
+    events = 0
+    start = time.perf_counter()
+    for round in range(rounds):
+        sentAt = {}
+        for login, client in studentClients:
+            client.emit("answerUpdate", roomId, randomAnswers(widgets, rnd))
+            sentAt[login] = time.perf_counter()
+            events += 1
+
+        # Only answer deltas are attributed to the answer latency
+        deadline = time.perf_counter() + max(settle * 20, 5)
+        while len(sentAt) > 0 and time.perf_counter() < deadline:
+            sim.wait(0.005)
+            for event in sim.received(teachers[-1]):
+                if event["name"] != "roomDelta":
+                    continue
+                now = time.perf_counter()
+                for login in event["args"][0]["answers"].keys():
+                    if login in sentAt:
+                        latencies.append(now - sentAt.pop(login))
+        for client in teachers[:-1] + [c for _, c in studentClients]:
+            sim.received(client)
+
+        # A teacher edit in every round exercises the layout broadcast; it is
+        # measured separately once the answers are delivered
+        editStart = time.perf_counter()
+        teachers[0].emit("changeWidgetName", roomId, widgets[0]["id"],
+            "Question {}".format(round), callback=True)
+        editDurations.append(time.perf_counter() - editStart)
+        events += 1
+        sim.wait(settle)
+        for client in teachers + [c for _, c in studentClients]:
+            sim.received(client)
+    duration = time.perf_counter() - start
+
+    teachers[0].emit("deleteRoom", roomId, callback=True)
+    for client in teachers + [c for _, c in studentClients]:
+        client.disconnect()
+    sim.wait(settle)
+
+    return {
+        "room": roomType,
+        "students": studentCount,
+        "teachers": teacherCount,
+        "widgets": widgetCount,
+        "rounds": rounds,
+        "events": events,
+        "durationS": duration,
+        "eventsPerS": events / duration,
+        "latencyMs": {
+            "p50": percentile(latencies, 50) * 1000 if latencies else None,
+            "p95": percentile(latencies, 95) * 1000 if latencies else None,
+            "p99": percentile(latencies, 99) * 1000 if latencies else None
+        },
+        "layoutEditMs": {
+            "p50": percentile(editDurations, 50) * 1000,
+            "max": max(editDurations) * 1000
+        },
+        "missedUpdates": rounds * studentCount - len(latencies),
+        "emittedPackets": sim.emittedPackets,
+        "emittedBytes": sim.emittedBytes,
+        "emittedBytesPerEvent": sim.emittedBytes / events
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__,
+        formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--db", choices=["memory", "postgres"], default="memory",
+        help="database to run against, in-memory by default")
+    parser.add_argument("--dsn", help="libpq connection string of a scratch database")
+    parser.add_argument("--students", default="50,500,2000")
+    parser.add_argument("--teachers", type=int, default=2)
+    parser.add_argument("--rooms", default="choice,text", help="room types to simulate")
+    parser.add_argument("--widgets", type=int, default=10)
+    parser.add_argument("--rounds", type=int, default=5)
+    parser.add_argument("--broadcast-interval", type=float, default=0.15)
+    parser.add_argument("--output", help="append results to this file as well")
+    args = parser.parse_args()
+    if args.db == "postgres" and args.dsn is None:
+        parser.error("--db postgres requires --dsn")
+
+    with tempfile.NamedTemporaryFile("w", suffix=".py", delete=False) as config:
+        config.write("DB_CONNECTION = {!r}\n".format({"dsn": args.dsn} if args.dsn else {}))
+        config.write("BROADCAST_INTERVAL = {!r}\n".format(args.broadcast_interval))
+    os.environ["QUICKPOLL_SETTINGS"] = config.name
+
+    quickPoll = importServer(memoryDb.install if args.db == "memory" else None)
+    import quickPoll.encoding
+    app, socketio, db = quickPoll.app, quickPoll.socketio, quickPoll.db
+
+    sim = Simulation(app, socketio, quickPoll.encoding)
+    results = []
+    for roomType in args.rooms.split(","):
+        for studentCount in [int(x) for x in args.students.split(",")]:
+            result = runScenario(sim, db, roomType, studentCount, args.teachers,
+                args.rounds, args.widgets, args.broadcast_interval * 2)
+            report("classroom", result)
+            results.append(result)
+    if args.output:
+        with open(args.output, "a") as f:
+            for result in results:
+                f.write(json.dumps({"benchmark": "classroom", "results": result}) + "\n")
+    os.unlink(config.name)
+
+if __name__ == "__main__":
+    main()
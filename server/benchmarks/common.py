@@ -0,0 +1,41 @@
+import importlib.util
+import json
+import os
+import sys
+
+SERVER_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+def importModel():
+    """
+    Make the model modules (quickPoll.room, quickPoll.widgets, ...) importable
+    without running the package __init__, which boots the whole server
+    including the database connection
+    """
+    if "quickPoll" in sys.modules:
+        return
+    spec = importlib.util.spec_from_loader("quickPoll", loader=None, is_package=True)
+    package = importlib.util.module_from_spec(spec)
+    package.__path__ = [os.path.join(SERVER_DIR, "quickPoll")]
+    sys.modules["quickPoll"] = package
+
+def importServer(prepare=None):
+    """
+    Import the whole server. prepare is called once the package is
+    registered but before its __init__ boots the server, e.g., to replace the
+    database. Return the package.
+    """
+    path = os.path.join(SERVER_DIR, "quickPoll", "__init__.py")
+    spec = importlib.util.spec_from_file_location("quickPoll", path,
+        submodule_search_locations=[os.path.dirname(path)])
+    package = importlib.util.module_from_spec(spec)
+    sys.modules["quickPoll"] = package
+    if prepare is not None:
+        prepare()
+    spec.loader.exec_module(package)
+    return package
+
+def report(name, results):
+    """
+    Print results as a single machine readable JSON line
+    """
+    print(json.dumps({"benchmark": name, "results": results}))
@@ -0,0 +1,163 @@
+"""
+In-memory stand-in for the PostgreSQL database, so that the end-to-end
+benchmarks run without any infrastructure. MemoryPool replaces the connection
+pool and the database functions of quickPoll.dbFun are replaced by ones
+working on its tables. Rooms still go through the same row representation
+(dbFun.layoutRows) and are rebuilt by dbFun.buildRoom, but no time is spent
+in a database, so the results show the cost of the server alone.
+"""
+
+import json
+import socket
+
+class MemoryConnection:
+    """
+    Connection used by the member directory to LISTEN for invalidations. It
+    never receives a notification.
+    """
+    def __init__(self):
+        self.socket, self.peer = socket.socketpair()
+        self.autocommit = False
+        self.notifies = []
+
+    def fileno(self):
+        return self.socket.fileno()
+
+    def cursor(self):
+        return self
+
+    def execute(self, query, args=None):
+        pass
+
+    def poll(self):
+        pass
+
+class MemoryPool:
+    """
+    Replacement of quickPoll.dbPool.ConnectionPool holding the tables
+    """
+    def __init__(self, size=None, **connectionArgs):
+        self.rooms = {}
+        self.widgets = {}
+        self.choices = {}
+        self.answers = {}
+        self.people = {}
+        self.teachers = set()
+
+    def connect(self):
+        return MemoryConnection()
+
+    def transaction(self):
+        raise RuntimeError("The in-memory database does not execute SQL")
+
+def createTables(db):
+    pass
+
+def ping(db):
+    pass
+
+def loadRoomIndex(db):
+    return [{ "id": row[0], "name": row[1], "author": row[3] } for row in db.rooms.values()]
+
+def loadRoomLayout(db, roomId):
+    row = db.rooms.get(roomId, None)
+    if row is None:
+        return None
+    id, name, description, author, widgetIdCounter = row
+    widgetRows = sorted((x for x in db.widgets.values() if x[0] == roomId), key=lambda x: x[2])
+    widgets = [{
+            "id": widgetId,
+            "type": type,
+            "name": widgetName,
+            "description": widgetDescription,
+            "visible": visible,
+            "multiple": multiple,
+            "choices": []
+        } for _, widgetId, position, type, widgetName, widgetDescription, visible, multiple, _
+        in widgetRows]
+    byId = { w["id"]: w for w in widgets }
+    for _, widgetId, choiceId, position, text in sorted(
+            (x for x in db.choices.values() if x[0] == roomId), key=lambda x: (x[1], x[3])):
+        if widgetId in byId:
+            byId[widgetId]["choices"].append({ "id": choiceId, "text": text })
+    from quickPoll.dbFun import buildRoom
+    return buildRoom({
+        "id": id,
+        "name": name,
+        "description": description,
+        "author": author,
+        "layout": widgets,
+        "idCounters": {
+            "widgets": widgetIdCounter,
+            "choices": { str(x[1]): x[8] for x in widgetRows if x[8] is not None }
+        }
+    })
+
+def streamAnswers(db, roomId, batchSize=1000):
+    memberAnswers = {}
+    for (answerRoomId, login, widgetId), answer in sorted(db.answers.items()):
+        if answerRoomId == roomId:
+            memberAnswers.setdefault(login, {})[widgetId] = json.loads(answer)
+    return iter(memberAnswers.items())
+
+def loadRoom(db, roomId):
+    room = loadRoomLayout(db, roomId)
+    if room is None:
+        return None
+    for login, answers in streamAnswers(db, roomId):
+        room.restoreAnswers(login, answers)
+    return room
+
+def writeRooms(db, rooms=None, widgets=None, choices=None, deletedWidgets=None,
+        deletedChoices=None, deletedIds=None):
+    for row in rooms or []:
+        db.rooms[row[0]] = row
+    for key in deletedWidgets or []:
+        db.widgets.pop(tuple(key), None)
+    for key in deletedChoices or []:
+        db.choices.pop(tuple(key), None)
+    for row in widgets or []:
+        db.widgets[row[:2]] = row
+    for row in choices or []:
+        db.choices[row[:3]] = row
+    deletedIds = set(deletedIds or [])
+    if len(deletedIds) > 0:
+        for table in [db.rooms, db.widgets, db.choices, db.answers]:
+            for key in list(table.keys()):
+                if (key if table is db.rooms else key[0]) in deletedIds:
+                    del table[key]
+
+def writeAnswers(db, answers, deletedAnswers=None, deletedWidgets=None):
+    deletedWidgets = set(tuple(x) for x in deletedWidgets or [])
+    if len(deletedWidgets) > 0:
+        for key in list(db.answers.keys()):
+            if (key[0], key[2]) in deletedWidgets:
+                del db.answers[key]
+    for roomId, login, widgetId, answer in answers:
+        db.answers[(roomId, login, widgetId)] = json.dumps(answer)
+    for key in deletedAnswers or []:
+        db.answers.pop(tuple(key), None)
+
+def fetchPeople(db, logins):
+    people = {}
+    for login in logins:
+        name, uco = db.people.get(login, (None, None))
+        people[login] = {
+            "uco": uco,
+            "name": name,
+            "teacher": login in db.teachers,
+            "known": login in db.people
+        }
+    return people
+
+def install():
+    """
+    Replace the connection pool and the database functions. Has to be called
+    before the quickPoll package is initialized, see common.importServer.
+    """
+    import quickPoll.dbFun as dbFun
+    import quickPoll.dbPool as dbPool
+    dbPool.ConnectionPool = MemoryPool
+    for f in [createTables, ping, loadRoomIndex, loadRoomLayout, loadRoom, streamAnswers,
+            writeRooms, writeAnswers, fetchPeople]:
+        setattr(dbFun, f.__name__, f)
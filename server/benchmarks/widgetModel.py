@@ -0,0 +1,59 @@
+#!/usr/bin/env python3
+"""
+Micro-benchmark of the room/widget model: memory per room and the cost of
+widget and choice lookups and answer pruning.
+
+Usage: python3 -m benchmarks.widgetModel (from the server directory)
+"""
+
+import timeit
+import tracemalloc
+from benchmarks.common import importModel, report
+
+importModel()
+from quickPoll.room import Room
+from quickPoll.widgets import ChoiceWidget, TextWidget, Choice
+
+def buildRoom(widgetCount, choiceCount):
+    room = Room("bench", "Benchmark", "bench", "")
+    for i in range(widgetCount):
+        if i % 2 == 0:
+            room.addWidget(ChoiceWidget("Question", i % 4 == 0,
+                [Choice("Choice") for _ in range(choiceCount)]))
+        else:
+            room.addWidget(TextWidget("Question"))
+    return room
+
+def roomMemory(widgetCount, choiceCount, rooms=100):
+    tracemalloc.start()
+    before = tracemalloc.take_snapshot()
+    keep = [buildRoom(widgetCount, choiceCount) for _ in range(rooms)]
+    after = tracemalloc.take_snapshot()
+    tracemalloc.stop()
+    size = sum(x.size_diff for x in after.compare_to(before, "filename"))
+    return size // len(keep)
+
+def perCall(stmt, number):
+    return min(timeit.repeat(stmt, number=number, repeat=5)) / number * 1e9
+
+def main():
+    results = []
+    for widgetCount in [5, 20, 50]:
+        choiceCount = 6
+        room = buildRoom(widgetCount, choiceCount)
+        lastWidget = widgetCount if widgetCount % 2 == 1 else widgetCount - 1
+        choiceWidget = room.widget(1)
+        answers = { str(w.id): 1 if w.type() == "choice" and not w.multiple else
+            [1, 2] if w.type() == "choice" else "text" for w in room.widgets }
+        results.append({
+            "widgets": widgetCount,
+            "choices": choiceCount,
+            "roomBytes": roomMemory(widgetCount, choiceCount),
+            "widgetLookupNs": perCall(lambda: room.widget(lastWidget), 20000),
+            "choiceLookupNs": perCall(lambda: choiceWidget.choice(choiceCount), 20000),
+            "pruneAnswersNs": perCall(lambda: room.pruneAnswers(answers), 2000)
+        })
+    report("widgetModel", results)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,90 @@
+#!/usr/bin/env python3
+"""
+Size and encoding time of the full teacher room overview in the JSON and the
+columnar encoding (and MessagePack of both if the msgpack package is
+installed). The room has 10 single-choice, 5 multiple-choice and 5 text
+widgets and every member answered everything.
+
+Usage: python3 -m benchmarks.wireEncoding (from the server directory)
+"""
+
+import random
+import time
+import zlib
+from benchmarks.common import importModel, report
+from benchmarks.answerStore import buildRoom, randomAnswers
+
+importModel()
+import quickPoll.encoding as encoding
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+def buildOverview(memberCount):
+    rnd = random.Random(42)
+    room = buildRoom()
+    members = {}
+    for i in range(memberCount):
+        login = "xlogin{}".format(i)
+        room.restoreAnswers(login, randomAnswers(room, rnd))
+        members[login] = {
+            "uco": 400000 + i,
+            "name": "Student Name {}".format(i),
+            "teacher": False,
+            "active": rnd.random() < 0.8
+        }
+    return {
+        "status": "success",
+        "revision": 1,
+        "roomLayout": encoding.PreEncoded(room.encodedTeacherLayout()),
+        "answers": room.getMembersAnswers(),
+        "members": members
+    }
+
+def measure(encode, repeat=5):
+    """
+    Return the encoded payload and the best time of encode in milliseconds
+    """
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        payload = encode()
+        duration = time.perf_counter() - start
+        best = duration if best is None else min(best, duration)
+    return payload, best * 1000
+
+def variant(name, encode):
+    payload, ms = measure(encode)
+    if isinstance(payload, str):
+        payload = payload.encode("utf-8")
+    return {
+        "encoding": name,
+        "bytes": len(payload),
+        "deflatedBytes": len(zlib.compress(payload)),
+        "encodeMs": ms
+    }
+
+def main():
+    results = []
+    for memberCount in [100, 500, 2000]:
+        overview = buildOverview(memberCount)
+        plain = dict(overview, roomLayout=None)
+        variants = [
+            variant("json", lambda: encoding.dumps(overview, separators=(",", ":"))),
+            variant("columnar", lambda: encoding.dumps(encoding.columnarOverview(overview),
+                separators=(",", ":")))
+        ]
+        if msgpack is not None:
+            variants.append(variant("msgpack", lambda: msgpack.packb(plain)))
+            variants.append(variant("columnarMsgpack",
+                lambda: msgpack.packb(encoding.columnarOverview(plain))))
+        results.append({
+            "members": memberCount,
+            "variants": variants
+        })
+    report("wireEncoding", results)
+
+if __name__ == "__main__":
+    main()
@@ -1,13 +1,21 @@
+import os
 from flask import Flask
 from flask_socketio import SocketIO
-import psycopg2
 from quickPoll.dbFun import createTables
+from quickPoll.dbPool import ConnectionPool
+import quickPoll.encoding
+import quickPoll.metrics
 
 app = Flask(__name__, instance_relative_config=True)
-app.config.from_pyfile('config.py')
-socketio = SocketIO(app)
+app.config.from_pyfile('config.py', silent="QUICKPOLL_SETTINGS" in os.environ)
+# Alternative configuration, e.g., for benchmarks against a scratch database
+app.config.from_envvar("QUICKPOLL_SETTINGS", silent=True)
+socketio = SocketIO(app, json=quickPoll.encoding,
+    message_queue=app.config.get("SOCKETIO_MESSAGE_QUEUE", None))
+if app.config.get("METRICS_ENABLED", True):
+    quickPoll.metrics.instrument(socketio)
 
-db = psycopg2.connect(**app.config["DB_CONNECTION"])
+db = ConnectionPool(app.config.get("DB_POOL_SIZE", 10), **app.config["DB_CONNECTION"])
 createTables(db)
 
 import quickPoll.main
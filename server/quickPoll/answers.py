@@ -0,0 +1,263 @@
+from array import array
+import hashlib
+import json
+
+def answerHash(widgetId, answer):
+    """
+    Return a 64-bit hash of a single answer; the tag of a member's answers is
+    the XOR of the hashes of all of them, so it is updated per changed widget
+    """
+    if isinstance(answer, list):
+        # As stored by BitsetColumn
+        answer = sorted(set(answer))
+    encoded = json.dumps([widgetId, answer], separators=(",", ":")).encode("utf-8")
+    return int.from_bytes(hashlib.blake2b(encoded, digest_size=8).digest(), "big")
+
+class StringTable:
+    """
+    Interned strings with reference counts. Ids of strings nobody refers to
+    anymore are reused.
+    """
+    __slots__ = ("strings", "ids", "refs", "free")
+
+    def __init__(self):
+        self.strings = []
+        self.ids = {}
+        self.refs = array("l")
+        self.free = []
+
+    def acquire(self, string):
+        id = self.ids.get(string, None)
+        if id is None:
+            if len(self.free) > 0:
+                id = self.free.pop()
+                self.strings[id] = string
+            else:
+                id = len(self.strings)
+                self.strings.append(string)
+                self.refs.append(0)
+            self.ids[string] = id
+        self.refs[id] += 1
+        return id
+
+    def release(self, id):
+        self.refs[id] -= 1
+        if self.refs[id] == 0:
+            del self.ids[self.strings[id]]
+            self.strings[id] = None
+            self.free.append(id)
+
+    def get(self, id):
+        return self.strings[id]
+
+class IntColumn:
+    """
+    Single choice answers as choice ids
+    """
+    __slots__ = ("values",)
+    MISSING = -2 ** 63
+
+    def __init__(self):
+        self.values = array("q")
+
+    def get(self, slot):
+        if slot >= len(self.values) or self.values[slot] == self.MISSING:
+            return None
+        return self.values[slot]
+
+    def set(self, slot, value):
+        if slot >= len(self.values):
+            self.values.extend([self.MISSING] * (slot + 1 - len(self.values)))
+        self.values[slot] = self.MISSING if value is None else value
+
+class BitsetColumn:
+    """
+    Multiple choice answers as bitsets over choice ids. The values are kept in
+    a compact array with the top bit marking present answers while all ids
+    are below 63, and in a list of Python ints otherwise.
+    """
+    __slots__ = ("values",)
+    PRESENT = 1 << 63
+
+    def __init__(self):
+        self.values = array("Q")
+
+    def get(self, slot):
+        if slot >= len(self.values):
+            return None
+        value = self.values[slot]
+        if isinstance(self.values, array):
+            if value == 0:
+                return None
+            value ^= self.PRESENT
+        elif value is None:
+            return None
+        return [id for id in range(value.bit_length()) if value >> id & 1]
+
+    def set(self, slot, value):
+        bitset = None
+        if value is not None:
+            bitset = 0
+            for id in value:
+                bitset |= 1 << id
+        if isinstance(self.values, array):
+            if bitset is None or bitset < self.PRESENT:
+                if slot >= len(self.values):
+                    self.values.extend([0] * (slot + 1 - len(self.values)))
+                self.values[slot] = 0 if bitset is None else bitset | self.PRESENT
+                return
+            self.values = [None if x == 0 else x ^ self.PRESENT for x in self.values]
+        if slot >= len(self.values):
+            self.values.extend([None] * (slot + 1 - len(self.values)))
+        self.values[slot] = bitset
+
+class TextColumn:
+    """
+    Text answers as ids to a string table shared by the whole room
+    """
+    __slots__ = ("values", "strings")
+    MISSING = -1
+
+    def __init__(self, strings):
+        self.values = array("l")
+        self.strings = strings
+
+    def get(self, slot):
+        if slot >= len(self.values) or self.values[slot] == self.MISSING:
+            return None
+        return self.strings.get(self.values[slot])
+
+    def set(self, slot, value):
+        if slot >= len(self.values):
+            self.values.extend([self.MISSING] * (slot + 1 - len(self.values)))
+        if self.values[slot] != self.MISSING:
+            self.strings.release(self.values[slot])
+        self.values[slot] = self.MISSING if value is None else self.strings.acquire(value)
+
+    def clear(self):
+        for id in self.values:
+            if id != self.MISSING:
+                self.strings.release(id)
+
+class AnswerStore:
+    """
+    Compact columnar storage of member answers of a room. Each member gets a
+    slot and each widget column stores answers indexed by the slot. The column
+    type is chosen by the answer value: int (single choice), list (multiple
+    choice) or str (text).
+    """
+    __slots__ = ("slots", "columns", "strings", "tags")
+
+    def __init__(self):
+        self.slots = {}
+        # Widget id -> {value type: column}
+        self.columns = {}
+        self.strings = StringTable()
+        # Slot -> XOR of answerHash of all answers of the member
+        self.tags = array("Q")
+
+    def newColumn(self, valueType):
+        if valueType is int:
+            return IntColumn()
+        if valueType is list:
+            return BitsetColumn()
+        if valueType is str:
+            return TextColumn(self.strings)
+        raise RuntimeError("Unsupported answer type " + valueType.__name__)
+
+    def __contains__(self, username):
+        return username in self.slots
+
+    def usernames(self):
+        return self.slots.keys()
+
+    def get(self, username):
+        """
+        Return answers of the member as a dictionary widget id -> answer
+        """
+        slot = self.slots.get(username, None)
+        if slot is None:
+            return {}
+        answers = {}
+        for widgetId, columns in self.columns.items():
+            for column in columns.values():
+                value = column.get(slot)
+                if value is not None:
+                    answers[widgetId] = value
+                    break
+        return answers
+
+    def getAnswer(self, username, widgetId):
+        """
+        Return answer of the member for a single widget or None
+        """
+        slot = self.slots.get(username, None)
+        if slot is None:
+            return None
+        for column in self.columns.get(widgetId, {}).values():
+            value = column.get(slot)
+            if value is not None:
+                return value
+        return None
+
+    def update(self, username, changes):
+        """
+        Update member answers by changes: widget id -> answer or None to
+        remove the answer
+        """
+        slot = self.slots.setdefault(username, len(self.slots))
+        if slot == len(self.tags):
+            self.tags.append(0)
+        for widgetId, value in changes.items():
+            old = self.getAnswer(username, widgetId)
+            if old == value:
+                continue
+            if old is not None:
+                self.tags[slot] ^= answerHash(widgetId, old)
+            if value is not None:
+                self.tags[slot] ^= answerHash(widgetId, value)
+            columns = self.columns.setdefault(widgetId, {})
+            for valueType, column in columns.items():
+                if valueType is not type(value):
+                    column.set(slot, None)
+            if value is not None:
+                if type(value) not in columns:
+                    columns[type(value)] = self.newColumn(type(value))
+                columns[type(value)].set(slot, value)
+
+    def widgetAnswers(self, widgetId):
+        """
+        Iterate over all present answers for given widget
+        """
+        for column in self.columns.get(widgetId, {}).values():
+            for slot in range(len(column.values)):
+                value = column.get(slot)
+                if value is not None:
+                    yield value
+
+    def memberAnswers(self, widgetId):
+        """
+        Iterate over (username, answer) of members who answered given widget
+        """
+        columns = self.columns.get(widgetId, {})
+        for username, slot in self.slots.items():
+            for column in columns.values():
+                value = column.get(slot)
+                if value is not None:
+                    yield username, value
+                    break
+
+    def tag(self, username):
+        """
+        Return a tag identifying the answers of the member, equal for equal
+        answers regardless of the order of changes
+        """
+        slot = self.slots.get(username, None)
+        return "{:016x}".format(0 if slot is None else self.tags[slot])
+
+    def dropWidget(self, widgetId):
+        for username, answer in list(self.memberAnswers(widgetId)):
+            self.tags[self.slots[username]] ^= answerHash(widgetId, answer)
+        for column in self.columns.pop(widgetId, {}).values():
+            if isinstance(column, TextColumn):
+                column.clear()
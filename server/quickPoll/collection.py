@@ -0,0 +1,35 @@
+class IndexedList:
+    """
+    Ordered collection of objects with an unique id attribute. Lookup,
+    appending and deletion by id take constant time, reordering is linear.
+    """
+    __slots__ = ("items",)
+
+    def __init__(self, items=[]):
+        self.items = {}
+        for item in items:
+            self.append(item)
+
+    def __iter__(self):
+        return iter(self.items.values())
+
+    def __len__(self):
+        return len(self.items)
+
+    def get(self, id):
+        return self.items.get(id, None)
+
+    def ids(self):
+        return self.items.keys()
+
+    def append(self, item):
+        self.items[item.id] = item
+
+    def remove(self, id):
+        """
+        Remove item with given id, return it or None if there is no such item
+        """
+        return self.items.pop(id, None)
+
+    def reorder(self, idList):
+        self.items = { id: self.items[id] for id in idList }
@@ -1,18 +1,44 @@
 from quickPoll.room import Room
 from quickPoll.widgets import TextWidget, ChoiceWidget, Choice
+from quickPoll.metrics import timedQuery
 import psycopg2.extras
 import json
 
+# Key of the advisory lock serializing schema migrations of several workers
+MIGRATION_LOCK = 0x717569636b
+@timedQuery
 def createTables(db):
-    try:
-        cursor = db.cursor(cursor_factory=psycopg2.extras.DictCursor)
+    with db.transaction() as cursor:
+        cursor.execute("SELECT pg_advisory_xact_lock(%s);", [MIGRATION_LOCK])
         cursor.execute("""
             CREATE TABLE IF NOT EXISTS rooms (
                 id VARCHAR(64) NOT NULL PRIMARY KEY,
                 name TEXT NOT NULL,
                 description TEXT NOT NULL,
                 author VARCHAR(64) NOT NULL,
-                layout json NOT NULL
+                widget_id_counter INTEGER NOT NULL DEFAULT 0
+            );""")
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS widgets (
+                room_id VARCHAR(64) NOT NULL,
+                widget_id INTEGER NOT NULL,
+                position INTEGER NOT NULL,
+                type VARCHAR(16) NOT NULL,
+                name TEXT NOT NULL,
+                description TEXT NOT NULL,
+                visible BOOLEAN NOT NULL,
+                multiple BOOLEAN,
+                choice_id_counter INTEGER,
+                PRIMARY KEY (room_id, widget_id)
+            );""")
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS choices (
+                room_id VARCHAR(64) NOT NULL,
+                widget_id INTEGER NOT NULL,
+                choice_id INTEGER NOT NULL,
+                position INTEGER NOT NULL,
+                text TEXT NOT NULL,
+                PRIMARY KEY (room_id, widget_id, choice_id)
             );""")
         cursor.execute("""
             CREATE TABLE IF NOT EXISTS people (
@@ -24,15 +50,81 @@ def createTables(db):
             CREATE TABLE IF NOT EXISTS teachers (
                 login VARCHAR(32) NOT NULL PRIMARY KEY
             );""")
-    except Exception as e:
-        db.rollback()
-        raise
-    else:
-        db.commit()
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS answers (
+                room_id VARCHAR(64) NOT NULL,
+                login VARCHAR(32) NOT NULL,
+                widget_id INTEGER NOT NULL,
+                answer json NOT NULL,
+                PRIMARY KEY (room_id, login, widget_id)
+            );""")
+        cursor.execute("""
+            SELECT 1 FROM information_schema.columns
+                WHERE table_schema = current_schema()
+                    AND table_name = 'rooms' AND column_name = 'layout';""")
+        if cursor.fetchone() is not None:
+            migrateLayouts(cursor)
+        cursor.execute("""
+            SELECT 1 FROM information_schema.columns
+                WHERE table_schema = current_schema()
+                    AND table_name = 'rooms' AND column_name = 'widget_id_counter';""")
+        if cursor.fetchone() is None:
+            migrateIdCounters(cursor)
+
+def migrateLayouts(cursor):
+    """
+    One-time migration of widgets stored as JSON in rooms.layout to the
+    widgets and choices tables
+    """
+    cursor.execute("""
+        INSERT INTO widgets (room_id, widget_id, position, type, name,
+                description, visible, multiple)
+            SELECT r.id, (w.widget->>'id')::INTEGER, w.position - 1,
+                    w.widget->>'type', w.widget->>'name',
+                    w.widget->>'description', (w.widget->>'visible')::BOOLEAN,
+                    (w.widget->>'multiple')::BOOLEAN
+                FROM rooms AS r
+                CROSS JOIN LATERAL json_array_elements(r.layout)
+                    WITH ORDINALITY AS w(widget, position)
+            ON CONFLICT DO NOTHING;""")
+    cursor.execute("""
+        INSERT INTO choices (room_id, widget_id, choice_id, position, text)
+            SELECT r.id, (w.widget->>'id')::INTEGER, (c.choice->>'id')::INTEGER,
+                    c.position - 1, c.choice->>'text'
+                FROM rooms AS r
+                CROSS JOIN LATERAL json_array_elements(r.layout) AS w(widget)
+                CROSS JOIN LATERAL json_array_elements(
+                        CASE WHEN w.widget->>'type' = 'choice'
+                            THEN w.widget->'choices' ELSE '[]'::json END)
+                    WITH ORDINALITY AS c(choice, position)
+            ON CONFLICT DO NOTHING;""")
+    cursor.execute("ALTER TABLE rooms DROP COLUMN layout;")
+
+def migrateIdCounters(cursor):
+    """
+    One-time migration adding the id counters. Stored answers may still refer
+    to deleted widgets, so the widget counter starts above their ids.
+    """
+    cursor.execute("""
+        ALTER TABLE rooms
+            ADD COLUMN widget_id_counter INTEGER NOT NULL DEFAULT 0;""")
+    cursor.execute("""
+        ALTER TABLE widgets ADD COLUMN choice_id_counter INTEGER;""")
+    cursor.execute("""
+        UPDATE rooms SET widget_id_counter = a.widget_id
+            FROM (SELECT room_id, MAX(widget_id) AS widget_id
+                    FROM answers GROUP BY room_id) AS a
+            WHERE rooms.id = a.room_id;""")
+
+def buildChoice(dict):
+    ch = Choice(dict["text"])
+    ch.id = dict["id"]
+    return ch
 
 def buildChoiceWidget(dict):
-    w = ChoiceWidget(dict["name"], dict["multiple"],
-        [Choice(x["text"]) for x in dict["choices"]])
+    w = ChoiceWidget(dict["name"], dict["multiple"], [])
+    for x in dict["choices"]:
+        w.addChoice(buildChoice(x), keepId=True)
     w.id = dict["id"]
     w.visible = dict["visible"]
     w.description = dict["description"]
@@ -45,85 +137,259 @@ def buildTextWidget(dict):
     w.description = dict["description"]
     return w
 
+def buildWidget(dict):
+    if dict["type"] == "choice":
+        return buildChoiceWidget(dict)
+    if dict["type"] == "text":
+        return buildTextWidget(dict)
+    raise RuntimeError("Unknow widget type " + dict["type"])
+
 def buildRoom(dict):
     r = Room(dict["id"], dict["name"], dict["author"], dict["description"])
     for widgetLayout in dict["layout"]:
-        if widgetLayout["type"] == "choice":
-            w = buildChoiceWidget(widgetLayout)
-        elif widgetLayout["type"] == "text":
-            w = buildTextWidget(widgetLayout)
-        else:
-            raise RuntimeError("Unknow widget type " + widgetLayout["type"])
-        r.addWidget(w)
+        r.addWidget(buildWidget(widgetLayout), keepId=True)
+    if "idCounters" in dict:
+        r.restoreIdCounters(dict["idCounters"])
     return r
 
-def loadRooms(db):
+@timedQuery
+def ping(db):
+    with db.transaction() as cursor:
+        cursor.execute("SELECT 1")
+
+@timedQuery
+def loadRoomIndex(db):
     """
-    Get all rooms
+    Get summaries (id, name, author) of all rooms without building them
     """
-    cursor = db.cursor(cursor_factory=psycopg2.extras.DictCursor)
-    cursor.execute("SELECT * from rooms")
-    return [buildRoom(x) for x in cursor]
+    with db.transaction() as cursor:
+        cursor.execute("SELECT id, name, author FROM rooms")
+        return [{ "id": x["id"], "name": x["name"], "author": x["author"] } for x in cursor]
 
-def updateRoom(db, room):
+def layoutRows(room):
     """
-    Update given room in database
+    Return database rows of the room: the room row, widget rows by widget id
+    and choice rows by (widget id, choice id)
     """
     l = room.teacherLayout()
-    try:
-        cursor = db.cursor(cursor_factory=psycopg2.extras.DictCursor)
+    counters = room.idCounters()
+    widgets = {}
+    choices = {}
+    for position, w in enumerate(l["widgets"]):
+        widgets[w["id"]] = (l["id"], w["id"], position, w["type"], w["name"],
+            w["description"], w["visible"], w.get("multiple", None),
+            counters["choices"].get(str(w["id"]), None))
+        for choicePosition, ch in enumerate(w.get("choices", [])):
+            choices[(w["id"], ch["id"])] = (l["id"], w["id"], ch["id"],
+                choicePosition, ch["text"])
+    return (l["id"], l["name"], l["description"], l["author"],
+        counters["widgets"]), widgets, choices
+
+def readLayout(cursor, roomId):
+    """
+    Build the room without answers, None if there is no such room
+    """
+    cursor.execute("SELECT * FROM rooms WHERE id = %s", [roomId])
+    row = cursor.fetchone()
+    if row is None:
+        return None
+    cursor.execute("""
+        SELECT widget_id, type, name, description, visible, multiple,
+                choice_id_counter
+            FROM widgets WHERE room_id = %s ORDER BY position;""", [roomId])
+    rows = cursor.fetchall()
+    widgets = [{
+            "id": x["widget_id"],
+            "type": x["type"],
+            "name": x["name"],
+            "description": x["description"],
+            "visible": x["visible"],
+            "multiple": x["multiple"],
+            "choices": []
+        } for x in rows]
+    byId = { w["id"]: w for w in widgets }
+    cursor.execute("""
+        SELECT widget_id, choice_id, text FROM choices
+            WHERE room_id = %s ORDER BY widget_id, position;""", [roomId])
+    for x in cursor:
+        widget = byId.get(x["widget_id"], None)
+        if widget is not None:
+            widget["choices"].append({ "id": x["choice_id"], "text": x["text"] })
+    return buildRoom(dict(row, layout=widgets, idCounters={
+        "widgets": row["widget_id_counter"],
+        "choices": { str(x["widget_id"]): x["choice_id_counter"] for x in rows
+            if x["choice_id_counter"] is not None }
+    }))
+
+@timedQuery
+def loadRoomLayout(db, roomId):
+    """
+    Get a single room without the member answers, None if there is no such
+    room
+    """
+    with db.transaction() as cursor:
+        return readLayout(cursor, roomId)
+
+@timedQuery
+def loadRoom(db, roomId):
+    """
+    Get a single room including the stored member answers, None if there is
+    no such room
+    """
+    with db.transaction() as cursor:
+        room = readLayout(cursor, roomId)
+        if room is None:
+            return None
+        cursor.execute("""
+            SELECT login, widget_id, answer FROM answers
+                WHERE room_id = %s ORDER BY login;""", [roomId])
+        memberAnswers = {}
+        for x in cursor:
+            memberAnswers.setdefault(x["login"], {})[str(x["widget_id"])] = x["answer"]
+    for login, answers in memberAnswers.items():
+        room.restoreAnswers(login, answers)
+    return room
+
+def streamAnswers(db, roomId, batchSize=1000):
+    """
+    Yield (login, answers by widget id) of the stored answers of the room.
+    Rows are read from a server-side cursor in batches, so memory use does
+    not depend on the number of members.
+    """
+    with db.transaction(name="streamAnswers") as cursor:
+        cursor.itersize = batchSize
         cursor.execute("""
-            INSERT INTO rooms (id, name, description, author, layout)
-                VALUES (%s, %s, %s, %s, %s)
-                ON CONFLICT (id) DO UPDATE
-                SET name = excluded.name,
-                    description = excluded.description,
-                    author = excluded.author,
-                    layout = excluded.layout;
-            """, [
-                l["id"],
-                l["name"],
-                l["description"],
-                l["author"],
-                json.dumps(l["widgets"])
-            ])
-    except Exception as e:
-        db.rollback()
-        raise
-    else:
-        db.commit()
+            SELECT login, widget_id, answer FROM answers
+                WHERE room_id = %s ORDER BY login;""", [roomId])
+        login, answers = None, {}
+        for x in cursor:
+            if x["login"] != login:
+                if login is not None:
+                    yield login, answers
+                login, answers = x["login"], {}
+            answers[x["widget_id"]] = x["answer"]
+        if login is not None:
+            yield login, answers
+
+@timedQuery
+def writeRooms(db, rooms=None, widgets=None, choices=None, deletedWidgets=None,
+        deletedChoices=None, deletedIds=None):
+    """
+    Write changed rows in a single transaction: room rows, widget and choice
+    rows as produced by layoutRows, keys (room id, widget id) and (room id,
+    widget id, choice id) of deleted widgets and choices, and ids of deleted
+    rooms
+    """
+    rooms = rooms or []
+    widgets = widgets or []
+    choices = choices or []
+    deletedWidgets = deletedWidgets or []
+    deletedChoices = deletedChoices or []
+    deletedIds = deletedIds or []
+    with db.transaction() as cursor:
+        if len(rooms) > 0:
+            psycopg2.extras.execute_values(cursor, """
+                INSERT INTO rooms (id, name, description, author, widget_id_counter)
+                    VALUES %s
+                    ON CONFLICT (id) DO UPDATE
+                    SET name = excluded.name,
+                        description = excluded.description,
+                        author = excluded.author,
+                        widget_id_counter = excluded.widget_id_counter;
+                """, rooms)
+        if len(deletedWidgets) > 0:
+            psycopg2.extras.execute_values(cursor, """
+                DELETE FROM widgets WHERE (room_id, widget_id) IN (VALUES %s);
+                """, deletedWidgets)
+        if len(deletedChoices) > 0:
+            psycopg2.extras.execute_values(cursor, """
+                DELETE FROM choices
+                    WHERE (room_id, widget_id, choice_id) IN (VALUES %s);
+                """, deletedChoices)
+        if len(widgets) > 0:
+            psycopg2.extras.execute_values(cursor, """
+                INSERT INTO widgets (room_id, widget_id, position, type, name,
+                        description, visible, multiple, choice_id_counter)
+                    VALUES %s
+                    ON CONFLICT (room_id, widget_id) DO UPDATE
+                    SET position = excluded.position,
+                        type = excluded.type,
+                        name = excluded.name,
+                        description = excluded.description,
+                        visible = excluded.visible,
+                        multiple = excluded.multiple,
+                        choice_id_counter = excluded.choice_id_counter;
+                """, widgets)
+        if len(choices) > 0:
+            psycopg2.extras.execute_values(cursor, """
+                INSERT INTO choices (room_id, widget_id, choice_id, position, text)
+                    VALUES %s
+                    ON CONFLICT (room_id, widget_id, choice_id) DO UPDATE
+                    SET position = excluded.position,
+                        text = excluded.text;
+                """, choices)
+        if len(deletedIds) > 0:
+            for table in ["rooms", "widgets", "choices", "answers"]:
+                column = "id" if table == "rooms" else "room_id"
+                cursor.execute("DELETE FROM {} WHERE {} = ANY(%s);".format(table, column),
+                    [list(deletedIds)])
+
+def updateRoom(db, room):
+    """
+    Write the whole room to the database, e.g., a newly created one
+    """
+    roomRow, widgets, choices = layoutRows(room)
+    writeRooms(db, [roomRow], list(widgets.values()), list(choices.values()))
 
 def deleteRoom(db, roomId):
-    try:
-        cursor = db.cursor(cursor_factory=psycopg2.extras.DictCursor)
-        cursor.execute("DELETE FROM rooms WHERE id = %s;", [roomId])
-    except Exception as e:
-        db.rollback()
-        raise
-    else:
-        db.commit()
+    writeRooms(db, deletedIds=[roomId])
+
+@timedQuery
+def writeAnswers(db, answers, deletedAnswers=None, deletedWidgets=None):
+    """
+    Store answers given as (room id, login, widget id, answer), delete
+    answers given as (room id, login, widget id) and all answers of widgets
+    given as (room id, widget id) in a single transaction
+    """
+    with db.transaction() as cursor:
+        if deletedWidgets:
+            psycopg2.extras.execute_values(cursor, """
+                DELETE FROM answers
+                    WHERE (room_id, widget_id) IN (VALUES %s);
+                """, deletedWidgets)
+        if len(answers) > 0:
+            psycopg2.extras.execute_values(cursor, """
+                INSERT INTO answers (room_id, login, widget_id, answer)
+                    VALUES %s
+                    ON CONFLICT (room_id, login, widget_id) DO UPDATE
+                    SET answer = excluded.answer;
+                """, [(r, l, w, json.dumps(a)) for r, l, w, a in answers])
+        if deletedAnswers:
+            psycopg2.extras.execute_values(cursor, """
+                DELETE FROM answers
+                    WHERE (room_id, login, widget_id) IN (VALUES %s);
+                """, deletedAnswers)
 
-def memberInfo(db, members, activeMembers):
+@timedQuery
+def fetchPeople(db, logins):
     """
-    Collect information (real name, UČO teacher status) for given members
+    Collect information (real name, UČO, teacher status) for given logins.
+    Logins missing in the people table are reported with known = False.
     """
-    if len(members) == 0:
+    if len(logins) == 0:
         return {}
-    try:
-        cursor = db.cursor(cursor_factory=psycopg2.extras.DictCursor)
+    with db.transaction() as cursor:
         cursor.execute("""
-                SELECT * from people
-            LEFT JOIN
-                (SELECT login, True as teacher FROM teachers) as t
-            USING (login)
-            WHERE login in %s;""",
-            [tuple(members)])
+                SELECT l.login, p.name, p.uco,
+                    p.login IS NOT NULL AS known,
+                    t.login IS NOT NULL AS teacher
+                FROM unnest(%s) AS l(login)
+            LEFT JOIN people AS p ON p.login = l.login
+            LEFT JOIN teachers AS t ON t.login = l.login;""",
+            [list(logins)])
         return { x["login"]: {
                 "uco": x["uco"],
                 "name": x["name"],
-                "teacher": bool(x["teacher"]),
-                "active": x["login"] in activeMembers
+                "teacher": x["teacher"],
+                "known": x["known"]
             } for x in cursor }
-    except Exception as e:
-        db.rollback()
-        raise
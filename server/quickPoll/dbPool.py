@@ -0,0 +1,95 @@
+from contextlib import contextmanager
+import time
+import psycopg2
+import psycopg2.extensions
+import psycopg2.extras
+import gevent.lock
+import gevent.queue
+import gevent.socket
+
+def geventWaitCallback(conn, timeout=None):
+    """
+    Wait for a query by yielding to other greenlets instead of blocking the
+    whole event loop
+    """
+    while True:
+        state = conn.poll()
+        if state == psycopg2.extensions.POLL_OK:
+            break
+        elif state == psycopg2.extensions.POLL_READ:
+            gevent.socket.wait_read(conn.fileno(), timeout=timeout)
+        elif state == psycopg2.extensions.POLL_WRITE:
+            gevent.socket.wait_write(conn.fileno(), timeout=timeout)
+        else:
+            raise psycopg2.OperationalError("Bad result from poll: {}".format(state))
+
+class ConnectionPool:
+    """
+    Bounded pool of database connections shared by greenlets. Each operation
+    checks out its own connection; when the pool is exhausted, the greenlet
+    waits for a connection to be returned. Broken connections are discarded
+    and replaced by new ones.
+    """
+    def __init__(self, size, pingAfter=60, **connectionArgs):
+        self.slots = gevent.lock.BoundedSemaphore(size)
+        self.idle = gevent.queue.LifoQueue()
+        self.pingAfter = pingAfter
+        self.connectionArgs = connectionArgs
+        psycopg2.extensions.set_wait_callback(geventWaitCallback)
+
+    def connect(self):
+        """
+        Open a new connection outside of the pool
+        """
+        return psycopg2.connect(**self.connectionArgs)
+
+    def isHealthy(self, conn, idleSince):
+        if conn.closed:
+            return False
+        if time.monotonic() - idleSince < self.pingAfter:
+            return True
+        try:
+            conn.cursor().execute("SELECT 1")
+            conn.rollback()
+            return True
+        except psycopg2.Error:
+            return False
+
+    def acquire(self):
+        self.slots.acquire()
+        try:
+            while not self.idle.empty():
+                conn, idleSince = self.idle.get_nowait()
+                if self.isHealthy(conn, idleSince):
+                    return conn
+                conn.close()
+            return self.connect()
+        except BaseException:
+            self.slots.release()
+            raise
+
+    def release(self, conn):
+        if not conn.closed:
+            self.idle.put((conn, time.monotonic()))
+        self.slots.release()
+
+    @contextmanager
+    def transaction(self, name=None):
+        """
+        Check out a connection and provide a dictionary cursor. The transaction
+        is committed when the block finishes and rolled back on exception.
+        A named cursor is a server-side one fetching rows in batches.
+        """
+        conn = self.acquire()
+        try:
+            yield conn.cursor(name=name, cursor_factory=psycopg2.extras.DictCursor)
+            conn.commit()
+        except BaseException:
+            if not conn.closed:
+                try:
+                    conn.rollback()
+                except psycopg2.Error:
+                    conn.close()
+            raise
+        finally:
+            self.release(conn)
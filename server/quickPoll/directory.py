@@ -0,0 +1,107 @@
+from collections import OrderedDict
+import time
+import sys
+import gevent.select
+
+INVALIDATION_CHANNEL = "quickpoll_directory"
+
+class MemberDirectory:
+    """
+    In-process cache of people and teachers. Entries expire after ttl seconds
+    and the least recently used entries are evicted when the cache is full.
+    Unknown logins are cached too, so repeated lookups never reach the
+    database.
+    """
+    def __init__(self, fetch, maxSize=10000, ttl=600):
+        """
+        fetch takes a list of logins and returns a dictionary login ->
+        {"uco", "name", "teacher", "known"} for all of them
+        """
+        self.fetch = fetch
+        self.maxSize = maxSize
+        self.ttl = ttl
+        self.entries = OrderedDict()
+
+    def lookup(self, logins):
+        """
+        Return records for given logins, fetching missing ones in a single
+        batch
+        """
+        now = time.monotonic()
+        result = {}
+        missing = []
+        for login in logins:
+            entry = self.entries.get(login, None)
+            if entry is None or entry[0] < now:
+                missing.append(login)
+                continue
+            self.entries.move_to_end(login)
+            result[login] = entry[1]
+        if len(missing) > 0:
+            fetched = self.fetch(missing)
+            expires = now + self.ttl
+            for login in missing:
+                record = fetched.get(login, None)
+                if record is None:
+                    record = { "uco": None, "name": None, "teacher": False, "known": False }
+                self.entries[login] = (expires, record)
+                self.entries.move_to_end(login)
+                result[login] = record
+            while len(self.entries) > self.maxSize:
+                self.entries.popitem(last=False)
+        return result
+
+    def prefetch(self, logins):
+        """
+        Load records of given logins in a single batch, e.g., of all members
+        of a room, so that their later lookups hit the cache
+        """
+        self.lookup(logins)
+
+    def isTeacher(self, login):
+        return self.lookup([login])[login]["teacher"]
+
+    def memberInfo(self, members, activeMembers):
+        """
+        Collect information (real name, UČO teacher status) for given members
+        """
+        return { login: {
+                "uco": record["uco"],
+                "name": record["name"],
+                "teacher": record["teacher"],
+                "active": login in activeMembers
+            } for login, record in self.lookup(members).items() if record["known"] }
+
+    def invalidate(self, logins=None):
+        """
+        Drop given logins from the cache, or all of them if logins is None
+        """
+        if logins is None:
+            self.entries.clear()
+            return
+        for login in logins:
+            self.entries.pop(login, None)
+
+    def listen(self, connect, sleep, retryDelay=10):
+        """
+        Invalidate the cache on NOTIFY to INVALIDATION_CHANNEL. The payload is
+        an optional comma separated list of logins. Runs forever, reconnecting
+        on failure.
+        """
+        while True:
+            try:
+                conn = connect()
+                conn.autocommit = True
+                conn.cursor().execute("LISTEN " + INVALIDATION_CHANNEL)
+                # Changes made while we were not listening are unknown
+                self.invalidate()
+                while True:
+                    gevent.select.select([conn], [], [])
+                    conn.poll()
+                    while conn.notifies:
+                        payload = conn.notifies.pop(0).payload
+                        logins = [x for x in payload.split(",") if x] if payload else None
+                        self.invalidate(logins)
+            except Exception as e:
+                print("Warning, directory listener failed: {}".format(e), file=sys.stderr)
+            sleep(retryDelay)
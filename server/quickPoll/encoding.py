@@ -0,0 +1,71 @@
+import json
+import re
+import uuid
+
+class PreEncoded:
+    """
+    Value already encoded as JSON, e.g., a cached room layout. It is spliced
+    into the packet verbatim instead of being encoded again.
+    """
+    def __init__(self, json):
+        self.json = json
+
+# Called with the size of every encoded value, see quickPoll.metrics
+observer = None
+
+def dumps(obj, **kwargs):
+    """
+    json.dumps supporting PreEncoded values. Used as the Socket.IO JSON module.
+    """
+    fragments = []
+    token = uuid.uuid4().hex
+
+    def default(o):
+        if isinstance(o, PreEncoded):
+            fragments.append(o.json)
+            return "{}:{}".format(token, len(fragments) - 1)
+        raise TypeError("Object of type {} is not JSON serializable".format(type(o).__name__))
+
+    encoded = json.dumps(obj, default=default, **kwargs)
+    if len(fragments) > 0:
+        encoded = re.sub('"{}:([0-9]+)"'.format(token),
+            lambda m: fragments[int(m.group(1))], encoded)
+    if observer is not None:
+        observer(len(encoded))
+    return encoded
+
+loads = json.loads
+
+# Encodings a client can negotiate, in the order of preference
+ENCODINGS = ("columnar", "json")
+
+MEMBER_FIELDS = ("uco", "name", "teacher", "active")
+
+def columnarOverview(overview):
+    """
+    Return the teacher room overview with member answers and info as aligned
+    arrays instead of per-member objects. Keys are sent once per room instead
+    of once per member: answers are a column per widget id with None for
+    missing answers and "known" marks members with info.
+    """
+    answers = overview["answers"]
+    members = overview["members"]
+    logins = list(answers.keys())
+    memberAnswers = list(answers.values())
+    widgetIds = set()
+    for a in memberAnswers:
+        widgetIds.update(a.keys())
+    infos = [members.get(login, None) for login in logins]
+    columns = {
+        "login": logins,
+        "answers": { widgetId: [a.get(widgetId, None) for a in memberAnswers]
+            for widgetId in widgetIds },
+        "known": [info is not None for info in infos]
+    }
+    for field in MEMBER_FIELDS:
+        columns[field] = [None if info is None else info[field] for info in infos]
+    result = { key: value for key, value in overview.items()
+        if key not in ("answers", "members") }
+    result["encoding"] = "columnar"
+    result["columns"] = columns
+    return result
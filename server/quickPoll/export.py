@@ -0,0 +1,66 @@
+import csv
+import io
+import itertools
+import json
+
+CSV_HEADER = ["room", "roomName", "login", "name", "uco", "widget", "question", "answer"]
+
+def memberBatches(memberAnswers, fetchPeople, batchSize):
+    """
+    Yield (login, answers) pairs in batches as lists of (login, info,
+    answers). Member info is fetched with one query per batch.
+    """
+    memberAnswers = iter(memberAnswers)
+    while True:
+        batch = list(itertools.islice(memberAnswers, batchSize))
+        if len(batch) == 0:
+            return
+        people = fetchPeople([login for login, _ in batch])
+        yield [(login, people.get(login, {}), answers) for login, answers in batch]
+
+def exportCsv(rooms, fetchPeople, batchSize=500):
+    """
+    Generate CSV lines with one row per member and widget. Rooms are given
+    as (room, iterable of (login, answers by widget id)); the answers are
+    consumed lazily.
+    """
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+
+    def flush():
+        value = buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+        return value
+
+    writer.writerow(CSV_HEADER)
+    yield flush()
+    for room, memberAnswers in rooms:
+        widgets = list(room.widgets)
+        for batch in memberBatches(memberAnswers, fetchPeople, batchSize):
+            for login, info, answers in batch:
+                for widget in widgets:
+                    writer.writerow([room.id, room.name, login, info.get("name"),
+                        info.get("uco"), widget.id, widget.name,
+                        widget.answerText(answers.get(widget.id, None))])
+            yield flush()
+
+def exportJsonLines(rooms, fetchPeople, batchSize=500):
+    """
+    Generate JSON lines: a "room" record with the layout of each room
+    followed by a "member" record for each of its members, see exportCsv
+    """
+    for room, memberAnswers in rooms:
+        yield json.dumps({
+            "type": "room",
+            "layout": room.teacherLayout()
+        }, ensure_ascii=False) + "\n"
+        for batch in memberBatches(memberAnswers, fetchPeople, batchSize):
+            yield "".join(json.dumps({
+                "type": "member",
+                "room": room.id,
+                "login": login,
+                "name": info.get("name"),
+                "uco": info.get("uco"),
+                "answers": answers
+            }, ensure_ascii=False) + "\n" for login, info, answers in batch)
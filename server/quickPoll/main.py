@@ -1,13 +1,22 @@
 from quickPoll import app, socketio, db
 
-from flask import request
+from flask import request, Response
 from flask_socketio import join_room, leave_room, close_room
-from copy import deepcopy
+import atexit
+import heapq
 import sys
 
 from quickPoll.room import Room, RoomSuite
 from quickPoll.widgets import ChoiceWidget, TextWidget, Choice
+from quickPoll.scheduler import BroadcastScheduler
+from quickPoll.directory import MemberDirectory
+from quickPoll.persistence import RoomWriter, AnswerWriter
+from quickPoll.store import createStore
+from quickPoll.encoding import PreEncoded, columnarOverview, ENCODINGS
+from quickPoll.memberView import RoomViews
 import quickPoll.dbFun as dbFun
+import quickPoll.metrics as metrics
+import quickPoll.export as export
 
 def addDemoRoom(suite):
     # Initialize single demonstration room
@@ -35,34 +44,163 @@ def addDemoRoom(suite):
     w3.visible = True
     return room
 
-roomSuite = RoomSuite()
-for room in dbFun.loadRooms(db):
-    roomSuite.addExistingRoom(room)
+store = createStore(app.config.get("STORE_URL", None))
+
+def hydrateRoom(roomId):
+    """
+    Build a room from the database on its first use
+    """
+    return dbFun.loadRoom(db, roomId)
+
+def onHydrated(room):
+    """
+    Restore the shared state of a room registered after hydration
+    """
+    store.loadRoom(roomSuite, room)
+    roomWriter.remember(room)
+    metrics.roomHydrations.inc()
+    # Members rejoin and teachers subscribe soon after the room is loaded
+    try:
+        directory.prefetch(list(room.members))
+    except Exception as e:
+        print("Warning, prefetching members of {} failed: {}".format(room.id, e),
+            file=sys.stderr)
+
+roomWriter = RoomWriter(socketio, db, app.config.get("PERSIST_INTERVAL", 1.0))
+answerWriter = AnswerWriter(socketio, db, app.config.get("ANSWERS_PERSIST_INTERVAL", 0.5))
+
+# Only the room summaries are loaded at startup; rooms are hydrated on demand
+roomSuite = RoomSuite(loader=hydrateRoom, onHydrated=onHydrated)
+for summary in dbFun.loadRoomIndex(db):
+    roomSuite.addSummary(summary)
 if not roomSuite.hasRoom("demo"):
     r = addDemoRoom(roomSuite)
     dbFun.updateRoom(db, r)
+    # Written directly, so the writer has to know the stored version
+    roomWriter.remember(r)
+
+def applyOperation(operation):
+    """
+    Apply a state change published by another worker. The other worker takes
+    care of all broadcasts and persistence.
+    """
+    kind = operation["op"]
+    roomId = operation["room"]
+    if kind == "layout":
+        layout = operation["layout"]
+        if not roomSuite.hasRoom(roomId):
+            roomSuite.addExistingRoom(Room(roomId))
+        room = roomSuite.getRoom(roomId)
+        room.applyLayout(layout, dbFun.buildWidget)
+        room.restoreIdCounters(operation["idCounters"])
+        # The publishing worker persists the layout
+        roomWriter.remember(room)
+        updateMemberViews(room)
+        return
+    # Rooms that are not hydrated pick up the shared state when hydrated
+    room = roomSuite.loadedRoom(roomId)
+    if room is None:
+        if kind == "deleteRoom":
+            roomSuite.deleteRoom(roomId)
+        return
+    if kind == "join":
+        roomSuite.join(room, operation["username"], operation["sid"])
+        updateMemberViews(room, operation["username"])
+    elif kind == "leave":
+        roomSuite.leaveRoom(room, operation["sid"])
+        updateMemberViews(room, operation["username"])
+    elif kind == "answers":
+        room.updateAnswers(operation["username"], operation["answers"])
+        updateMemberViews(room, operation["username"])
+    elif kind == "deleteRoom":
+        roomSuite.deleteRoom(roomId)
+        broadcaster.forget(roomId)
+        answerWriter.forget(roomId)
+        roomWriter.forget(roomId)
+        forgetMemberViews(roomId)
+
+socketio.start_background_task(store.listen, applyOperation, socketio.sleep)
+socketio.start_background_task(store.heartbeat, applyOperation, socketio.sleep)
+
+def flushOnShutdown():
+    roomWriter.flushAll()
+    answerWriter.flushAll()
+    try:
+        store.close()
+    except Exception as e:
+        print("Warning, releasing sessions in the store failed: {}".format(e),
+            file=sys.stderr)
+
+atexit.register(flushOnShutdown)
+try:
+    import uwsgi
+    uwsgi.atexit = flushOnShutdown
+except ImportError:
+    pass
+
+directory = MemberDirectory(lambda logins: dbFun.fetchPeople(db, logins),
+    maxSize=app.config.get("DIRECTORY_SIZE", 10000),
+    ttl=app.config.get("DIRECTORY_TTL", 600))
+socketio.start_background_task(directory.listen, db.connect, socketio.sleep)
+
+def roomChanged(room):
+    """
+    Persist layout change of the room and share it with other workers
+    """
+    roomWriter.markRoom(room)
+    if store.shared:
+        store.publish({
+            "op": "layout",
+            "room": room.id,
+            "layout": room.teacherLayout(),
+            "idCounters": room.idCounters()
+        })
 
 def isTeacher(username):
     try:
-        cursor = db.cursor()
-        cursor.execute("SELECT COUNT(*) FROM teachers WHERE login = %s", [username])
-        result = cursor.fetchone()
-        return result[0] > 0
+        return directory.isTeacher(username)
     except Exception as e:
-        db.rollback()
         print("Warning, DB query failed", file=sys.stderr)
         return False
 
 @socketio.on("disconnect")
 def disconnect():
-    def onLeave(room):
+    def onLeave(room, username):
         leave_room("student:room." + room.id)
-        updateRoomOverview(room)
+        store.publish({
+            "op": "leave",
+            "room": room.id,
+            "username": username,
+            "sid": request.sid
+        })
+        updateRoomMember(room, username)
+        updateRoomsOverview(room)
     roomSuite.leave(request.sid, onLeave=onLeave)
-    updateRoomsOverview()
+    sessionEncodings.pop(request.sid, None)
+    for roomId in list(memberViews.keys()):
+        unsubscribeMemberView(roomId, request.sid)
+
+def joinResponse(room, username, known):
+    """
+    Build the reply to a join. known holds the layoutTag and answersTag of
+    the state the client already has (e.g., when reconnecting); parts the
+    client has in the current version are left out.
+    """
+    if not isinstance(known, dict):
+        known = {}
+    response = {
+        "status": "success",
+        "layoutTag": room.studentLayoutTag(),
+        "answersTag": room.memberAnswersTag(username)
+    }
+    if known.get("layoutTag", None) != response["layoutTag"]:
+        response["roomLayout"] = PreEncoded(room.encodedStudentLayout())
+    if known.get("answersTag", None) != response["answersTag"]:
+        response["answers"] = room.getMemberAnswers(username)
+    return response
 
 @socketio.on("joinRoom")
-def joinRoom(roomId):
+def joinRoom(roomId, known=None):
     roomId = str(roomId)
     username = request.environ["AUTH_USER"]
 
@@ -81,18 +219,20 @@ def joinRoom(roomId):
             "reason": "alreadyJoined"
         }
 
-    room.join(username, request.sid)
+    roomSuite.join(room, username, request.sid)
+    store.publish({
+        "op": "join",
+        "room": room.id,
+        "username": username,
+        "sid": request.sid
+    })
     join_room("student:room." + room.id)
-    updateRoomsOverview()
-    updateRoomOverview(room)
-    return {
-        "status": "success",
-        "roomLayout": room.studentLayout(),
-        "answers": room.getMemberAnswers(username)
-    }
+    updateRoomsOverview(room)
+    updateRoomMember(room, username)
+    return joinResponse(room, username, known)
 
 @socketio.on("forceJoinRoom")
-def forceJoinRoom(roomId):
+def forceJoinRoom(roomId, known=None):
     roomId = str(roomId)
     username = request.environ["AUTH_USER"]
 
@@ -109,40 +249,117 @@ def forceJoinRoom(roomId):
         socketio.emit("roomUpdate", {
             "status": "error",
             "reason": "alreadyJoined"
+        }, room=existingSession)
+        leave_room("student:room." + room.id, sid=existingSession)
+        roomSuite.leaveRoom(room, existingSession)
+        store.publish({
+            "op": "leave",
+            "room": room.id,
+            "username": username,
+            "sid": existingSession
         })
-        room.leave(existingSession)
 
-    room.join(username, request.sid)
-    return {
-        "status": "success",
-        "roomLayout": room.studentLayout(),
-        "answers": room.getMemberAnswers(username)
-    }
+    roomSuite.join(room, username, request.sid)
+    store.publish({
+        "op": "join",
+        "room": room.id,
+        "username": username,
+        "sid": request.sid
+    })
+    join_room("student:room." + room.id)
+    return joinResponse(room, username, known)
 
-@socketio.on("answerUpdate")
-def answerUpdate(roomId, answers):
+def answeringRoom(roomId):
+    """
+    Return the room if the current session is joined to it, None otherwise
+    """
     roomId = str(roomId)
     username = request.environ["AUTH_USER"]
     if not roomSuite.hasRoom(roomId):
-        return
+        return None
     room = roomSuite.getRoom(roomId)
-    existingSession = room.getMemberSession(username)
-    if existingSession != request.sid:
+    if room.getMemberSession(username) != request.sid:
+        return None
+    return room
+
+def answersChanged(room, username, changed):
+    if len(changed) == 0:
         return
-    room.updateAnswers(username, answers)
-    updateRoomOverview(room)
+    answerWriter.markAnswers(room, username, changed)
+    if store.shared:
+        store.publish({
+            "op": "answers",
+            "room": room.id,
+            "username": username,
+            "answers": room.getMemberAnswers(username)
+        })
+    updateMemberAnswers(room, username)
+
+def answersRepaired(room, widget, usernames):
+    """
+    Persist and share answers changed by a layout change of the widget
+    """
+    for username in usernames:
+        answersChanged(room, username, [widget.id])
+
+@socketio.on("answerUpdate")
+def answerUpdate(roomId, answers):
+    """
+    Replace all answers of the member, e.g., to resynchronize the client
+    """
+    room = answeringRoom(roomId)
+    if room is None:
+        return
+    username = request.environ["AUTH_USER"]
+    answersChanged(room, username, room.updateAnswers(username, answers))
+
+@socketio.on("answerPatch")
+def answerPatch(roomId, patch):
+    """
+    Change answers of the given widgets only: widget id -> answer, None
+    clears the answer. The reply carries the tag of the resulting answers.
+    """
+    if not isinstance(patch, dict):
+        return {
+            "status": "error",
+            "reason": "invalidPatch"
+        }
+    room = answeringRoom(roomId)
+    if room is None:
+        return {
+            "status": "error",
+            "reason": "notJoined"
+        }
+    username = request.environ["AUTH_USER"]
+    answersChanged(room, username, room.patchAnswers(username, patch))
+    return {
+        "status": "success",
+        "answersTag": room.memberAnswersTag(username)
+    }
+
+def withAuthorInfo(summaries):
+    """
+    Add author info to room summaries with a single directory lookup
+    """
+    authors = set(summary["author"] for summary in summaries)
+    authorInfo = directory.memberInfo(authors, authors)
+    for summary in summaries:
+        summary["authorInfo"] = authorInfo.get(summary["author"], None)
+    return summaries
 
 def roomsOverview(roomSuite):
-    return [{
-        "id": id,
-        "name": room.name,
-        "author": room.author,
-        "authorInfo": dbFun.memberInfo(db, [room.author], [room.author]).get(room.author, None),
-        "activeMembers": len(room.memberSessions)
-    } for id, room in roomSuite.rooms.items()]
+    return withAuthorInfo(roomSuite.summaries())
 
-def updateRoomsOverview():
-    socketio.emit("rooms", roomsOverview(roomSuite), room="teacher:roomsOverview")
+def emitRoomsOverview(roomIds):
+    """
+    Send summaries of changed rooms to the teachers. Rooms without a summary
+    were deleted.
+    """
+    summaries = [roomSuite.summary(roomId) for roomId in roomIds]
+    socketio.emit("roomsDelta", {
+        "updated": withAuthorInfo([s for s in summaries if s is not None]),
+        "deleted": [roomId for roomId, s in zip(roomIds, summaries) if s is None]
+    }, room="teacher:roomsOverview")
 
 @socketio.on("subscribeRooms")
 def subscribeRooms():
@@ -159,31 +376,211 @@ def unsubscribeRooms():
         return
     leave_room("teacher:roomsOverview")
 
+# Session id -> encoding negotiated by the client if not JSON
+sessionEncodings = {}
+
+@socketio.on("negotiateEncoding")
+def negotiateEncoding(encodings):
+    """
+    Pick the preferred encoding of full room overviews supported by both
+    sides. Old clients never ask and get JSON objects.
+    """
+    if not isinstance(encodings, list):
+        return "json"
+    for encoding in ENCODINGS:
+        if encoding in encodings:
+            break
+    if encoding == "json":
+        sessionEncodings.pop(request.sid, None)
+    else:
+        sessionEncodings[request.sid] = encoding
+    return encoding
+
 def roomOverview(room):
     return {
         "status": "success",
-        "roomLayout": room.teacherLayout(),
+        "revision": room.revision,
+        "roomLayout": PreEncoded(room.encodedTeacherLayout()),
         "answers": room.getMembersAnswers(),
-        "members": dbFun.memberInfo(db, room.members, room.memberSessions.keys())
+        "members": directory.memberInfo(room.members, room.memberSessions.keys())
+    }
+
+def aggregateOverview(room):
+    return {
+        "status": "success",
+        "revision": room.revision,
+        "roomLayout": PreEncoded(room.encodedTeacherLayout()),
+        "statistics": room.statistics(),
+        "activeMembers": len(room.memberSessions)
     }
 
 def updateRoomLayout(room):
-    overview = roomOverview(room)
-    socketio.emit("room", overview, room="teacher:room." + room.id)
-    layout = room.studentLayout()
-    for username, sid in room.memberSessions.items():
-        socketio.emit("roomUpdate", {
-            "status": "success",
-            "roomLayout": layout,
-            "answers": room.getMemberAnswers(username)
-        }, sid=sid)
+    updateRoomOverview(room)
+    # Students already have their answers, send only the layout once to all
+    socketio.emit("roomUpdate", {
+        "status": "success",
+        "layoutTag": room.studentLayoutTag(),
+        "roomLayout": PreEncoded(room.encodedStudentLayout())
+    }, room="student:room." + room.id)
+
+def hasSubscribers(socketRoom):
+    """
+    Return False if nobody can be subscribed to the Socket.IO room. With a
+    message queue the subscribers might be connected to other workers, so
+    only a single worker knows for sure.
+    """
+    if app.config.get("SOCKETIO_MESSAGE_QUEUE", None) is not None:
+        return True
+    return len(socketio.server.manager.rooms.get("/", {}).get(socketRoom, {})) > 0
+
+def emitRoomOverview(room):
+    store.nextRevision(room)
+    full = hasSubscribers("teacher:room." + room.id)
+    columnar = hasSubscribers("teacher:roomColumnar." + room.id)
+    # The overviews are built only for encodings somebody asked for
+    if full or columnar:
+        overview = roomOverview(room)
+        if full:
+            socketio.emit("room", overview, room="teacher:room." + room.id)
+        if columnar:
+            socketio.emit("room", columnarOverview(overview),
+                room="teacher:roomColumnar." + room.id)
+    if hasSubscribers("teacher:roomAggregate." + room.id):
+        socketio.emit("room", aggregateOverview(room), room="teacher:roomAggregate." + room.id)
+        # The subscribers hold the full statistics, deltas continue from here
+        room.trackStatistics(True)
+    else:
+        room.trackStatistics(False)
+
+def emitMemberAnswers(room, usernames):
+    """
+    Send only the changed answers to the teachers. If the revision does not
+    follow the one the teacher holds, the teacher resubscribes to the room.
+    """
+    revision = store.nextRevision(room)
+    delta = {
+        "roomId": room.id,
+        "revision": revision,
+        "answers": { username: room.getMemberAnswers(username) for username in usernames }
+    }
+    socketio.emit("roomDelta", delta, room="teacher:room." + room.id)
+    socketio.emit("roomDelta", delta, room="teacher:roomColumnar." + room.id)
+    if hasSubscribers("teacher:roomAggregate." + room.id):
+        socketio.emit("roomStatistics", {
+            "roomId": room.id,
+            "revision": revision,
+            "statistics": room.statisticsDelta(),
+            "activeMembers": len(room.memberSessions)
+        }, room="teacher:roomAggregate." + room.id)
+    else:
+        # Nobody receives the deltas, do not collect the changes
+        room.trackStatistics(False)
+
+broadcaster = BroadcastScheduler(socketio, app.config.get("BROADCAST_INTERVAL", 0.15),
+    sendRoom=emitRoomOverview,
+    sendMembers=emitMemberAnswers,
+    sendRooms=emitRoomsOverview)
+
+# Room id -> RoomViews of teachers subscribed to a window of members
+memberViews = {}
+
+def windowOverview(views, view):
+    room = views.room
+    view.logins, view.total = views.window(view)
+    return {
+        "status": "success",
+        "roomId": room.id,
+        "revision": view.nextRevision(),
+        "roomLayout": PreEncoded(room.encodedTeacherLayout()),
+        "window": view.window,
+        "total": view.total,
+        "order": view.logins,
+        "answers": { login: room.getMemberAnswers(login) for login in view.logins },
+        "members": directory.memberInfo(view.logins, room.memberSessions.keys())
+    }
+
+def emitRoomViews(room):
+    views = memberViews.get(room.id, None)
+    if views is None:
+        return
+    for view in list(views.views.values()):
+        socketio.emit("roomWindow", windowOverview(views, view), room=view.sid)
+
+def emitMemberViews(room, usernames):
+    """
+    Send changed answers and member info (e.g., joined or left) to the
+    teachers whose window contains the members. If the window content or
+    order changed, the whole window is sent instead.
+    """
+    views = memberViews.get(room.id, None)
+    if views is None:
+        return
+    for view, changed in views.updates(usernames):
+        if changed is None:
+            socketio.emit("roomWindow", windowOverview(views, view), room=view.sid)
+            continue
+        socketio.emit("roomWindowDelta", {
+            "roomId": room.id,
+            "revision": view.nextRevision(),
+            "answers": { username: room.getMemberAnswers(username) for username in changed },
+            "members": directory.memberInfo(changed, room.memberSessions.keys())
+        }, room=view.sid)
+
+# Windows are local to the worker, so they are updated for changes made by
+# other workers too
+viewBroadcaster = BroadcastScheduler(socketio, app.config.get("BROADCAST_INTERVAL", 0.15),
+    sendRoom=emitRoomViews,
+    sendMembers=emitMemberViews,
+    sendRooms=lambda roomIds: None)
+
+def updateMemberViews(room, username=None):
+    """
+    Schedule update of the member windows. Without username (layout changes)
+    all windows are sent whole, otherwise only windows affected by the member.
+    """
+    if room.id not in memberViews:
+        return
+    if username is None:
+        viewBroadcaster.markRoom(room)
+    else:
+        viewBroadcaster.markMember(room, username)
+
+def unsubscribeMemberView(roomId, sid):
+    views = memberViews.get(roomId, None)
+    if views is None:
+        return
+    views.unsubscribe(sid)
+    if len(views.views) == 0:
+        del memberViews[roomId]
+
+def forgetMemberViews(roomId):
+    memberViews.pop(roomId, None)
+    viewBroadcaster.forget(roomId)
 
 def updateRoomOverview(room):
-    overview = roomOverview(room)
-    socketio.emit("room", overview, room="teacher:room." + room.id)
+    broadcaster.markRoom(room)
+    updateMemberViews(room)
+
+def updateRoomMember(room, username):
+    broadcaster.markRoom(room)
+    updateMemberViews(room, username)
+
+def updateMemberAnswers(room, username):
+    broadcaster.markMember(room, username)
+    updateMemberViews(room, username)
+
+def updateRoomsOverview(room):
+    broadcaster.markRooms(room.id)
 
 @socketio.on("subscribeRoom")
-def subscribeRoom(roomId):
+def subscribeRoom(roomId, mode="full", window=None):
+    """
+    Subscribe to room updates. In the "aggregate" mode only the layout and
+    aggregated answers are streamed instead of individual member answers. In
+    the "window" mode only members in the given window (see
+    memberView.normalizeWindow) are streamed; subscribing again changes the
+    window.
+    """
     roomId = str(roomId)
     username = request.environ["AUTH_USER"]
     if not isTeacher(username):
@@ -194,6 +591,20 @@ def subscribeRoom(roomId):
             "reason": "noSuchRoom"
         }
     room = roomSuite.getRoom(roomId)
+    store.syncRevision(room)
+    if mode == "aggregate":
+        join_room("teacher:roomAggregate." + room.id)
+        return aggregateOverview(room)
+    if mode == "window":
+        views = memberViews.get(room.id, None)
+        if views is None:
+            views = memberViews[room.id] = RoomViews(room, directory.lookup)
+        view = views.subscribe(request.sid, window)
+        join_room("teacher:roomView." + room.id)
+        return windowOverview(views, view)
+    if sessionEncodings.get(request.sid, "json") == "columnar":
+        join_room("teacher:roomColumnar." + room.id)
+        return columnarOverview(roomOverview(room))
     join_room("teacher:room." + room.id)
     return roomOverview(room)
 
@@ -205,6 +616,10 @@ def unsubscribeRoom(roomId):
     if not roomSuite.hasRoom(roomId):
         return
     leave_room("teacher:room." + roomId)
+    leave_room("teacher:roomColumnar." + roomId)
+    leave_room("teacher:roomAggregate." + roomId)
+    leave_room("teacher:roomView." + roomId)
+    unsubscribeMemberView(roomId, request.sid)
 
 @socketio.on("deleteRoom")
 def deleteRoom(roomId):
@@ -214,19 +629,41 @@ def deleteRoom(roomId):
     if not roomSuite.hasRoom(roomId):
         return
     roomSuite.deleteRoom(roomId)
-    dbFun.deleteRoom(db, roomId)
+    broadcaster.forget(roomId)
+    answerWriter.forget(roomId)
+    forgetMemberViews(roomId)
+    roomWriter.markDeleted(roomId)
+    store.publish({
+        "op": "deleteRoom",
+        "room": roomId
+    })
 
     socketio.emit("room", {
             "status": "error",
             "reason": "noSuchRoom"
         }, room="teacher:room." + roomId)
     socketio.close_room("teacher:room." + roomId)
+    socketio.emit("room", {
+            "status": "error",
+            "reason": "noSuchRoom"
+        }, room="teacher:roomColumnar." + roomId)
+    socketio.close_room("teacher:roomColumnar." + roomId)
+    socketio.emit("room", {
+            "status": "error",
+            "reason": "noSuchRoom"
+        }, room="teacher:roomAggregate." + roomId)
+    socketio.close_room("teacher:roomAggregate." + roomId)
+    socketio.emit("roomWindow", {
+            "status": "error",
+            "reason": "noSuchRoom"
+        }, room="teacher:roomView." + roomId)
+    socketio.close_room("teacher:roomView." + roomId)
     socketio.emit("room", {
             "status": "error",
             "reason": "noSuchRoom"
         }, room="student:room." + roomId)
     socketio.close_room("student:room." + roomId)
-    updateRoomsOverview()
+    broadcaster.markRooms(roomId)
 
 @socketio.on("createRoom")
 def createRoom():
@@ -234,8 +671,8 @@ def createRoom():
     if not isTeacher(username):
         return
     room = roomSuite.addRoom(author=username)
-    dbFun.updateRoom(db, room)
-    updateRoomsOverview()
+    roomChanged(room)
+    updateRoomsOverview(room)
     return room.id
 
 @socketio.on("reorderWidgets")
@@ -250,7 +687,7 @@ def reorderWidgets(roomId, widgetsId):
         return
 
     room.reorderWidgets(widgetsId)
-    dbFun.updateRoom(db, room)
+    roomChanged(room)
     updateRoomLayout(room)
     return roomOverview(room)
 
@@ -262,8 +699,10 @@ def deleteWidget(roomId, widgetId):
     if not roomSuite.hasRoom(roomId):
         return
     room = roomSuite.getRoom(roomId)
+    if room.widget(widgetId) is not None:
+        answerWriter.forgetWidget(room.id, widgetId)
     room.deleteWidget(widgetId)
-    dbFun.updateRoom(db, room)
+    roomChanged(room)
     updateRoomLayout(room)
     return roomOverview(room)
 
@@ -282,7 +721,7 @@ def addWidget(roomId, type):
         room.addWidget(ChoiceWidget("Nová výběrová otázka", False, []))
     else:
         return
-    dbFun.updateRoom(db, room)
+    roomChanged(room)
     updateRoomLayout(room)
     return roomOverview(room)
 
@@ -302,8 +741,10 @@ def changeRoomPropertyHandler(request, roomId, propertyName, propertyValue):
         return
     room = roomSuite.getRoom(roomId)
     setattr(room, propertyName, propertyValue)
-    dbFun.updateRoom(db, room)
+    roomChanged(room)
     updateRoomLayout(room)
+    if propertyName == "name":
+        updateRoomsOverview(room)
     return roomOverview(room)
 
 def changeWidgetPropertyHandler(request, roomId, widgetId, propertyName, propertyValue):
@@ -317,7 +758,9 @@ def changeWidgetPropertyHandler(request, roomId, widgetId, propertyName, propert
     if widget is None:
         return
     setattr(widget, propertyName, propertyValue)
-    dbFun.updateRoom(db, room)
+    roomChanged(room)
+    if propertyName == "multiple":
+        answersRepaired(room, widget, widget.repairAnswers())
     updateRoomLayout(room)
     return roomOverview(room)
 
@@ -359,8 +802,9 @@ def deleteChoice(roomId, widgetId, choiceId):
     room, widget, choice = validateForChoice(request, roomId, widgetId, choiceId)
     if room is None or widget is None or choice is None:
         return
-    widget.deleteChoice(choiceId)
-    dbFun.updateRoom(db, room)
+    usernames = widget.deleteChoice(choiceId)
+    roomChanged(room)
+    answersRepaired(room, widget, usernames)
     updateRoomLayout(room)
     return roomOverview(room)
 
@@ -370,7 +814,7 @@ def deleteChoice(roomId, widgetId, choiceId, value):
     if room is None or widget is None or choice is None:
         return
     choice.text = value
-    dbFun.updateRoom(db, room)
+    roomChanged(room)
     updateRoomLayout(room)
     return roomOverview(room)
 
@@ -380,7 +824,7 @@ def deleteChoice(roomId, widgetId):
     if room is None or widget is None:
         return
     widget.addChoice(Choice(""))
-    dbFun.updateRoom(db, room)
+    roomChanged(room)
     updateRoomLayout(room)
     return roomOverview(room)
 
@@ -393,7 +837,7 @@ def deleteChoice(roomId, widgetId, choicesIds):
         return
 
     widget.reorderChoices(choicesIds)
-    dbFun.updateRoom(db, room)
+    roomChanged(room)
     updateRoomLayout(room)
     return roomOverview(room)
 
@@ -408,12 +852,26 @@ def cloneRoom(roomId):
 
     newRoom = Room(None, room.name + " (klon)", username, room.description)
     for widget in room.widgets:
-        newRoom.addWidget(deepcopy(widget))
+        newRoom.addWidget(dbFun.buildWidget(widget.layout()))
     roomSuite.addExistingRoom(newRoom)
-    dbFun.updateRoom(db, newRoom)
+    roomChanged(newRoom)
 
-    updateRoomsOverview()
+    updateRoomsOverview(newRoom)
+
+
+@socketio.on("broadcastStats")
+def broadcastStats():
+    username = request.environ["AUTH_USER"]
+    if not isTeacher(username):
+        return
+    return broadcaster.stats()
 
+@socketio.on("invalidateDirectory")
+def invalidateDirectory():
+    username = request.environ["AUTH_USER"]
+    if not isTeacher(username):
+        return
+    directory.invalidate()
 
 @socketio.on("whoAmI")
 def whoAmI():
@@ -421,4 +879,125 @@ def whoAmI():
     roles = ["student"]
     if isTeacher(username):
         roles.append("teacher")
-    return roles
\ No newline at end of file
+    return roles
+
+def isBusy(room):
+    """
+    Return True if the room cannot be evicted: somebody on this worker is
+    subscribed to it or there are pending broadcasts or writes
+    """
+    socketRooms = socketio.server.manager.rooms.get("/", {})
+    for prefix in ["student:room.", "teacher:room.", "teacher:roomColumnar.",
+            "teacher:roomAggregate.", "teacher:roomView."]:
+        if len(socketRooms.get(prefix + room.id, {})) > 0:
+            return True
+    return room.id in memberViews or broadcaster.hasPending(room.id) \
+        or viewBroadcaster.hasPending(room.id) or roomWriter.hasPending(room.id) \
+        or answerWriter.hasPending(room.id)
+
+def evictIdleRooms(timeout):
+    while True:
+        socketio.sleep(min(timeout / 4, 60))
+        evicted = roomSuite.evictIdle(timeout, isBusy)
+        for roomId in evicted:
+            roomWriter.forget(roomId)
+        if len(evicted) > 0:
+            metrics.evictedRooms.inc((), len(evicted))
+
+roomIdleTimeout = app.config.get("ROOM_IDLE_TIMEOUT", 1800)
+if roomIdleTimeout is not None:
+    socketio.start_background_task(evictIdleRooms, roomIdleTimeout)
+
+EXPORT_FORMATS = {
+    "csv": (export.exportCsv, "text/csv; charset=utf-8"),
+    "jsonl": (export.exportJsonLines, "application/x-ndjson; charset=utf-8")
+}
+
+def exportedRooms(roomIds):
+    """
+    Iterate over rooms to export with their member answers, see
+    export.exportCsv. Rooms that are not hydrated are not loaded; their
+    answers are streamed from the database.
+    """
+    for roomId in roomIds:
+        room = roomSuite.loadedRoom(roomId)
+        if room is not None:
+            yield room, ((login, room.getMemberAnswers(login)) for login in list(room.members))
+            continue
+        room = dbFun.loadRoomLayout(db, roomId)
+        if room is not None:
+            yield room, ((login, room.validAnswers(answers))
+                for login, answers in dbFun.streamAnswers(db, roomId))
+
+def exportResponse(roomIds, format, filename):
+    if not isTeacher(request.environ.get("AUTH_USER", None)):
+        return Response("Forbidden\n", status=403, mimetype="text/plain")
+    if format not in EXPORT_FORMATS:
+        return Response("Unknown format\n", status=404, mimetype="text/plain")
+    generate, mimetype = EXPORT_FORMATS[format]
+    response = Response(generate(exportedRooms(roomIds),
+        lambda logins: dbFun.fetchPeople(db, logins)), mimetype=mimetype)
+    response.headers["Content-Disposition"] = \
+        'attachment; filename="{}.{}"'.format(filename, format)
+    return response
+
+@app.route("/export/room/<roomId>/<format>")
+def exportRoom(roomId, format):
+    """
+    Stream layout and answers of a room as CSV or JSON lines
+    """
+    if not roomSuite.hasRoom(roomId):
+        return Response("No such room\n", status=404, mimetype="text/plain")
+    return exportResponse([roomId], format, roomId)
+
+@app.route("/export/author/<author>/<format>")
+def exportAuthor(author, format):
+    """
+    Stream all rooms of the author
+    """
+    roomIds = [s["id"] for s in roomSuite.summaries() if s["author"] == author]
+    return exportResponse(roomIds, format, author)
+
+metrics.registry.add(metrics.Gauge("quickpoll_rooms", "Rooms hydrated in this worker",
+    lambda: { (): len(roomSuite.rooms) }))
+metrics.registry.add(metrics.Gauge("quickpoll_stored_rooms",
+    "Rooms known only by their summary", lambda: { (): len(roomSuite.index) }))
+metrics.registry.add(metrics.Gauge("quickpoll_sessions",
+    "Sessions joined to at least one room", lambda: { (): len(roomSuite.sessions) }))
+metrics.registry.add(metrics.Gauge("quickpoll_room_members",
+    "Members currently joined to the hydrated rooms",
+    lambda: { (): sum(len(room.memberSessions) for room in roomSuite.rooms.values()) }))
+metrics.registry.add(metrics.Gauge("quickpoll_room_known_members",
+    "Members who have ever joined the hydrated rooms",
+    lambda: { (): sum(len(room.members) for room in roomSuite.rooms.values()) }))
+metrics.registry.add(metrics.Gauge("quickpoll_rooms_by_members",
+    "Hydrated rooms with at most le joined members",
+    lambda: metrics.cumulativeCounts(
+        (len(room.memberSessions) for room in roomSuite.rooms.values()),
+        metrics.ROOM_SIZE_BUCKETS),
+    ("le",)))
+topRooms = app.config.get("METRICS_TOP_ROOMS", 10)
+metrics.registry.add(metrics.Gauge("quickpoll_top_room_members",
+    "Joined members of the largest hydrated rooms",
+    lambda: { (room.id,): len(room.memberSessions) for room in heapq.nlargest(topRooms,
+        roomSuite.rooms.values(), key=lambda room: len(room.memberSessions)) },
+    ("room",)))
+
+@app.route("/metrics")
+def exportMetrics():
+    if not app.config.get("METRICS_ENABLED", True):
+        return Response("Metrics are disabled\n", status=404, mimetype="text/plain")
+    return Response(metrics.registry.render(),
+        mimetype="text/plain; version=0.0.4; charset=utf-8")
+
+@app.route("/ready")
+def ready():
+    """
+    Readiness probe for the load balancer: the worker has finished its startup
+    and reaches the database
+    """
+    try:
+        dbFun.ping(db)
+    except Exception as e:
+        return Response("Database unavailable\n", status=503, mimetype="text/plain")
+    return Response("Ready\n", mimetype="text/plain")
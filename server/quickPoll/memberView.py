@@ -0,0 +1,194 @@
+from bisect import bisect_left, insort
+
+SORT_KEYS = ("login", "name", "uco", "lastAnswer")
+MAX_LIMIT = 500
+
+class MemberIndex:
+    """
+    Members of a room kept sorted by a key. keyOf(login) returns a comparable
+    key; the login is appended to make entries unique.
+    """
+    __slots__ = ("keyOf", "entries", "keys")
+
+    def __init__(self, keyOf):
+        self.keyOf = keyOf
+        # Sorted (key, login)
+        self.entries = []
+        # Login -> key
+        self.keys = {}
+
+    def __len__(self):
+        return len(self.entries)
+
+    def update(self, login):
+        """
+        Insert the member or move it if its key changed
+        """
+        key = self.keyOf(login)
+        oldKey = self.keys.get(login, None)
+        if login in self.keys:
+            if oldKey == key:
+                return
+            del self.entries[bisect_left(self.entries, (oldKey, login))]
+        self.keys[login] = key
+        insort(self.entries, (key, login))
+
+    def logins(self, descending=False):
+        entries = reversed(self.entries) if descending else self.entries
+        return (login for _, login in entries)
+
+def normalizeWindow(window):
+    """
+    Return a valid window built from the client request: offset, limit, sort
+    ("login", "name", "uco" or "lastAnswer"), descending and filter with
+    optional keys active (bool), answered and notAnswered (widget ids).
+    """
+    if not isinstance(window, dict):
+        window = {}
+    filter = window.get("filter", None)
+    if not isinstance(filter, dict):
+        filter = {}
+    offset = window.get("offset", 0)
+    limit = window.get("limit", 50)
+    return {
+        "offset": offset if type(offset) is int and offset >= 0 else 0,
+        "limit": min(limit, MAX_LIMIT) if type(limit) is int and limit > 0 else 50,
+        "sort": window.get("sort") if window.get("sort") in SORT_KEYS else "login",
+        "descending": window.get("descending", False) is True,
+        "filter": {
+            "active": filter.get("active", False) is True,
+            "answered": filter.get("answered") if type(filter.get("answered")) is int else None,
+            "notAnswered": filter.get("notAnswered") if type(filter.get("notAnswered")) is int else None
+        }
+    }
+
+class MemberView:
+    """
+    Window of a single teacher session into the members of a room
+    """
+    __slots__ = ("sid", "window", "revision", "logins", "total")
+
+    def __init__(self, sid, window):
+        self.sid = sid
+        self.window = window
+        self.revision = 0
+        # Logins in the window and the filtered total as last sent to the
+        # teacher
+        self.logins = []
+        self.total = 0
+
+    def nextRevision(self):
+        self.revision += 1
+        return self.revision
+
+class RoomViews:
+    """
+    Windowed member views of a single room with the sorted member indexes
+    they need. Indexes are built on first use of a sort key.
+    """
+    __slots__ = ("room", "lookup", "indexes", "views")
+
+    def __init__(self, room, lookup):
+        self.room = room
+        # Callable returning directory records for given logins
+        self.lookup = lookup
+        self.indexes = {}
+        # Session id -> MemberView
+        self.views = {}
+
+    def keyOf(self, sort):
+        room = self.room
+        if sort == "lastAnswer":
+            return lambda login: room.answerTimes.get(login, 0)
+        if sort == "login":
+            return lambda login: 0
+        def key(login):
+            value = self.lookup([login])[login][sort]
+            return (value is None, value if value is not None else "")
+        return key
+
+    def index(self, sort):
+        index = self.indexes.get(sort, None)
+        if index is None:
+            index = self.indexes[sort] = MemberIndex(self.keyOf(sort))
+            if sort in ("name", "uco"):
+                self.lookup(list(self.room.members.keys()))
+            for login in self.room.members.keys():
+                index.update(login)
+        elif len(index) != len(self.room.members):
+            for login in self.room.members.keys():
+                if login not in index.keys:
+                    index.update(login)
+        return index
+
+    def membersChanged(self, logins):
+        """
+        Reposition members whose answers changed. Newly joined members are
+        added to the indexes on the next window computation.
+        """
+        index = self.indexes.get("lastAnswer", None)
+        if index is not None:
+            for login in logins:
+                index.update(login)
+
+    def matches(self, login, filter):
+        room = self.room
+        if filter["active"] and login not in room.memberSessions:
+            return False
+        if filter["answered"] is not None and \
+                room.memberAnswers.getAnswer(login, filter["answered"]) is None:
+            return False
+        if filter["notAnswered"] is not None and \
+                room.memberAnswers.getAnswer(login, filter["notAnswered"]) is not None:
+            return False
+        return True
+
+    def window(self, view):
+        """
+        Return logins in the window of the view and the number of members
+        passing the filter
+        """
+        window = view.window
+        start = window["offset"]
+        end = start + window["limit"]
+        logins = []
+        total = 0
+        for login in self.index(window["sort"]).logins(window["descending"]):
+            if not self.matches(login, window["filter"]):
+                continue
+            if start <= total < end:
+                logins.append(login)
+            total += 1
+        return logins, total
+
+    def updates(self, usernames):
+        """
+        Reposition members whose answers changed and return (view, changed)
+        for the affected views. changed is None if the window content, order
+        or total changed and the whole window has to be sent, otherwise it
+        lists the members in the window whose answers changed.
+        """
+        self.membersChanged(usernames)
+        updates = []
+        for view in list(self.views.values()):
+            logins, total = self.window(view)
+            if logins != view.logins or total != view.total:
+                updates.append((view, None))
+                continue
+            inWindow = set(logins)
+            changed = [username for username in usernames if username in inWindow]
+            if len(changed) > 0:
+                updates.append((view, changed))
+        return updates
+
+    def subscribe(self, sid, window):
+        self.views[sid] = MemberView(sid, normalizeWindow(window))
+        return self.views[sid]
+
+    def unsubscribe(self, sid):
+        self.views.pop(sid, None)
+        # Drop indexes no longer used by any view
+        used = set(view.window["sort"] for view in self.views.values())
+        for sort in list(self.indexes.keys()):
+            if sort not in used:
+                del self.indexes[sort]
@@ -0,0 +1,245 @@
+from bisect import bisect_left
+from functools import wraps
+from gevent.local import local
+import time
+
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1,
+    0.25, 0.5, 1.0, 2.5, 5.0)
+ROOM_SIZE_BUCKETS = (0, 10, 25, 50, 100, 250, 500, 1000, 2500)
+
+def formatLabels(names, values):
+    if len(names) == 0:
+        return ""
+    pairs = ['{}="{}"'.format(name, str(value).replace("\\", "\\\\").replace('"', '\\"'))
+        for name, value in zip(names, values)]
+    return "{" + ",".join(pairs) + "}"
+
+class Counter:
+    __slots__ = ("name", "help", "labels", "values")
+
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.values = {}
+
+    def inc(self, labels=(), amount=1):
+        self.values[labels] = self.values.get(labels, 0) + amount
+
+    def render(self):
+        yield "# HELP {} {}".format(self.name, self.help)
+        yield "# TYPE {} counter".format(self.name)
+        for labels, value in self.values.items():
+            yield "{}{} {}".format(self.name, formatLabels(self.labels, labels), value)
+
+class Gauge:
+    """
+    Gauge evaluated on scrape. The callback returns a dictionary label values
+    -> value.
+    """
+    __slots__ = ("name", "help", "labels", "callback")
+
+    def __init__(self, name, help, callback, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.callback = callback
+
+    def render(self):
+        yield "# HELP {} {}".format(self.name, self.help)
+        yield "# TYPE {} gauge".format(self.name)
+        for labels, value in self.callback().items():
+            yield "{}{} {}".format(self.name, formatLabels(self.labels, labels), value)
+
+class Histogram:
+    """
+    Histogram with fixed buckets. Per label values it keeps non-cumulative
+    bucket counts, the sum and the count of observations.
+    """
+    __slots__ = ("name", "help", "labels", "buckets", "values")
+
+    def __init__(self, name, help, labels=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.buckets = buckets
+        self.values = {}
+
+    def observe(self, labels, value):
+        entry = self.values.get(labels, None)
+        if entry is None:
+            entry = self.values[labels] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+        entry[0][bisect_left(self.buckets, value)] += 1
+        entry[1] += value
+        entry[2] += 1
+
+    def time(self, labels):
+        """
+        Decorator observing duration of the function
+        """
+        def decorator(f):
+            @wraps(f)
+            def wrapper(*args, **kwargs):
+                start = time.perf_counter()
+                try:
+                    return f(*args, **kwargs)
+                finally:
+                    self.observe(labels, time.perf_counter() - start)
+            return wrapper
+        return decorator
+
+    def render(self):
+        yield "# HELP {} {}".format(self.name, self.help)
+        yield "# TYPE {} histogram".format(self.name)
+        names = self.labels + ("le",)
+        for labels, (counts, total, count) in self.values.items():
+            cumulative = 0
+            for bound, bucketCount in zip(self.buckets + ("+Inf",), counts):
+                cumulative += bucketCount
+                yield "{}_bucket{} {}".format(self.name,
+                    formatLabels(names, labels + (bound,)), cumulative)
+            yield "{}_sum{} {}".format(self.name, formatLabels(self.labels, labels), total)
+            yield "{}_count{} {}".format(self.name, formatLabels(self.labels, labels), count)
+
+class Registry:
+    def __init__(self):
+        self.metrics = []
+
+    def add(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def render(self):
+        """
+        Return all metrics in the Prometheus text exposition format
+        """
+        lines = []
+        for metric in self.metrics:
+            lines.extend(metric.render())
+        lines.append("")
+        return "\n".join(lines)
+
+registry = Registry()
+
+dbSeconds = registry.add(Histogram("quickpoll_db_seconds",
+    "Duration of database functions", ("function",)))
+handlerSeconds = registry.add(Histogram("quickpoll_handler_seconds",
+    "Duration of Socket.IO event handlers", ("event",)))
+handlerErrors = registry.add(Counter("quickpoll_handler_errors_total",
+    "Socket.IO event handlers that raised an exception", ("event",)))
+emits = registry.add(Counter("quickpoll_emits_total",
+    "Emits requested by this worker", ("event", "target")))
+emittedPackets = registry.add(Counter("quickpoll_emitted_packets_total",
+    "Packets sent to sockets of this worker", ("event", "target")))
+emittedBytes = registry.add(Counter("quickpoll_emitted_bytes_total",
+    "Encoded size of packets sent to sockets of this worker", ("event", "target")))
+roomHydrations = registry.add(Counter("quickpoll_room_hydrations_total",
+    "Rooms built from the database on demand"))
+evictedRooms = registry.add(Counter("quickpoll_evicted_rooms_total",
+    "Idle rooms evicted from memory"))
+
+def cumulativeCounts(values, buckets):
+    """
+    Return gauge values (bucket bound,) -> number of values not greater than
+    the bound, a distribution with a bounded number of series
+    """
+    counts = [0] * (len(buckets) + 1)
+    for value in values:
+        counts[bisect_left(buckets, value)] += 1
+    result = {}
+    cumulative = 0
+    for bound, count in zip(buckets + ("+Inf",), counts):
+        cumulative += count
+        result[(bound,)] = cumulative
+    return result
+
+def timedQuery(f):
+    """
+    Decorator recording duration of a database function
+    """
+    return dbSeconds.time((f.__name__,))(f)
+
+def emitTarget(room):
+    """
+    Return the kind of the target room, e.g., "teacher:room" for
+    "teacher:room.<id>". Room ids are left out to keep the number of series
+    bounded.
+    """
+    if room is None:
+        return "broadcast"
+    kind, dot, _ = room.partition(".")
+    return kind if dot else "session"
+
+class EmitContext(local):
+    """
+    Event and target of the emit being delivered by the current greenlet.
+    Packets are encoded synchronously during the delivery, so the encoder can
+    attribute their size.
+    """
+    event = None
+    target = None
+
+emitContext = EmitContext()
+
+def onEncoded(size):
+    if emitContext.event is not None:
+        labels = (emitContext.event, emitContext.target)
+        emittedPackets.inc(labels)
+        emittedBytes.inc(labels, size)
+
+def instrument(socketio):
+    """
+    Time all Socket.IO handlers registered from now on and account emits.
+    Packets delivered via the message queue are accounted with target
+    "remote" as the original target is not known to the receiving worker.
+    """
+    import quickPoll.encoding
+    quickPoll.encoding.observer = onEncoded
+
+    originalOn = socketio.on
+    def on(message, namespace=None):
+        register = originalOn(message, namespace)
+        def decorator(handler):
+            labels = (message,)
+            @wraps(handler)
+            def timedHandler(*args, **kwargs):
+                start = time.perf_counter()
+                try:
+                    return handler(*args, **kwargs)
+                except Exception:
+                    handlerErrors.inc(labels)
+                    raise
+                finally:
+                    handlerSeconds.observe(labels, time.perf_counter() - start)
+            register(timedHandler)
+            return handler
+        return decorator
+    socketio.on = on
+
+    originalEmit = socketio.emit
+    def emit(event, *args, **kwargs):
+        target = emitTarget(kwargs.get("room", None))
+        emits.inc((event, target))
+        emitContext.target = target
+        try:
+            return originalEmit(event, *args, **kwargs)
+        finally:
+            emitContext.target = None
+    socketio.emit = emit
+
+    server = socketio.server
+    originalEmitInternal = server._emit_internal
+    def emitInternal(sid, event, *args, **kwargs):
+        emitContext.event = event
+        if emitContext.target is None:
+            emitContext.target = "remote"
+            remote = True
+        else:
+            remote = False
+        try:
+            return originalEmitInternal(sid, event, *args, **kwargs)
+        finally:
+            emitContext.event = None
+            if remote:
+                emitContext.target = None
+    server._emit_internal = emitInternal
@@ -0,0 +1,143 @@
+import gevent.lock
+from quickPoll.scheduler import PeriodicFlusher
+import quickPoll.dbFun as dbFun
+
+class RoomWriter(PeriodicFlusher):
+    """
+    Write-behind persistence of room layouts. Handlers only mark rooms as
+    changed; all changes made within an interval are written in a single
+    transaction. Rows of each room are compared with the last persisted
+    version so only changed widgets and choices are written.
+    """
+    def __init__(self, socketio, db, interval):
+        super().__init__(socketio, interval)
+        self.db = db
+        # Room id -> room, None marks a deleted room
+        self.pendingRooms = {}
+        # Room id -> rows as produced by dbFun.layoutRows last persisted
+        self.persisted = {}
+
+    def markRoom(self, room):
+        self.pendingRooms[room.id] = room
+        self.schedule()
+
+    def markDeleted(self, roomId):
+        self.pendingRooms[roomId] = None
+        self.persisted.pop(roomId, None)
+        self.schedule()
+
+    def remember(self, room):
+        """
+        Record the room as it is stored in the database, e.g., after loading
+        """
+        self.persisted[room.id] = dbFun.layoutRows(room)
+
+    def forget(self, roomId):
+        """
+        Drop the persisted version of an evicted room
+        """
+        self.persisted.pop(roomId, None)
+
+    def pending(self):
+        return len(self.pendingRooms) > 0
+
+    def hasPending(self, roomId):
+        return roomId in self.pendingRooms
+
+    def flush(self):
+        pendingRooms, self.pendingRooms = self.pendingRooms, {}
+        rooms, widgets, choices = [], [], []
+        deletedWidgets, deletedChoices, deletedIds = [], [], []
+        snapshots = {}
+        for roomId, room in pendingRooms.items():
+            if room is None:
+                deletedIds.append(roomId)
+                continue
+            roomRow, widgetRows, choiceRows = snapshots[roomId] = dbFun.layoutRows(room)
+            oldRoomRow, oldWidgetRows, oldChoiceRows = self.persisted.get(roomId, (None, {}, {}))
+            if roomRow != oldRoomRow:
+                rooms.append(roomRow)
+            widgets.extend(row for key, row in widgetRows.items() if oldWidgetRows.get(key) != row)
+            choices.extend(row for key, row in choiceRows.items() if oldChoiceRows.get(key) != row)
+            deletedWidgets.extend((roomId, key) for key in oldWidgetRows.keys()
+                if key not in widgetRows)
+            deletedChoices.extend((roomId,) + key for key in oldChoiceRows.keys()
+                if key not in choiceRows)
+        try:
+            dbFun.writeRooms(self.db, rooms, widgets, choices, deletedWidgets,
+                deletedChoices, deletedIds)
+        except Exception:
+            # Retry in the next round unless there is a newer change
+            for roomId, room in pendingRooms.items():
+                self.pendingRooms.setdefault(roomId, room)
+            raise
+        self.persisted.update(snapshots)
+
+class AnswerWriter(PeriodicFlusher):
+    """
+    Batched persistence of member answers. Changed answers are only recorded
+    and written with a multi-row upsert once per interval.
+    """
+    def __init__(self, socketio, db, interval):
+        super().__init__(socketio, interval)
+        self.db = db
+        # (room id, login, widget id) -> room
+        self.pendingAnswers = {}
+        # (room id, widget id) of deleted widgets whose answers are to be
+        # deleted
+        self.deletedWidgets = set()
+        # Held by a flush for its whole duration so that forgetting answers
+        # waits for a write that may still contain them
+        self.lock = gevent.lock.RLock()
+
+    def markAnswers(self, room, username, widgetIds):
+        for widgetId in widgetIds:
+            self.pendingAnswers[(room.id, username, widgetId)] = room
+        self.schedule()
+
+    def forget(self, roomId):
+        """
+        Drop pending answers of a deleted room
+        """
+        with self.lock:
+            self.pendingAnswers = { key: room for key, room in self.pendingAnswers.items()
+                if key[0] != roomId }
+            self.deletedWidgets = set(key for key in self.deletedWidgets
+                if key[0] != roomId)
+
+    def forgetWidget(self, roomId, widgetId):
+        """
+        Drop pending answers of a deleted widget and delete the stored ones
+        """
+        with self.lock:
+            self.pendingAnswers = { key: room for key, room in self.pendingAnswers.items()
+                if key[0] != roomId or key[2] != widgetId }
+            self.deletedWidgets.add((roomId, widgetId))
+        self.schedule()
+
+    def pending(self):
+        return len(self.pendingAnswers) > 0 or len(self.deletedWidgets) > 0
+
+    def hasPending(self, roomId):
+        return any(key[0] == roomId for key in self.pendingAnswers) \
+            or any(key[0] == roomId for key in self.deletedWidgets)
+
+    def flush(self):
+        with self.lock:
+            pendingAnswers, self.pendingAnswers = self.pendingAnswers, {}
+            deletedWidgets, self.deletedWidgets = self.deletedWidgets, set()
+            answers = []
+            deletedAnswers = []
+            for (roomId, username, widgetId), room in pendingAnswers.items():
+                answer = room.getMemberAnswers(username).get(widgetId, None)
+                if answer is None:
+                    deletedAnswers.append((roomId, username, widgetId))
+                else:
+                    answers.append((roomId, username, widgetId, answer))
+            try:
+                dbFun.writeAnswers(self.db, answers, deletedAnswers, list(deletedWidgets))
+            except Exception:
+                for key, room in pendingAnswers.items():
+                    self.pendingAnswers.setdefault(key, room)
+                self.deletedWidgets |= deletedWidgets
+                raise
@@ -1,131 +1,554 @@
 from random_words import RandomWords
+from quickPoll.widgets import layoutProperty
+from quickPoll.collection import IndexedList
+from quickPoll.answers import AnswerStore
+import gevent.lock
+import hashlib
+import json
+import time
+
+def contentTag(text):
+    """
+    Return a short hash of the text identifying a version of the content
+    independently of the worker and of restarts
+    """
+    return hashlib.blake2b(text.encode("utf-8"), digest_size=8).hexdigest()
 
 class Room:
+    __slots__ = ("_id", "_name", "_description", "_author", "widgets",
+        "widgetIdCounter", "layoutRevision", "layoutCache", "memberSessions",
+        "sessionMembers", "memberAnswers", "members", "answerTimes", "revision")
+
+    id = layoutProperty("id")
+    name = layoutProperty("name")
+    description = layoutProperty("description")
+    author = layoutProperty("author")
+
     def __init__(self, id, name="", author="", description=""):
+        self.layoutRevision = 0
+        # Key -> (layout revision, cached value)
+        self.layoutCache = {}
         self.id = id
         self.name = name
         self.description = description
         self.author = author
-        self.widgets = []
+        self.widgets = IndexedList()
 
         self.widgetIdCounter = 0
         self.memberSessions = {}
-        self.memberAnswers = {}
-        self.members = []
+        self.sessionMembers = {}
+        self.memberAnswers = AnswerStore()
+        # Ordered set of everyone who has ever joined; only keys are used
+        self.members = {}
+        # Username -> time.time() of the last answer change
+        self.answerTimes = {}
+        self.revision = 0
 
     def widget(self, id):
-        for w in self.widgets:
-            if w.id == id:
-                return w
-        return None
-
-    def addWidget(self, widget):
-        self.widgetIdCounter += 1
-        widget.id = self.widgetIdCounter
+        return self.widgets.get(id)
+
+    def addWidget(self, widget, keepId=False):
+        if keepId:
+            self.widgetIdCounter = max(self.widgetIdCounter, widget.id)
+        else:
+            self.widgetIdCounter += 1
+            widget.id = self.widgetIdCounter
+        widget.room = self
         self.widgets.append(widget)
-        return self.widgets[-1]
+        self.layoutChanged()
+        return widget
+
+    def idCounters(self):
+        """
+        Return the widget id counter and the choice id counters by widget id
+        (as strings). They are stored with the layout so that ids of deleted
+        widgets and choices are never given to new ones; stored answers may
+        still refer to them.
+        """
+        return {
+            "widgets": self.widgetIdCounter,
+            "choices": { str(w.id): w.choiceIdCounter for w in self.widgets
+                if w.type() == "choice" }
+        }
+
+    def restoreIdCounters(self, counters):
+        """
+        Raise the id counters to the ones returned by idCounters
+        """
+        self.widgetIdCounter = max(self.widgetIdCounter, counters["widgets"])
+        for strId, counter in counters["choices"].items():
+            widget = self.widgets.get(int(strId))
+            if widget is not None and widget.type() == "choice":
+                widget.choiceIdCounter = max(widget.choiceIdCounter, counter)
+
+    def applyLayout(self, layout, buildWidget):
+        """
+        Make the room match the teacher layout, e.g., when the layout was
+        changed by another worker. Existing widgets are updated in place and
+        only new widgets and widgets whose choices changed are recounted and
+        get their answers repaired.
+        buildWidget creates a widget from its layout.
+        """
+        for name in ["name", "description", "author"]:
+            if getattr(self, name) != layout[name]:
+                setattr(self, name, layout[name])
+        widgets = IndexedList()
+        recount = []
+        for widgetLayout in layout["widgets"]:
+            widget = self.widgets.get(widgetLayout["id"])
+            if widget is None or widget.type() != widgetLayout["type"]:
+                widget = buildWidget(widgetLayout)
+                widget.room = self
+                self.widgetIdCounter = max(self.widgetIdCounter, widget.id)
+                recount.append(widget)
+            elif widget.applyLayout(widgetLayout):
+                recount.append(widget)
+            widgets.append(widget)
+        for widgetId in list(self.memberAnswers.columns.keys()):
+            widget = widgets.get(widgetId)
+            # Deleted or replaced by a widget of another type
+            if widget is None or widget is not self.widgets.get(widgetId):
+                self.memberAnswers.dropWidget(widgetId)
+        if list(widgets) != list(self.widgets):
+            self.widgets = widgets
+            self.layoutChanged()
+        for widget in recount:
+            widget.repairAnswers()
 
     def deleteWidget(self, id):
-        for i, w in enumerate(self.widgets):
-            if w.id == id:
-                del self.widgets[i]
-                return
+        if self.widgets.remove(id) is not None:
+            self.memberAnswers.dropWidget(id)
+            self.layoutChanged()
 
     def reorderWidgets(self, widgetIdList):
-        widgetDict = {w.id: w for w in self.widgets}
-        self.widgets = list([widgetDict[wId] for wId in widgetIdList])
+        self.widgets.reorder(widgetIdList)
+        self.layoutChanged()
+
+    def layoutChanged(self):
+        """
+        Invalidate cached layouts, called on every layout modification
+        """
+        self.layoutRevision += 1
+
+    def cachedLayout(self, key, build):
+        """
+        Return the value built by build for the current layout revision
+        """
+        cached = self.layoutCache.get(key, None)
+        if cached is None or cached[0] != self.layoutRevision:
+            cached = self.layoutCache[key] = (self.layoutRevision, build())
+        return cached[1]
+
+    def nextRevision(self):
+        """
+        Bump and return the revision of the teacher view of the room. Teachers
+        use it to detect missed delta updates.
+        """
+        self.revision += 1
+        return self.revision
 
     def getMemberSession(self, username):
         return self.memberSessions.get(username, None)
 
     def join(self, username, sessionId):
+        """
+        Join member with given session. Return the previous session of the
+        member if it was replaced, None otherwise.
+        """
+        previousSession = self.memberSessions.get(username, None)
+        if previousSession is not None:
+            del self.sessionMembers[previousSession]
         self.memberSessions[username] = sessionId
-        self.members.append(username)
+        self.sessionMembers[sessionId] = username
+        self.members[username] = None
+        if previousSession == sessionId:
+            return None
+        return previousSession
 
     def leave(self, sessionId):
-        for username, session in self.memberSessions.items():
-            if session != sessionId:
-                continue
-            del self.memberSessions[username]
-            return True
-        return False
+        """
+        Leave the room, return the username of the leaving member or None if
+        the session was not joined
+        """
+        username = self.sessionMembers.pop(sessionId, None)
+        if username is None:
+            return None
+        del self.memberSessions[username]
+        return username
+
+    def widgetIndex(self):
+        """
+        Return widgets by their ids as strings, i.e., as they arrive in answers
+        """
+        return self.cachedLayout("widgetIndex",
+            lambda: { str(w.id): w for w in self.widgets })
 
     def pruneAnswers(self, answers):
         """
         Remove answers that do not match the current layout
         """
+        widgets = self.widgetIndex()
         prunedAnswers = {}
-        for widget in self.widgets:
-            strId = str(widget.id)
-            if strId not in answers.keys():
-                continue
-            if widget.isValidAnswer(answers[strId]):
-                prunedAnswers[widget.id] = answers[strId]
+        for strId, answer in answers.items():
+            widget = widgets.get(strId, None)
+            if widget is not None and widget.isValidAnswer(answer):
+                prunedAnswers[widget.id] = widget.normalizeAnswer(answer)
         return prunedAnswers
 
     def updateAnswers(self, username, answers):
-        self.memberAnswers[username] = self.pruneAnswers(answers)
+        """
+        Replace member answers, return ids of widgets whose answer changed
+        """
+        oldAnswers = self.memberAnswers.get(username)
+        newAnswers = self.pruneAnswers(answers)
+        changed = []
+        for widgetId in oldAnswers.keys() | newAnswers.keys():
+            oldAnswer = oldAnswers.get(widgetId, None)
+            newAnswer = newAnswers.get(widgetId, None)
+            widget = self.widgets.get(widgetId)
+            if oldAnswer != newAnswer and widget is not None:
+                widget.updateStatistics(oldAnswer, newAnswer)
+                changed.append(widgetId)
+        self.memberAnswers.update(username,
+            { widgetId: newAnswers.get(widgetId, None) for widgetId in changed })
+        if len(changed) > 0:
+            self.answerTimes[username] = time.time()
+        return changed
+
+    def patchAnswers(self, username, patch):
+        """
+        Change answers of given widgets only, patch maps widget ids (strings)
+        to the new answer or None to clear it. Invalid answers are ignored.
+        Return ids of widgets whose answer changed.
+        """
+        widgets = self.widgetIndex()
+        changes = {}
+        for strId, answer in patch.items():
+            widget = widgets.get(strId, None)
+            if widget is None:
+                continue
+            if answer is not None:
+                if not widget.isValidAnswer(answer):
+                    continue
+                answer = widget.normalizeAnswer(answer)
+            oldAnswer = self.memberAnswers.getAnswer(username, widget.id)
+            if oldAnswer != answer:
+                widget.updateStatistics(oldAnswer, answer)
+                changes[widget.id] = answer
+        if len(changes) > 0:
+            self.members[username] = None
+            self.memberAnswers.update(username, changes)
+            self.answerTimes[username] = time.time()
+        return list(changes.keys())
+
+    def rebuildStatistics(self):
+        for widget in self.widgets:
+            widget.rebuildStatistics()
+
+    def validAnswers(self, answers):
+        """
+        Return the valid part of stored answers by widget id. Answers stored
+        before a layout change keep what is still valid, e.g., choices that
+        were not deleted meanwhile.
+        """
+        widgets = self.widgetIndex()
+        valid = {}
+        for widgetId, answer in answers.items():
+            widget = widgets.get(str(widgetId), None)
+            if widget is not None:
+                answer = widget.restoreAnswer(answer)
+                if answer is not None:
+                    valid[widget.id] = answer
+        return valid
+
+    def restoreAnswers(self, username, answers):
+        """
+        Restore answers of a member who joined before the server restart,
+        see validAnswers
+        """
+        self.members[username] = None
+        self.updateAnswers(username,
+            { str(widgetId): answer for widgetId, answer in self.validAnswers(answers).items() })
+        # The time of the original answer is not known
+        self.answerTimes.pop(username, None)
+
+    def statistics(self):
+        """
+        Return aggregated answers for widgets supporting it
+        """
+        statistics = {}
+        for widget in self.widgets:
+            s = widget.statistics()
+            if s is not None:
+                statistics[widget.id] = s
+        return statistics
+
+    def statisticsDelta(self):
+        """
+        Return aggregated answers changed since the last call; text widgets
+        report only the changed groups and tokens
+        """
+        statistics = {}
+        for widget in self.widgets:
+            s = widget.statisticsDelta()
+            if s is not None:
+                statistics[widget.id] = s
+        return statistics
+
+    def trackStatistics(self, enabled):
+        """
+        Start or stop collecting changes for statisticsDelta
+        """
+        for widget in self.widgets:
+            widget.trackStatistics(enabled)
 
     def studentLayout(self):
-        return {
+        """
+        Return layout for students. The result is shared, do not modify it.
+        """
+        return self.cachedLayout("student", lambda: {
             "id": self.id,
             "name": self.name,
             "description": self.description,
             "widgets": list([x.layout() for x in self.widgets if x.visible])
-        }
+        })
 
     def teacherLayout(self):
-        return {
+        """
+        Return layout for teachers. The result is shared, do not modify it.
+        """
+        return self.cachedLayout("teacher", lambda: {
             "id": self.id,
             "name": self.name,
             "description": self.description,
             "author": self.author,
             "widgets": list([x.layout() for x in self.widgets])
-        }
+        })
+
+    def encodedStudentLayout(self):
+        """
+        Return the student layout encoded as JSON
+        """
+        return self.cachedLayout("studentJson",
+            lambda: json.dumps(self.studentLayout(), separators=(",", ":")))
+
+    def studentLayoutTag(self):
+        """
+        Return the tag of the student layout, see contentTag
+        """
+        return self.cachedLayout("studentTag",
+            lambda: contentTag(self.encodedStudentLayout()))
+
+    def encodedTeacherLayout(self):
+        """
+        Return the teacher layout encoded as JSON
+        """
+        return self.cachedLayout("teacherJson",
+            lambda: json.dumps(self.teacherLayout(), separators=(",", ":")))
+
+    def memberAnswersTag(self, username):
+        """
+        Return the tag of the member answers, maintained with every change
+        """
+        return self.memberAnswers.tag(username)
 
     def getMemberAnswers(self, username):
-        if username not in self.memberAnswers:
-            return {}
-        return self.memberAnswers[username]
+        return self.memberAnswers.get(username)
 
     def getMembersAnswers(self):
         return { username: self.getMemberAnswers(username) for username in self.members}
 
 class RoomSuite:
-    def __init__(self):
+    """
+    All rooms of the worker. Rooms are hydrated lazily: stored rooms are known
+    only by their summary (id, name, author) until they are accessed, and
+    idle rooms can be evicted back to the summary.
+    """
+    __slots__ = ("rooms", "index", "lastUsed", "loader", "onHydrated", "loading",
+        "evictedMembers", "sessions", "wordsGenerator")
+
+    def __init__(self, loader=None, onHydrated=None):
+        # Hydrated rooms
         self.rooms = {}
+        # Room id -> summary of rooms that are not hydrated
+        self.index = {}
+        # Room id -> time.monotonic() of the last access of a hydrated room
+        self.lastUsed = {}
+        # Callable building the room with given id from the storage
+        self.loader = loader
+        # Callable restoring state of a freshly hydrated room, called once the
+        # room is registered
+        self.onHydrated = onHydrated
+        # Room id -> lock held while the room is being hydrated
+        self.loading = {}
+        # Room id -> members of an evicted room; members who never answered
+        # cannot be restored from the stored answers
+        self.evictedMembers = {}
+        # Session id -> {room id: username}
+        self.sessions = {}
         self.wordsGenerator = RandomWords()
 
     def generateId(self):
         idWords = [self.wordsGenerator.random_word() for _ in range(3)]
         idString = "".join([x.capitalize() for x in idWords])
-        if idString in self.rooms.keys():
+        if self.hasRoom(idString):
             return self.generateId()
         return idString
 
     def addExistingRoom(self, room):
         if room.id is None:
             room.id = self.generateId()
+        self.index.pop(room.id, None)
         self.rooms[room.id] = room
+        self.lastUsed[room.id] = time.monotonic()
 
     def addRoom(self, id=None, **kwargs):
         if id is None:
             id = self.generateId()
-        self.rooms[id] = Room(id, **kwargs)
+        self.addExistingRoom(Room(id, **kwargs))
         return self.rooms[id]
 
+    def addSummary(self, summary):
+        """
+        Register a stored room without hydrating it. The summary is a
+        dictionary with keys id, name and author.
+        """
+        if summary["id"] not in self.rooms:
+            self.index[summary["id"]] = summary
+
     def hasRoom(self, id):
-        return id in self.rooms.keys()
+        return id in self.rooms or id in self.index
+
+    def loadedRoom(self, id):
+        """
+        Return the room if it is hydrated, None otherwise
+        """
+        return self.rooms.get(id, None)
 
     def getRoom(self, id):
-        return self.rooms[id]
+        """
+        Return the room, hydrate it if necessary. Raise KeyError if there is
+        no such room.
+        """
+        room = self.rooms.get(id, None)
+        if (room is None and id in self.index) or id in self.loading:
+            room = self.hydrate(id)
+        if room is None:
+            raise KeyError(id)
+        self.lastUsed[id] = time.monotonic()
+        return room
+
+    def hydrate(self, id):
+        """
+        Load the room unless it is loaded already. Only one greenlet loads a
+        room, others asking for it wait until it is fully restored.
+        """
+        lock = self.loading.get(id, None)
+        if lock is None:
+            lock = self.loading[id] = gevent.lock.Semaphore()
+        try:
+            with lock:
+                if id in self.rooms or id not in self.index:
+                    return self.rooms.get(id, None)
+                room = self.loader(id)
+                # The room might have been deleted while loading
+                if room is None or id not in self.index:
+                    self.index.pop(id, None)
+                    self.evictedMembers.pop(id, None)
+                    return None
+                room.members = dict.fromkeys(
+                    list(self.evictedMembers.pop(id, [])) + list(room.members.keys()))
+                self.addExistingRoom(room)
+                if self.onHydrated is not None:
+                    self.onHydrated(room)
+                return room
+        finally:
+            if self.loading.get(id, None) is lock:
+                del self.loading[id]
+
+    def summary(self, id):
+        """
+        Return summary of the room: id, name, author and the number of active
+        members; None if there is no such room
+        """
+        room = self.rooms.get(id, None)
+        if room is None:
+            summary = self.index.get(id, None)
+            return None if summary is None else dict(summary, activeMembers=0)
+        return {
+            "id": room.id,
+            "name": room.name,
+            "author": room.author,
+            "activeMembers": len(room.memberSessions)
+        }
+
+    def summaries(self):
+        """
+        Return summaries of all rooms
+        """
+        return [self.summary(id) for id in list(self.rooms.keys()) + list(self.index.keys())]
+
+    def evictIdle(self, timeout, isBusy):
+        """
+        Evict rooms without sessions that were not accessed for timeout
+        seconds and for which isBusy(room) is False. Return the evicted ids.
+        """
+        limit = time.monotonic() - timeout
+        evicted = []
+        for id, room in list(self.rooms.items()):
+            if self.lastUsed.get(id, 0) > limit or len(room.sessionMembers) > 0 or isBusy(room):
+                continue
+            del self.rooms[id]
+            self.lastUsed.pop(id, None)
+            self.evictedMembers[id] = list(room.members.keys())
+            self.index[id] = {
+                "id": id,
+                "name": room.name,
+                "author": room.author
+            }
+            evicted.append(id)
+        return evicted
+
+    def join(self, room, username, sessionId):
+        previousSession = room.join(username, sessionId)
+        if previousSession is not None:
+            self.forgetSession(previousSession, room.id)
+        self.sessions.setdefault(sessionId, {})[room.id] = username
+        self.lastUsed[room.id] = time.monotonic()
+
+    def forgetSession(self, sessionId, roomId):
+        roomSessions = self.sessions.get(sessionId, None)
+        if roomSessions is None:
+            return
+        roomSessions.pop(roomId, None)
+        if len(roomSessions) == 0:
+            del self.sessions[sessionId]
+
+    def leaveRoom(self, room, sessionId):
+        """
+        Leave a single room with given session
+        """
+        self.forgetSession(sessionId, room.id)
+        return room.leave(sessionId)
 
     def leave(self, sessionId, onLeave=None):
-        for room in self.rooms.values():
-            if room.leave(sessionId) and onLeave is not None:
-                onLeave(room)
+        """
+        Leave all rooms joined with given session
+        """
+        for roomId in self.sessions.pop(sessionId, {}).keys():
+            room = self.rooms.get(roomId, None)
+            if room is None:
+                continue
+            username = room.leave(sessionId)
+            if username is not None and onLeave is not None:
+                onLeave(room, username)
 
     def deleteRoom(self, roomId):
+        self.index.pop(roomId, None)
+        self.evictedMembers.pop(roomId, None)
         if roomId not in self.rooms:
             return
+        for sessionId in self.rooms[roomId].sessionMembers.keys():
+            self.forgetSession(sessionId, roomId)
         del self.rooms[roomId]
+        self.lastUsed.pop(roomId, None)
@@ -0,0 +1,134 @@
+from abc import ABC, abstractmethod
+import sys
+import traceback
+
+class PeriodicFlusher(ABC):
+    """
+    Collects pending work and flushes it from a background task at most once
+    per interval. The task runs only while there is something to flush.
+    """
+    def __init__(self, socketio, interval):
+        self.socketio = socketio
+        self.interval = interval
+        self.task = None
+
+    def schedule(self):
+        if self.task is None:
+            self.task = self.socketio.start_background_task(self.run)
+
+    def run(self):
+        try:
+            while self.pending():
+                self.socketio.sleep(self.interval)
+                self.flushAll()
+        finally:
+            self.task = None
+
+    def flushAll(self):
+        """
+        Flush everything pending now, e.g., on shutdown
+        """
+        if not self.pending():
+            return
+        try:
+            self.flush()
+        except Exception as e:
+            print("Warning, {} flush failed".format(type(self).__name__),
+                file=sys.stderr)
+            traceback.print_exc()
+
+    @abstractmethod
+    def pending(self):
+        """
+        Return True if there is anything to flush
+        """
+
+    @abstractmethod
+    def flush(self):
+        """
+        Write or send everything pending
+        """
+
+class BroadcastScheduler(PeriodicFlusher):
+    """
+    Coalesces teacher broadcasts. Rooms are marked dirty and the overviews are
+    sent at most once per interval no matter how many events happened.
+    """
+    def __init__(self, socketio, interval, sendRoom, sendMembers, sendRooms):
+        super().__init__(socketio, interval)
+        self.sendRoom = sendRoom
+        self.sendMembers = sendMembers
+        self.sendRooms = sendRooms
+
+        self.dirtyRooms = {}
+        self.dirtyMembers = {}
+        # Ids of rooms whose summary in the rooms overview changed
+        self.dirtyRoomIds = set()
+
+        self.events = 0
+        self.broadcasts = 0
+
+    def markRoom(self, room):
+        """
+        Schedule full overview of the room
+        """
+        self.events += 1
+        self.dirtyRooms[room.id] = room
+        self.dirtyMembers.pop(room.id, None)
+        self.schedule()
+
+    def markMember(self, room, username):
+        """
+        Schedule delta update of member answers
+        """
+        self.events += 1
+        if room.id not in self.dirtyRooms:
+            self.dirtyMembers.setdefault(room.id, (room, set()))[1].add(username)
+        self.schedule()
+
+    def markRooms(self, roomId):
+        """
+        Schedule update of the room in the overview of all rooms
+        """
+        self.events += 1
+        self.dirtyRoomIds.add(roomId)
+        self.schedule()
+
+    def forget(self, roomId):
+        """
+        Drop pending updates of a deleted room
+        """
+        self.dirtyRooms.pop(roomId, None)
+        self.dirtyMembers.pop(roomId, None)
+
+    def hasPending(self, roomId):
+        return roomId in self.dirtyRooms or roomId in self.dirtyMembers
+
+    def pending(self):
+        return len(self.dirtyRoomIds) > 0 or len(self.dirtyRooms) > 0 or len(self.dirtyMembers) > 0
+
+    def flush(self):
+        dirtyRooms, self.dirtyRooms = self.dirtyRooms, {}
+        dirtyMembers, self.dirtyMembers = self.dirtyMembers, {}
+        dirtyRoomIds, self.dirtyRoomIds = self.dirtyRoomIds, set()
+
+        for room in dirtyRooms.values():
+            self.sendRoom(room)
+            self.broadcasts += 1
+        for room, usernames in dirtyMembers.values():
+            self.sendMembers(room, usernames)
+            self.broadcasts += 1
+        if len(dirtyRoomIds) > 0:
+            self.sendRooms(dirtyRoomIds)
+            self.broadcasts += 1
+
+    def stats(self):
+        """
+        Return counters of scheduled events and of broadcasts actually sent
+        """
+        return {
+            "interval": self.interval,
+            "events": self.events,
+            "broadcasts": self.broadcasts,
+            "absorbed": self.events - self.broadcasts
+        }
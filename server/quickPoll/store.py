@@ -0,0 +1,218 @@
+import json
+import sys
+import time
+import uuid
+
+CHANNEL = "quickpoll:operations"
+# Sorted set of worker ids scored by the time of their last heartbeat
+WORKERS = "quickpoll:workers"
+HEARTBEAT_INTERVAL = 10
+# Sessions of a worker without a heartbeat for this many seconds are released
+WORKER_TIMEOUT = 30
+# Answers of a room expire after this many seconds without a change; by then
+# they are persisted in the database
+ANSWERS_TTL = 3600
+# Remove a session (KEYS[1] sessions hash, ARGV[1] username) only if it still
+# is the given one (ARGV[2] sid); sessions are stored as JSON [sid, worker id]
+LEAVE_SCRIPT = """
+    local session = redis.call("HGET", KEYS[1], ARGV[1])
+    if session and cjson.decode(session)[1] == ARGV[2] then
+        return redis.call("HDEL", KEYS[1], ARGV[1])
+    end
+    return 0"""
+
+class LocalStore:
+    """
+    State store of a single worker; the in-memory rooms are the only copy of
+    sessions and answers
+    """
+    # Whether published operations reach anybody; callers skip building
+    # expensive operations otherwise
+    shared = False
+    def loadRoom(self, roomSuite, room):
+        """
+        Restore shared state into a freshly hydrated room
+        """
+        pass
+
+    def publish(self, operation):
+        """
+        Record a state change made by this worker and announce it to the
+        other workers
+        """
+        pass
+
+    def listen(self, apply, sleep):
+        """
+        Apply operations published by other workers, runs forever
+        """
+        pass
+
+    def heartbeat(self, apply, sleep):
+        """
+        Keep this worker registered and release sessions of workers that
+        stopped without a clean shutdown, runs forever
+        """
+        pass
+
+    def close(self):
+        """
+        Release sessions owned by this worker on shutdown
+        """
+        pass
+
+    def nextRevision(self, room):
+        return room.nextRevision()
+
+    def syncRevision(self, room):
+        """
+        Make room.revision reflect updates made by other workers
+        """
+        pass
+
+class RedisStore(LocalStore):
+    """
+    State shared by several workers or nodes via Redis (or any server speaking
+    its protocol). Sessions, answers and room revisions are kept in Redis so a
+    starting worker can catch up; every change is also published so the other
+    workers can update their in-memory rooms.
+
+    Operations are dictionaries with keys "op" (one of join, leave, answers,
+    layout, deleteRoom), "room" and the operation specific arguments.
+
+    Each session is stored together with the id of the worker owning its
+    socket. Workers refresh a heartbeat; sessions of a worker whose heartbeat
+    expired are released by the first worker noticing it.
+    """
+    shared = True
+    def __init__(self, url, client=None):
+        """
+        Connect to the store at given URL unless a client object is given
+        """
+        if client is None:
+            import redis
+            client = redis.Redis.from_url(url)
+        self.redis = client
+        self.workerId = uuid.uuid4().hex
+        self.leaveScript = self.redis.register_script(LEAVE_SCRIPT)
+        self.redis.zadd(WORKERS, { self.workerId: time.time() })
+
+    @staticmethod
+    def key(kind, roomId):
+        return "quickpoll:{}:{}".format(kind, roomId)
+
+    def loadRoom(self, roomSuite, room):
+        for username, answers in self.redis.hgetall(self.key("answers", room.id)).items():
+            room.restoreAnswers(username.decode("utf-8"), json.loads(answers))
+        aliveWorkers = self.aliveWorkers()
+        for username, session in self.redis.hgetall(self.key("sessions", room.id)).items():
+            try:
+                sid, worker = json.loads(session)
+            except ValueError:
+                # Session stored by an older version without the owner
+                continue
+            if worker in aliveWorkers:
+                roomSuite.join(room, username.decode("utf-8"), sid)
+        self.syncRevision(room)
+
+    def aliveWorkers(self):
+        limit = time.time() - WORKER_TIMEOUT
+        return set(x.decode("utf-8") for x in self.redis.zrangebyscore(WORKERS, limit, "+inf"))
+
+    def publish(self, operation):
+        operation = dict(operation, worker=self.workerId)
+        kind = operation["op"]
+        roomId = operation["room"]
+        pipe = self.redis.pipeline(transaction=False)
+        if kind == "join":
+            pipe.hset(self.key("sessions", roomId), operation["username"],
+                json.dumps([operation["sid"], self.workerId]))
+            pipe.sadd(self.key("workerSessions", self.workerId),
+                json.dumps([roomId, operation["username"], operation["sid"]]))
+        elif kind == "leave":
+            self.leaveScript(keys=[self.key("sessions", roomId)],
+                args=[operation["username"], operation["sid"]], client=pipe)
+            pipe.srem(self.key("workerSessions", self.workerId),
+                json.dumps([roomId, operation["username"], operation["sid"]]))
+        elif kind == "answers":
+            pipe.hset(self.key("answers", roomId), operation["username"],
+                json.dumps(operation["answers"]))
+            pipe.expire(self.key("answers", roomId), ANSWERS_TTL)
+        elif kind == "deleteRoom":
+            pipe.delete(self.key("sessions", roomId), self.key("answers", roomId),
+                self.key("revision", roomId))
+        pipe.publish(CHANNEL, json.dumps(operation))
+        pipe.execute()
+
+    def releaseSessions(self, worker, apply=None):
+        """
+        Publish leave of all sessions of the worker, apply them locally when
+        apply is given
+        """
+        key = self.key("workerSessions", worker)
+        for entry in self.redis.smembers(key):
+            roomId, username, sid = json.loads(entry)
+            operation = {
+                "op": "leave",
+                "room": roomId,
+                "username": username,
+                "sid": sid
+            }
+            self.publish(operation)
+            if apply is not None:
+                apply(operation)
+        self.redis.delete(key)
+
+    def heartbeat(self, apply, sleep):
+        while True:
+            try:
+                now = time.time()
+                self.redis.zadd(WORKERS, { self.workerId: now })
+                for worker in self.redis.zrangebyscore(WORKERS, "-inf", now - WORKER_TIMEOUT):
+                    # Only the worker that manages to remove it releases the
+                    # sessions
+                    if self.redis.zrem(WORKERS, worker) == 1:
+                        self.releaseSessions(worker.decode("utf-8"), apply)
+            except Exception as e:
+                print("Warning, store heartbeat failed: {}".format(e), file=sys.stderr)
+            sleep(HEARTBEAT_INTERVAL)
+
+    def close(self):
+        self.redis.zrem(WORKERS, self.workerId)
+        self.releaseSessions(self.workerId)
+
+    def listen(self, apply, sleep, retryDelay=5):
+        while True:
+            try:
+                pubsub = self.redis.pubsub(ignore_subscribe_messages=True)
+                pubsub.subscribe(CHANNEL)
+                for message in pubsub.listen():
+                    # A failing operation must not drop the subscription,
+                    # operations published meanwhile would be lost
+                    try:
+                        operation = json.loads(message["data"])
+                        if operation["worker"] != self.workerId:
+                            apply(operation)
+                    except Exception as e:
+                        print("Warning, applying store operation failed: {}".format(e),
+                            file=sys.stderr)
+            except Exception as e:
+                print("Warning, store listener failed: {}".format(e), file=sys.stderr)
+            sleep(retryDelay)
+
+    def nextRevision(self, room):
+        room.revision = self.redis.incr(self.key("revision", room.id))
+        return room.revision
+
+    def syncRevision(self, room):
+        revision = self.redis.get(self.key("revision", room.id))
+        if revision is not None:
+            room.revision = max(room.revision, int(revision))
+
+def createStore(url):
+    """
+    Create store for given URL, None means a single worker deployment
+    """
+    if url is None:
+        return LocalStore()
+    return RedisStore(url)
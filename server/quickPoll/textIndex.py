@@ -0,0 +1,103 @@
+import re
+import unicodedata
+
+TOKEN = re.compile(r"\w+")
+
+def normalizeText(text):
+    """
+    Fold case, strip diacritics and collapse whitespace so that trivially
+    different answers fall into the same group
+    """
+    decomposed = unicodedata.normalize("NFKD", text.casefold())
+    stripped = "".join(c for c in decomposed if not unicodedata.combining(c))
+    return " ".join(stripped.split())
+
+class TextIndex:
+    """
+    Incrementally maintained groups of equal normalized text answers with
+    their counts and a table of token frequencies (number of answers
+    containing the token). Keys changed since the last delta are tracked so
+    that only they are sent to the teachers. Tracking starts with the first
+    delta and stops when nobody asks for deltas or when the delta would not
+    be smaller than the full statistics.
+    """
+    __slots__ = ("groups", "tokens", "respondents", "dirtyGroups", "dirtyTokens")
+
+    def __init__(self):
+        # Normalized text -> [first raw text, count]
+        self.groups = {}
+        self.tokens = {}
+        self.respondents = 0
+        # Keys changed since the last delta, None while not tracking
+        self.dirtyGroups = None
+        self.dirtyTokens = None
+
+    def add(self, text, delta):
+        key = normalizeText(text)
+        if key == "":
+            return
+        group = self.groups.get(key, None)
+        if group is None:
+            group = self.groups[key] = [text, 0]
+        group[1] += delta
+        if group[1] == 0:
+            del self.groups[key]
+        self.respondents += delta
+        tokens = set(TOKEN.findall(key))
+        for token in tokens:
+            count = self.tokens.get(token, 0) + delta
+            if count == 0:
+                del self.tokens[token]
+            else:
+                self.tokens[token] = count
+        if self.dirtyGroups is not None:
+            self.dirtyGroups.add(key)
+            self.dirtyTokens.update(tokens)
+            if len(self.dirtyGroups) + len(self.dirtyTokens) > len(self.groups) + len(self.tokens):
+                self.track(False)
+
+    def update(self, oldText, newText):
+        if oldText == newText:
+            return
+        if oldText is not None:
+            self.add(oldText, -1)
+        if newText is not None:
+            self.add(newText, 1)
+
+    def group(self, key):
+        group = self.groups.get(key, None)
+        if group is None:
+            return { "text": None, "count": 0 }
+        return { "text": group[0], "count": group[1] }
+
+    def statistics(self):
+        return {
+            "groups": { key: self.group(key) for key in self.groups.keys() },
+            "tokens": dict(self.tokens),
+            "respondents": self.respondents
+        }
+
+    def track(self, enabled):
+        """
+        Start tracking changes for the next delta from now on or stop
+        tracking them
+        """
+        self.dirtyGroups = set() if enabled else None
+        self.dirtyTokens = set() if enabled else None
+
+    def delta(self):
+        """
+        Return groups and tokens changed since the last call; removed ones
+        have count 0. If changes were not tracked, return the full statistics
+        marked with "full": True so that the receiver replaces its copy.
+        """
+        if self.dirtyGroups is None:
+            delta = dict(self.statistics(), full=True)
+        else:
+            delta = {
+                "groups": { key: self.group(key) for key in self.dirtyGroups },
+                "tokens": { token: self.tokens.get(token, 0) for token in self.dirtyTokens },
+                "respondents": self.respondents
+            }
+        self.track(True)
+        return delta
@@ -1,11 +1,40 @@
 
+from quickPoll.collection import IndexedList
+from quickPoll.textIndex import TextIndex
+
+def layoutProperty(name):
+    """
+    Attribute that notifies its owner about the layout change when set
+    """
+    attribute = "_" + name
+
+    def get(self):
+        return getattr(self, attribute)
+
+    def set(self, value):
+        setattr(self, attribute, value)
+        self.layoutChanged()
+
+    return property(get, set)
+
 class Widget:
+    __slots__ = ("room", "id", "_name", "_description", "_visible")
+
+    name = layoutProperty("name")
+    description = layoutProperty("description")
+    visible = layoutProperty("visible")
+
     def __init__(self, name):
+        self.room = None
         self.id = None
         self.name = name
         self.description = ""
         self.visible = False
 
+    def layoutChanged(self):
+        if self.room is not None:
+            self.room.layoutChanged()
+
     def layout(self):
         """
         Return layout of the widget as dictionary
@@ -18,11 +47,104 @@ class Widget:
             "description": self.description,
         }
 
+    def applyLayout(self, layout):
+        """
+        Update the widget in place to match its layout as returned by
+        layout(), e.g., when it was changed by another worker. Return True if
+        the statistics have to be recounted.
+        """
+        for name in ["name", "description", "visible"]:
+            if getattr(self, name) != layout[name]:
+                setattr(self, name, layout[name])
+        return False
+
+    def normalizeAnswer(self, answer):
+        """
+        Return canonical form of a valid answer
+        """
+        return answer
+
+    def answerText(self, answer):
+        """
+        Return human readable form of the answer, e.g., for exports
+        """
+        return "" if answer is None else str(answer)
+
+    def restoreAnswer(self, answer):
+        """
+        Return the valid part of an answer stored before a layout change in
+        its canonical form, None if nothing valid is left
+        """
+        return self.normalizeAnswer(answer) if self.isValidAnswer(answer) else None
+
+    def repairAnswers(self):
+        """
+        Make the stored answers valid after a layout change and recount the
+        statistics. Return usernames of members whose answer changed.
+        """
+        changes = {}
+        if self.room is not None:
+            for username, answer in self.room.memberAnswers.memberAnswers(self.id):
+                repaired = self.restoreAnswer(answer)
+                if repaired != answer:
+                    changes[username] = repaired
+            for username, answer in changes.items():
+                self.room.memberAnswers.update(username, { self.id: answer })
+        self.rebuildStatistics()
+        return list(changes.keys())
+
+    def updateStatistics(self, oldAnswer, newAnswer):
+        """
+        Account for a member changing the answer from oldAnswer to newAnswer.
+        Missing answers are passed as None.
+        """
+        pass
+
+    def statistics(self):
+        """
+        Return aggregated answers of the widget or None if not supported
+        """
+        return None
+
+    def resetStatistics(self):
+        pass
+
+    def rebuildStatistics(self):
+        """
+        Recompute statistics from the answers stored in the room
+        """
+        self.resetStatistics()
+        if self.room is not None:
+            for answer in self.room.memberAnswers.widgetAnswers(self.id):
+                self.updateStatistics(None, answer)
+
+    def statisticsDelta(self):
+        """
+        Return statistics changed since the last call, by default all of them
+        """
+        return self.statistics()
+
+    def trackStatistics(self, enabled):
+        """
+        Start collecting changes for statisticsDelta or stop collecting them
+        when nobody receives the deltas
+        """
+        pass
+
 class Choice:
+    __slots__ = ("widget", "id", "_text")
+
+    text = layoutProperty("text")
+
     def __init__(self, text):
+        self.widget = None
         self.id = None
         self.text = text
 
+    def layoutChanged(self):
+        if self.widget is not None:
+            self.widget.layoutChanged()
+
     def layout(self):
         return {
             "id": self.id,
@@ -30,35 +152,104 @@ class Choice:
         }
 
 class ChoiceWidget(Widget):
+    __slots__ = ("choiceIdCounter", "choices", "counts", "respondents", "_multiple")
+
+    multiple = layoutProperty("multiple")
+
     def __init__(self, name, multiple, choices):
         super().__init__(name)
         self.choiceIdCounter = 0
-        self.choices = []
+        self.choices = IndexedList()
+        self.resetStatistics()
         for choice in choices:
             self.addChoice(choice)
         self.multiple = multiple
 
     def choice(self, choiceId):
-        for ch in self.choices:
-            if ch.id == choiceId:
-                return ch
-        return None
+        return self.choices.get(choiceId)
 
-    def addChoice(self, choice):
-        self.choiceIdCounter += 1
-        choice.id = self.choiceIdCounter
+    def addChoice(self, choice, keepId=False):
+        if keepId:
+            self.choiceIdCounter = max(self.choiceIdCounter, choice.id)
+        else:
+            self.choiceIdCounter += 1
+            choice.id = self.choiceIdCounter
+        choice.widget = self
         self.choices.append(choice)
+        self.layoutChanged()
 
     def reorderChoices(self, choicesIdList):
-        choicesDict = {ch.id: ch for ch in self.choices}
-        self.choices = list([choicesDict[chId] for chId in choicesIdList])
+        self.choices.reorder(choicesIdList)
+        self.layoutChanged()
 
     def deleteChoice(self, choiceId):
-        self.choices = list([ch for ch in self.choices if ch.id != choiceId])
+        """
+        Delete the choice and remove it from the stored answers. Return
+        usernames of members whose answer changed.
+        """
+        if self.choices.remove(choiceId) is None:
+            return []
+        self.layoutChanged()
+        return self.repairAnswers()
 
     def type(self):
         return "choice"
 
+    def applyLayout(self, layout):
+        recount = super().applyLayout(layout)
+        if self.multiple != layout["multiple"]:
+            self.multiple = layout["multiple"]
+            recount = True
+        choices = IndexedList()
+        for choiceLayout in layout["choices"]:
+            choice = self.choices.get(choiceLayout["id"])
+            if choice is None:
+                choice = Choice(choiceLayout["text"])
+                choice.id = choiceLayout["id"]
+                choice.widget = self
+                self.choiceIdCounter = max(self.choiceIdCounter, choice.id)
+            elif choice.text != choiceLayout["text"]:
+                choice.text = choiceLayout["text"]
+            choices.append(choice)
+        if choices.ids() != self.choices.ids():
+            recount = True
+        if list(choices.ids()) != list(self.choices.ids()):
+            self.choices = choices
+            self.layoutChanged()
+        return recount
+
+    def answerChoices(self, answer):
+        """
+        Return ids of the existing choices picked in the answer; answers may
+        still refer to deleted choices
+        """
+        if answer is None:
+            return set()
+        if not isinstance(answer, list):
+            answer = [answer]
+        return set(x for x in answer if self.choices.get(x) is not None)
+
+    def updateStatistics(self, oldAnswer, newAnswer):
+        oldChoices = self.answerChoices(oldAnswer)
+        newChoices = self.answerChoices(newAnswer)
+        for chId in oldChoices - newChoices:
+            self.counts[chId] -= 1
+            if self.counts[chId] == 0:
+                del self.counts[chId]
+        for chId in newChoices - oldChoices:
+            self.counts[chId] = self.counts.get(chId, 0) + 1
+        self.respondents += bool(newChoices) - bool(oldChoices)
+
+    def statistics(self):
+        return {
+            "counts": { ch.id: self.counts.get(ch.id, 0) for ch in self.choices },
+            "respondents": self.respondents
+        }
+
+    def resetStatistics(self):
+        self.counts = {}
+        self.respondents = 0
+
     def layout(self):
         layout = super().layout()
         layout.update({
@@ -67,20 +258,64 @@ class ChoiceWidget(Widget):
         })
         return layout
 
+    def isChoiceId(self, value):
+        return type(value) is int and self.choices.get(value) is not None
+
     def isValidAnswer(self, answer):
         if self.multiple:
-            return isinstance(answer, list)
+            return isinstance(answer, list) and all(self.isChoiceId(x) for x in answer)
         else:
-            return isinstance(answer, int)
+            return self.isChoiceId(answer)
+
+    def normalizeAnswer(self, answer):
+        if self.multiple:
+            return sorted(set(answer))
+        return answer
+
+    def restoreAnswer(self, answer):
+        if not isinstance(answer, list):
+            answer = [answer]
+        choices = sorted(set(x for x in answer if self.isChoiceId(x)))
+        if self.multiple:
+            # An answer left without choices is no answer at all
+            return choices if len(choices) > 0 or len(answer) == 0 else None
+        # A single choice answer is kept only if it is unambiguous
+        return choices[0] if len(choices) == 1 else None
+
+    def answerText(self, answer):
+        texts = []
+        for choiceId in sorted(self.answerChoices(answer)):
+            choice = self.choice(choiceId)
+            if choice is not None:
+                texts.append(choice.text)
+        return "; ".join(texts)
 
 
 class TextWidget(Widget):
+    __slots__ = ("text", "index")
+
     def __init__(self, name):
         super().__init__(name)
         self.text = ""
+        self.index = TextIndex()
 
     def type(self):
         return "text"
 
     def isValidAnswer(self, answer):
-        return isinstance(answer, str)
\ No newline at end of file
+        return isinstance(answer, str)
+
+    def updateStatistics(self, oldAnswer, newAnswer):
+        self.index.update(oldAnswer, newAnswer)
+
+    def statistics(self):
+        return self.index.statistics()
+
+    def resetStatistics(self):
+        self.index = TextIndex()
+
+    def statisticsDelta(self):
+        return self.index.delta()
+
+    def trackStatistics(self, enabled):
+        self.index.track(enabled)
\ No newline at end of file
@@ -0,0 +1,19 @@
+"""
+Unit tests of the server data structures. Run them from the server directory
+with `python3 -m unittest discover -s tests -t .`.
+
+Importing quickPoll creates the application and connects to the database, so
+the package is registered here without running its __init__; the tested
+modules do not depend on the application.
+"""
+
+import importlib.machinery
+import importlib.util
+import os
+import sys
+
+if "quickPoll" not in sys.modules:
+    spec = importlib.machinery.ModuleSpec("quickPoll", None, is_package=True)
+    spec.submodule_search_locations = [os.path.join(
+        os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "quickPoll")]
+    sys.modules["quickPoll"] = importlib.util.module_from_spec(spec)
@@ -0,0 +1,205 @@
+"""
+In-memory stand-in for the Redis client used by quickPoll.store.RedisStore,
+so that the multi-worker store runs in tests without a server. Several stores
+sharing one MemoryRedis behave like workers sharing a Redis server. Only the
+commands the store uses are implemented; replies are bytes as with the real
+client. Lua scripts are replaced by Python functions registered in SCRIPTS.
+"""
+
+import json
+import queue
+import time
+import quickPoll.store as store
+
+def encode(value):
+    if isinstance(value, bytes):
+        return value
+    return str(value).encode("utf-8")
+
+def leave(redis, keys, args):
+    session = redis.hget(keys[0], args[0])
+    if session is not None and json.loads(session)[0] == args[1]:
+        return redis.hdel(keys[0], args[0])
+    return 0
+
+# Script source -> Python function taking the client, keys and arguments
+SCRIPTS = {
+    store.LEAVE_SCRIPT: leave
+}
+
+class Script:
+    def __init__(self, redis, function):
+        self.redis = redis
+        self.function = function
+
+    def __call__(self, keys=[], args=[], client=None):
+        if isinstance(client, Pipeline):
+            client.commands.append(lambda: self.function(self.redis, keys, args))
+            return client
+        return self.function(self.redis, keys, args)
+
+class Pipeline:
+    """
+    Commands are queued and executed by execute, their replies returned as a
+    list
+    """
+    def __init__(self, redis):
+        self.redis = redis
+        self.commands = []
+
+    def __getattr__(self, name):
+        command = getattr(self.redis, name)
+
+        def queue(*args, **kwargs):
+            self.commands.append(lambda: command(*args, **kwargs))
+            return self
+        return queue
+
+    def execute(self):
+        commands, self.commands = self.commands, []
+        return [command() for command in commands]
+
+class PubSub:
+    """
+    Subscription receiving messages published after subscribe. listen stops
+    when no message arrives for timeout seconds, like a dropped connection.
+    """
+    def __init__(self, redis, timeout):
+        self.redis = redis
+        self.timeout = timeout
+        self.messages = queue.Queue()
+
+    def subscribe(self, channel):
+        self.redis.subscribers.setdefault(channel, []).append(self)
+
+    def listen(self):
+        while True:
+            try:
+                yield self.messages.get(timeout=self.timeout)
+            except queue.Empty:
+                return
+
+class MemoryRedis:
+    def __init__(self, listenTimeout=0.5):
+        self.data = {}
+        # Key -> time.monotonic() of the expiration
+        self.expires = {}
+        # Channel -> subscribed PubSub objects
+        self.subscribers = {}
+        self.listenTimeout = listenTimeout
+
+    def value(self, key, default):
+        key = encode(key)
+        if key in self.expires and self.expires[key] <= time.monotonic():
+            del self.expires[key]
+            self.data.pop(key, None)
+        return self.data.setdefault(key, default)
+
+    def cleanup(self, key):
+        key = encode(key)
+        if key in self.data and len(self.data[key]) == 0:
+            del self.data[key]
+            self.expires.pop(key, None)
+
+    def register_script(self, source):
+        return Script(self, SCRIPTS[source])
+
+    def pipeline(self, transaction=True):
+        return Pipeline(self)
+
+    def pubsub(self, ignore_subscribe_messages=False):
+        return PubSub(self, self.listenTimeout)
+
+    def publish(self, channel, message):
+        subscribers = self.subscribers.get(channel, [])
+        for subscriber in subscribers:
+            subscriber.messages.put({ "type": "message", "channel": encode(channel),
+                "data": encode(message) })
+        return len(subscribers)
+
+    def delete(self, *keys):
+        count = 0
+        for key in keys:
+            count += self.data.pop(encode(key), None) is not None
+            self.expires.pop(encode(key), None)
+        return count
+
+    def expire(self, key, seconds):
+        if encode(key) not in self.data:
+            return False
+        self.expires[encode(key)] = time.monotonic() + seconds
+        return True
+
+    def ttl(self, key):
+        if encode(key) not in self.data:
+            return -2
+        if encode(key) not in self.expires:
+            return -1
+        return round(self.expires[encode(key)] - time.monotonic())
+
+    def get(self, key):
+        return self.data.get(encode(key), None)
+
+    def incr(self, key):
+        value = int(self.value(key, b"0")) + 1
+        self.data[encode(key)] = encode(value)
+        return value
+
+    def hset(self, key, field, value):
+        h = self.value(key, {})
+        new = encode(field) not in h
+        h[encode(field)] = encode(value)
+        return int(new)
+
+    def hget(self, key, field):
+        return self.value(key, {}).get(encode(field), None)
+
+    def hdel(self, key, *fields):
+        h = self.value(key, {})
+        count = sum(h.pop(encode(field), None) is not None for field in fields)
+        self.cleanup(key)
+        return count
+
+    def hgetall(self, key):
+        h = dict(self.value(key, {}))
+        self.cleanup(key)
+        return h
+
+    def sadd(self, key, *members):
+        s = self.value(key, set())
+        count = len(set(encode(x) for x in members) - s)
+        s.update(encode(x) for x in members)
+        return count
+
+    def srem(self, key, *members):
+        s = self.value(key, set())
+        count = len(set(encode(x) for x in members) & s)
+        s.difference_update(encode(x) for x in members)
+        self.cleanup(key)
+        return count
+
+    def smembers(self, key):
+        s = set(self.value(key, set()))
+        self.cleanup(key)
+        return s
+
+    def zadd(self, key, mapping):
+        z = self.value(key, {})
+        count = len(set(encode(x) for x in mapping) - z.keys())
+        z.update((encode(member), float(score)) for member, score in mapping.items())
+        return count
+
+    def zrem(self, key, *members):
+        z = self.value(key, {})
+        count = sum(z.pop(encode(x), None) is not None for x in members)
+        self.cleanup(key)
+        return count
+
+    def zrangebyscore(self, key, min, max):
+        def bound(x):
+            return { "-inf": float("-inf"), "+inf": float("inf") }.get(x, x)
+        z = self.value(key, {})
+        result = [member for member, score in sorted(z.items(), key=lambda x: x[1])
+            if bound(min) <= score <= bound(max)]
+        self.cleanup(key)
+        return result
@@ -0,0 +1,167 @@
+import unittest
+from quickPoll.answers import StringTable, IntColumn, BitsetColumn, TextColumn, AnswerStore
+
+class StringTableTest(unittest.TestCase):
+    def testInterning(self):
+        t = StringTable()
+        a = t.acquire("yes")
+        self.assertEqual(t.acquire("yes"), a)
+        self.assertNotEqual(t.acquire("no"), a)
+        self.assertEqual(t.get(a), "yes")
+
+    def testReleaseReusesId(self):
+        t = StringTable()
+        a = t.acquire("yes")
+        t.acquire("yes")
+        t.release(a)
+        self.assertEqual(t.get(a), "yes")
+        t.release(a)
+        self.assertIsNone(t.get(a))
+        self.assertEqual(t.acquire("other"), a)
+        self.assertEqual(t.get(a), "other")
+
+class IntColumnTest(unittest.TestCase):
+    def testSetGet(self):
+        c = IntColumn()
+        c.set(3, 7)
+        self.assertEqual(c.get(3), 7)
+        self.assertIsNone(c.get(0))
+        self.assertIsNone(c.get(10))
+        c.set(0, 0)
+        self.assertEqual(c.get(0), 0)
+
+    def testDelete(self):
+        c = IntColumn()
+        c.set(1, 5)
+        c.set(1, None)
+        self.assertIsNone(c.get(1))
+
+class BitsetColumnTest(unittest.TestCase):
+    def testListConversion(self):
+        c = BitsetColumn()
+        c.set(0, [3, 1, 5])
+        self.assertEqual(c.get(0), [1, 3, 5])
+
+    def testEmptyAnswerIsPresent(self):
+        c = BitsetColumn()
+        c.set(2, [])
+        self.assertEqual(c.get(2), [])
+        self.assertIsNone(c.get(1))
+        self.assertIsNone(c.get(5))
+
+    def testDelete(self):
+        c = BitsetColumn()
+        c.set(0, [1])
+        c.set(0, None)
+        self.assertIsNone(c.get(0))
+
+    def testLargeIds(self):
+        c = BitsetColumn()
+        c.set(0, [1, 2])
+        c.set(1, [0, 62])
+        c.set(2, [1, 100])
+        self.assertEqual(c.get(0), [1, 2])
+        self.assertEqual(c.get(1), [0, 62])
+        self.assertEqual(c.get(2), [1, 100])
+        c.set(4, [])
+        c.set(2, None)
+        self.assertIsNone(c.get(2))
+        self.assertIsNone(c.get(3))
+        self.assertEqual(c.get(4), [])
+
+class TextColumnTest(unittest.TestCase):
+    def testSetGetDelete(self):
+        strings = StringTable()
+        c = TextColumn(strings)
+        c.set(1, "hello")
+        c.set(2, "hello")
+        self.assertEqual(c.get(1), "hello")
+        self.assertIsNone(c.get(0))
+        c.set(1, None)
+        self.assertIsNone(c.get(1))
+        self.assertEqual(c.get(2), "hello")
+        c.set(2, "bye")
+        self.assertNotIn("hello", strings.ids)
+
+    def testClearReleasesStrings(self):
+        strings = StringTable()
+        c = TextColumn(strings)
+        c.set(0, "a")
+        c.set(3, "b")
+        c.clear()
+        self.assertEqual(strings.ids, {})
+
+class AnswerStoreTest(unittest.TestCase):
+    def testUpdateAndGet(self):
+        s = AnswerStore()
+        s.update("alice", { 1: 2, 2: [1, 3], 3: "text" })
+        s.update("bob", { 1: 1 })
+        self.assertEqual(s.get("alice"), { 1: 2, 2: [1, 3], 3: "text" })
+        self.assertEqual(s.get("bob"), { 1: 1 })
+        self.assertEqual(s.get("carol"), {})
+        self.assertEqual(s.getAnswer("alice", 2), [1, 3])
+        self.assertIsNone(s.getAnswer("bob", 2))
+        self.assertIsNone(s.getAnswer("carol", 1))
+        self.assertIn("bob", s)
+        self.assertEqual(list(s.usernames()), ["alice", "bob"])
+
+    def testRemoveAnswer(self):
+        s = AnswerStore()
+        s.update("alice", { 1: 2, 2: "text" })
+        s.update("alice", { 1: None })
+        self.assertEqual(s.get("alice"), { 2: "text" })
+
+    def testTypeChange(self):
+        s = AnswerStore()
+        s.update("alice", { 1: 2 })
+        s.update("alice", { 1: [2, 4] })
+        self.assertEqual(s.getAnswer("alice", 1), [2, 4])
+        s.update("alice", { 1: 3 })
+        self.assertEqual(s.getAnswer("alice", 1), 3)
+
+    def testWidgetAnswers(self):
+        s = AnswerStore()
+        s.update("alice", { 1: 2 })
+        s.update("bob", { 2: 1 })
+        s.update("carol", { 1: 3 })
+        self.assertEqual(sorted(s.widgetAnswers(1)), [2, 3])
+
+    def testMemberAnswers(self):
+        s = AnswerStore()
+        s.update("alice", { 1: 2 })
+        s.update("bob", { 2: 1 })
+        s.update("carol", { 1: [3] })
+        self.assertEqual(list(s.memberAnswers(1)), [("alice", 2), ("carol", [3])])
+        self.assertEqual(list(s.memberAnswers(3)), [])
+
+    def testTag(self):
+        a = AnswerStore()
+        a.update("alice", { 1: 2, 2: [3, 1], 3: "text" })
+        a.update("alice", { 1: 1 })
+        b = AnswerStore()
+        b.update("bob", { 1: 5 })
+        b.update("alice", { 3: "text", 1: 1 })
+        b.update("alice", { 2: [1, 3], 4: 7 })
+        self.assertNotEqual(a.tag("alice"), b.tag("alice"))
+        b.update("alice", { 4: None })
+        self.assertEqual(a.tag("alice"), b.tag("alice"))
+        self.assertNotEqual(a.tag("alice"), a.tag("carol"))
+        self.assertEqual(a.tag("carol"), AnswerStore().tag("alice"))
+
+    def testTagAfterDropWidget(self):
+        a = AnswerStore()
+        a.update("alice", { 1: "text", 2: 1 })
+        a.dropWidget(1)
+        b = AnswerStore()
+        b.update("alice", { 2: 1 })
+        self.assertEqual(a.tag("alice"), b.tag("alice"))
+
+    def testDropWidget(self):
+        s = AnswerStore()
+        s.update("alice", { 1: "text", 2: 1 })
+        s.dropWidget(1)
+        self.assertEqual(s.get("alice"), { 2: 1 })
+        self.assertEqual(s.strings.ids, {})
+
+if __name__ == "__main__":
+    unittest.main()
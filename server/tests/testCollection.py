@@ -0,0 +1,51 @@
+import unittest
+from quickPoll.collection import IndexedList
+
+class Item:
+    def __init__(self, id):
+        self.id = id
+
+class IndexedListTest(unittest.TestCase):
+    def ids(self, l):
+        return [x.id for x in l]
+
+    def testAppendKeepsOrder(self):
+        l = IndexedList([Item(3), Item(1)])
+        l.append(Item(2))
+        self.assertEqual(self.ids(l), [3, 1, 2])
+        self.assertEqual(len(l), 3)
+        self.assertEqual(list(l.ids()), [3, 1, 2])
+
+    def testLookup(self):
+        item = Item(7)
+        l = IndexedList([Item(1), item])
+        self.assertIs(l.get(7), item)
+        self.assertIsNone(l.get(8))
+
+    def testRemove(self):
+        item = Item(2)
+        l = IndexedList([Item(1), item, Item(3)])
+        self.assertIs(l.remove(2), item)
+        self.assertIsNone(l.remove(2))
+        self.assertIsNone(l.get(2))
+        self.assertEqual(self.ids(l), [1, 3])
+
+    def testAppendAfterRemove(self):
+        l = IndexedList([Item(1), Item(2)])
+        l.remove(1)
+        l.append(Item(1))
+        self.assertEqual(self.ids(l), [2, 1])
+
+    def testReorder(self):
+        l = IndexedList([Item(1), Item(2), Item(3)])
+        l.reorder([3, 1, 2])
+        self.assertEqual(self.ids(l), [3, 1, 2])
+        self.assertEqual(l.get(1).id, 1)
+
+    def testDefaultIsNotShared(self):
+        a = IndexedList()
+        a.append(Item(1))
+        self.assertEqual(len(IndexedList()), 0)
+
+if __name__ == "__main__":
+    unittest.main()
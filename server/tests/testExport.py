@@ -0,0 +1,56 @@
+import csv
+import io
+import json
+import unittest
+from quickPoll.export import exportCsv, exportJsonLines
+from quickPoll.widgets import Choice, ChoiceWidget, TextWidget
+
+class Room:
+    """
+    The part of a room the export uses
+    """
+    def __init__(self):
+        self.id = "r"
+        self.name = "Room"
+        choice = ChoiceWidget("Choice", True, [Choice("a"), Choice("b")])
+        choice.id = 1
+        text = TextWidget("Text")
+        text.id = 2
+        self.widgets = [choice, text]
+
+    def teacherLayout(self):
+        return { "id": self.id, "widgets": [w.layout() for w in self.widgets] }
+
+class ExportTest(unittest.TestCase):
+    def setUp(self):
+        self.fetched = []
+
+    def fetchPeople(self, logins):
+        self.fetched.append(logins)
+        return { login: { "name": login.capitalize(), "uco": len(login) } for login in logins }
+
+    def memberAnswers(self):
+        yield "alice", { 1: [1, 2], 2: "yes" }
+        yield "bob", { 2: "no" }
+        yield "carol", {}
+
+    def testCsv(self):
+        text = "".join(exportCsv([(Room(), self.memberAnswers())], self.fetchPeople,
+            batchSize=2))
+        rows = list(csv.reader(io.StringIO(text)))
+        self.assertEqual(rows[0][:3], ["room", "roomName", "login"])
+        self.assertEqual(rows[1], ["r", "Room", "alice", "Alice", "5", "1", "Choice", "a; b"])
+        self.assertEqual([row[2] + row[5] + row[7] for row in rows[2:]],
+            ["alice2yes", "bob1", "bob2no", "carol1", "carol2"])
+        self.assertEqual(self.fetched, [["alice", "bob"], ["carol"]])
+
+    def testJsonLines(self):
+        lines = [json.loads(x) for x in
+            "".join(exportJsonLines([(Room(), self.memberAnswers())], self.fetchPeople)).splitlines()]
+        self.assertEqual(lines[0]["type"], "room")
+        self.assertEqual([x["login"] for x in lines[1:]], ["alice", "bob", "carol"])
+        self.assertEqual(lines[2], { "type": "member", "room": "r", "login": "bob",
+            "name": "Bob", "uco": 3, "answers": { "2": "no" } })
+
+if __name__ == "__main__":
+    unittest.main()
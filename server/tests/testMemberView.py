@@ -0,0 +1,150 @@
+import unittest
+from quickPoll.answers import AnswerStore
+from quickPoll.memberView import MemberIndex, RoomViews, normalizeWindow
+
+class Room:
+    """
+    The part of a room the member views use
+    """
+    def __init__(self):
+        self.members = {}
+        self.memberSessions = {}
+        self.answerTimes = {}
+        self.memberAnswers = AnswerStore()
+
+    def join(self, login):
+        self.members[login] = None
+        self.memberSessions[login] = "sid-" + login
+
+    def leave(self, login):
+        self.memberSessions.pop(login, None)
+
+    def answer(self, login, widgetId, value, at):
+        self.members[login] = None
+        self.memberAnswers.update(login, { widgetId: value })
+        self.answerTimes[login] = at
+
+PEOPLE = {
+    "alice": { "name": "Zuzana", "uco": 3 },
+    "bob": { "name": "Adam", "uco": None },
+    "carol": { "name": None, "uco": 1 },
+    "dave": { "name": "Marek", "uco": 2 }
+}
+
+def lookup(logins):
+    return { login: PEOPLE[login] for login in logins }
+
+class MemberIndexTest(unittest.TestCase):
+    def testUpdateMoves(self):
+        keys = { "a": 3, "b": 1, "c": 2 }
+        index = MemberIndex(lambda login: keys[login])
+        for login in keys:
+            index.update(login)
+        self.assertEqual(list(index.logins()), ["b", "c", "a"])
+        self.assertEqual(list(index.logins(descending=True)), ["a", "c", "b"])
+        keys["b"] = 5
+        index.update("b")
+        self.assertEqual(list(index.logins()), ["c", "a", "b"])
+        self.assertEqual(len(index), 3)
+
+class NormalizeWindowTest(unittest.TestCase):
+    def testDefaults(self):
+        window = normalizeWindow({ "offset": -1, "limit": 10000, "sort": "password" })
+        self.assertEqual(window["offset"], 0)
+        self.assertEqual(window["limit"], 500)
+        self.assertEqual(window["sort"], "login")
+        self.assertEqual(normalizeWindow(None)["filter"], {
+            "active": False,
+            "answered": None,
+            "notAnswered": None
+        })
+
+class RoomViewsTest(unittest.TestCase):
+    def setUp(self):
+        self.room = Room()
+        for login in ["carol", "alice", "dave", "bob"]:
+            self.room.join(login)
+        self.views = RoomViews(self.room, lookup)
+
+    def window(self, **window):
+        view = self.views.subscribe("teacher", window)
+        view.logins, view.total = self.views.window(view)
+        return view
+
+    def testSortOrder(self):
+        def order(**window):
+            return self.views.window(self.views.subscribe("teacher", window))[0]
+        self.assertEqual(order(sort="login"), ["alice", "bob", "carol", "dave"])
+        self.assertEqual(order(sort="login", descending=True), ["dave", "carol", "bob", "alice"])
+        # Members without a value go last
+        self.assertEqual(order(sort="name"), ["bob", "dave", "alice", "carol"])
+        self.assertEqual(order(sort="uco"), ["carol", "dave", "alice", "bob"])
+
+    def testLastAnswerOrder(self):
+        self.room.answer("dave", 1, 1, at=10)
+        self.room.answer("alice", 1, 2, at=20)
+        view = self.window(sort="lastAnswer", descending=True)
+        self.assertEqual(view.logins, ["alice", "dave", "carol", "bob"])
+        self.room.answer("carol", 1, 1, at=30)
+        updates = self.views.updates(["carol"])
+        self.assertEqual(updates, [(view, None)])
+        self.assertEqual(self.views.window(view)[0], ["carol", "alice", "dave", "bob"])
+
+    def testWindowMove(self):
+        view = self.window(offset=1, limit=2)
+        self.assertEqual((view.logins, view.total), (["bob", "carol"], 4))
+        view.window = normalizeWindow({ "offset": 3, "limit": 2 })
+        self.assertEqual(self.views.window(view), (["dave"], 4))
+        view.window = normalizeWindow({ "offset": 10, "limit": 2 })
+        self.assertEqual(self.views.window(view), ([], 4))
+
+    def testFilters(self):
+        self.room.answer("bob", 1, 2, at=1)
+        self.room.leave("carol")
+        answered = self.views.subscribe("a", { "filter": { "answered": 1 } })
+        self.assertEqual(self.views.window(answered), (["bob"], 1))
+        notAnswered = self.views.subscribe("b", { "filter": { "notAnswered": 1 } })
+        self.assertEqual(self.views.window(notAnswered), (["alice", "carol", "dave"], 3))
+        active = self.views.subscribe("c", { "filter": { "active": True } })
+        self.assertEqual(self.views.window(active), (["alice", "bob", "dave"], 3))
+
+    def testDeltaForMembersInWindow(self):
+        view = self.window(limit=2)
+        self.room.answer("alice", 1, 1, at=1)
+        self.room.answer("dave", 1, 1, at=2)
+        self.assertEqual(self.views.updates(["alice", "dave"]), [(view, ["alice"])])
+        self.room.answer("dave", 1, 2, at=3)
+        self.assertEqual(self.views.updates(["dave"]), [])
+
+    def testJoinChangesWindow(self):
+        view = self.window(limit=2)
+        self.room.join("aaron")
+        self.assertEqual(self.views.updates([]), [(view, None)])
+        self.assertEqual(self.views.window(view), (["aaron", "alice"], 5))
+
+    def testJoinOutsideWindowChangesTotal(self):
+        view = self.window(limit=2)
+        self.room.join("zoe")
+        self.assertEqual(self.views.updates([]), [(view, None)])
+        self.assertEqual(self.views.window(view), (["alice", "bob"], 5))
+
+    def testLeaveChangesActiveWindow(self):
+        view = self.window(filter={ "active": True })
+        self.room.leave("bob")
+        self.assertEqual(self.views.updates([]), [(view, None)])
+        self.assertEqual(self.views.window(view)[0], ["alice", "carol", "dave"])
+
+    def testLeaveInWindowIsDelta(self):
+        view = self.window(limit=2)
+        self.room.leave("alice")
+        self.room.leave("dave")
+        self.assertEqual(self.views.updates(["alice", "dave"]), [(view, ["alice"])])
+
+    def testUnsubscribeDropsIndexes(self):
+        self.views.window(self.views.subscribe("a", { "sort": "name" }))
+        self.views.window(self.views.subscribe("b", { "sort": "uco" }))
+        self.views.unsubscribe("a")
+        self.assertEqual(set(self.views.indexes.keys()), { "uco" })
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,125 @@
+import contextlib
+import io
+import threading
+import time
+import unittest
+from quickPoll.store import RedisStore, WORKERS, ANSWERS_TTL
+from tests.memoryRedis import MemoryRedis
+
+class Room:
+    """
+    The part of a room the store uses
+    """
+    def __init__(self, id):
+        self.id = id
+        self.revision = 0
+        self.answers = {}
+        self.sessions = {}
+
+    def restoreAnswers(self, username, answers):
+        self.answers[username] = answers
+
+class RoomSuite:
+    def join(self, room, username, sid):
+        room.sessions[username] = sid
+
+class Stop(Exception):
+    pass
+
+def stop(delay):
+    raise Stop()
+
+class RedisStoreTest(unittest.TestCase):
+    def setUp(self):
+        self.redis = MemoryRedis()
+        self.a = RedisStore(None, client=self.redis)
+        self.b = RedisStore(None, client=self.redis)
+
+    def join(self, store, username, sid):
+        store.publish({ "op": "join", "room": "r", "username": username, "sid": sid })
+
+    def load(self, store):
+        room = Room("r")
+        store.loadRoom(RoomSuite(), room)
+        return room
+
+    def testLoadRoom(self):
+        self.join(self.a, "alice", "s1")
+        self.a.publish({ "op": "answers", "room": "r", "username": "alice",
+            "answers": { "1": 2 } })
+        self.a.nextRevision(Room("r"))
+        room = self.load(self.b)
+        self.assertEqual(room.answers, { "alice": { "1": 2 } })
+        self.assertEqual(room.sessions, { "alice": "s1" })
+        self.assertEqual(room.revision, 1)
+        self.assertEqual(self.redis.ttl("quickpoll:answers:r"), ANSWERS_TTL)
+
+    def testLeaveKeepsNewerSession(self):
+        self.join(self.a, "alice", "s1")
+        self.join(self.b, "alice", "s2")
+        self.a.publish({ "op": "leave", "room": "r", "username": "alice", "sid": "s1" })
+        self.assertEqual(self.load(self.b).sessions, { "alice": "s2" })
+        self.b.publish({ "op": "leave", "room": "r", "username": "alice", "sid": "s2" })
+        self.assertEqual(self.load(self.b).sessions, {})
+
+    def testSessionsOfStoppedWorker(self):
+        self.join(self.a, "alice", "s1")
+        self.join(self.b, "bob", "s2")
+        # The heartbeat of a is too old
+        self.redis.zadd(WORKERS, { self.a.workerId: 0 })
+        self.assertEqual(self.load(self.b).sessions, { "bob": "s2" })
+        applied = []
+        with self.assertRaises(Stop):
+            self.b.heartbeat(applied.append, stop)
+        self.assertEqual([(x["op"], x["username"]) for x in applied], [("leave", "alice")])
+        self.assertEqual(self.redis.hgetall("quickpoll:sessions:r"), {
+            b"bob": b'["s2", "' + self.b.workerId.encode("utf-8") + b'"]'
+        })
+        self.assertEqual(self.redis.smembers("quickpoll:workerSessions:" + self.a.workerId),
+            set())
+
+    def testCloseReleasesSessions(self):
+        self.join(self.a, "alice", "s1")
+        self.a.close()
+        self.assertEqual(self.load(self.b).sessions, {})
+        self.assertNotIn(self.a.workerId, self.b.aliveWorkers())
+
+    def testDeleteRoom(self):
+        self.join(self.a, "alice", "s1")
+        self.a.publish({ "op": "answers", "room": "r", "username": "alice",
+            "answers": { "1": 2 } })
+        self.a.publish({ "op": "deleteRoom", "room": "r" })
+        room = self.load(self.b)
+        self.assertEqual((room.answers, room.sessions), ({}, {}))
+
+    def testListenSurvivesFailingOperation(self):
+        applied = []
+
+        def apply(operation):
+            if operation["username"] == "alice":
+                raise RuntimeError("Database unavailable")
+            applied.append(operation["username"])
+
+        def listen():
+            try:
+                self.a.listen(apply, stop)
+            except Stop:
+                pass
+
+        listener = threading.Thread(target=listen)
+        stderr = io.StringIO()
+        with contextlib.redirect_stderr(stderr):
+            listener.start()
+            while len(self.redis.subscribers.get("quickpoll:operations", [])) == 0:
+                time.sleep(0.01)
+            self.join(self.b, "alice", "s1")
+            self.join(self.b, "bob", "s2")
+            # Own operations are not applied again
+            self.join(self.a, "carol", "s3")
+            self.join(self.b, "dave", "s4")
+            listener.join()
+        self.assertEqual(applied, ["bob", "dave"])
+        self.assertIn("Database unavailable", stderr.getvalue())
+
+if __name__ == "__main__":
+    unittest.main()
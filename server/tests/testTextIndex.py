@@ -0,0 +1,80 @@
+import unittest
+from quickPoll.textIndex import TextIndex, normalizeText
+
+class NormalizeTextTest(unittest.TestCase):
+    def testFolding(self):
+        self.assertEqual(normalizeText("  Příliš\tŽLUŤOUČKÝ \n kůň "), "prilis zlutoucky kun")
+        self.assertEqual(normalizeText("STRASSE"), normalizeText("straße"))
+        self.assertEqual(normalizeText(" \t"), "")
+
+class TextIndexTest(unittest.TestCase):
+    def testGrouping(self):
+        index = TextIndex()
+        index.update(None, "Hello world")
+        index.update(None, "hello   WORLD")
+        index.update(None, "Hello")
+        index.update(None, "   ")
+        self.assertEqual(index.statistics(), {
+            "groups": {
+                "hello world": { "text": "Hello world", "count": 2 },
+                "hello": { "text": "Hello", "count": 1 }
+            },
+            "tokens": { "hello": 3, "world": 2 },
+            "respondents": 3
+        })
+
+    def testChangeAndRemove(self):
+        index = TextIndex()
+        index.update(None, "a b")
+        index.update("a b", "b c")
+        self.assertEqual(index.statistics()["groups"], { "b c": { "text": "b c", "count": 1 } })
+        self.assertEqual(index.statistics()["tokens"], { "b": 1, "c": 1 })
+        index.update("b c", None)
+        self.assertEqual(index.statistics(), { "groups": {}, "tokens": {}, "respondents": 0 })
+
+    def testDelta(self):
+        index = TextIndex()
+        index.update(None, "yes")
+        index.update(None, "no")
+        for i in range(5):
+            index.update(None, "answer %d" % i)
+        self.assertTrue(index.delta()["full"])
+        index.update(None, "Yes")
+        index.update("no", None)
+        self.assertEqual(index.delta(), {
+            "groups": {
+                "yes": { "text": "yes", "count": 2 },
+                "no": { "text": None, "count": 0 }
+            },
+            "tokens": { "yes": 2, "no": 0 },
+            "respondents": 7
+        })
+        self.assertEqual(index.delta()["groups"], {})
+
+    def testNoTrackingWithoutDeltas(self):
+        index = TextIndex()
+        for i in range(50):
+            index.update(None, "answer %d" % i)
+        self.assertIsNone(index.dirtyGroups)
+        index.delta()
+        index.track(False)
+        index.update(None, "another")
+        self.assertIsNone(index.dirtyTokens)
+
+    def testLargeDeltaBecomesFull(self):
+        index = TextIndex()
+        for i in range(10):
+            index.update(None, "answer %d" % i)
+        index.delta()
+        for i in range(10):
+            index.update("answer %d" % i, None)
+        self.assertIsNone(index.dirtyGroups)
+        self.assertEqual(index.delta(), {
+            "groups": {},
+            "tokens": {},
+            "respondents": 0,
+            "full": True
+        })
+
+if __name__ == "__main__":
+    unittest.main()
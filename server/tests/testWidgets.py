@@ -0,0 +1,127 @@
+import unittest
+from quickPoll.answers import AnswerStore
+from quickPoll.widgets import Choice, ChoiceWidget
+
+class Room:
+    """
+    The part of a room the widgets use
+    """
+    def __init__(self):
+        self.memberAnswers = AnswerStore()
+
+    def layoutChanged(self):
+        pass
+
+def answer(widget, username, value):
+    widget.updateStatistics(widget.room.memberAnswers.getAnswer(username, widget.id), value)
+    widget.room.memberAnswers.update(username, { widget.id: value })
+
+class ChoiceWidgetTest(unittest.TestCase):
+    def widget(self, multiple):
+        w = ChoiceWidget("Question", multiple, [Choice("a"), Choice("b"), Choice("c")])
+        w.id = 1
+        w.room = Room()
+        return w
+
+    def testStatistics(self):
+        w = self.widget(False)
+        answer(w, "alice", 1)
+        answer(w, "bob", 1)
+        answer(w, "bob", 2)
+        self.assertEqual(w.statistics(), {
+            "counts": { 1: 1, 2: 1, 3: 0 },
+            "respondents": 2
+        })
+
+    def testDeleteChoiceSingle(self):
+        w = self.widget(False)
+        answer(w, "alice", 1)
+        answer(w, "bob", 2)
+        self.assertEqual(w.deleteChoice(1), ["alice"])
+        self.assertIsNone(w.room.memberAnswers.getAnswer("alice", 1))
+        self.assertEqual(w.statistics(), {
+            "counts": { 2: 1, 3: 0 },
+            "respondents": 1
+        })
+        # The member whose answer was removed answers again
+        answer(w, "alice", 3)
+        self.assertEqual(w.statistics(), {
+            "counts": { 2: 1, 3: 1 },
+            "respondents": 2
+        })
+
+    def testDeleteChoiceMultiple(self):
+        w = self.widget(True)
+        answer(w, "alice", [1])
+        answer(w, "bob", [1, 2])
+        answer(w, "carol", [2])
+        self.assertEqual(w.deleteChoice(1), ["alice", "bob"])
+        self.assertEqual(w.deleteChoice(4), [])
+        self.assertIsNone(w.room.memberAnswers.getAnswer("alice", 1))
+        self.assertEqual(w.room.memberAnswers.getAnswer("bob", 1), [2])
+        self.assertEqual(w.statistics(), {
+            "counts": { 2: 2, 3: 0 },
+            "respondents": 2
+        })
+        answer(w, "bob", None)
+        self.assertEqual(w.statistics(), {
+            "counts": { 2: 1, 3: 0 },
+            "respondents": 1
+        })
+
+    def testRestoreAnswer(self):
+        w = self.widget(True)
+        w.deleteChoice(3)
+        self.assertEqual(w.restoreAnswer([3, 1, 7]), [1])
+        self.assertEqual(w.restoreAnswer(2), [2])
+        self.assertEqual(w.restoreAnswer([]), [])
+        self.assertIsNone(w.restoreAnswer([3]))
+        w.multiple = False
+        self.assertEqual(w.restoreAnswer([1, 3]), 1)
+        self.assertIsNone(w.restoreAnswer([1, 2]))
+        self.assertIsNone(w.restoreAnswer("1"))
+
+    def testToggleMultipleRepairsAnswers(self):
+        w = self.widget(False)
+        answer(w, "alice", 1)
+        w.multiple = True
+        self.assertEqual(w.repairAnswers(), ["alice"])
+        self.assertEqual(w.room.memberAnswers.getAnswer("alice", 1), [1])
+        answer(w, "bob", [1, 2])
+        w.multiple = False
+        self.assertEqual(w.repairAnswers(), ["alice", "bob"])
+        self.assertEqual(w.room.memberAnswers.get("alice"), { 1: 1 })
+        self.assertEqual(w.room.memberAnswers.get("bob"), {})
+        self.assertEqual(w.statistics(), {
+            "counts": { 1: 1, 2: 0, 3: 0 },
+            "respondents": 1
+        })
+
+    def testAnswerTextSkipsDeletedChoices(self):
+        w = self.widget(True)
+        w.deleteChoice(2)
+        self.assertEqual(w.answerText([1, 2, 3]), "a; c")
+
+    def testApplyLayoutRename(self):
+        w = self.widget(False)
+        answer(w, "alice", 1)
+        layout = w.layout()
+        layout["name"] = "Renamed"
+        layout["choices"][0]["text"] = "A"
+        self.assertFalse(w.applyLayout(layout))
+        self.assertEqual(w.layout(), layout)
+        self.assertEqual(w.statistics()["counts"][1], 1)
+
+    def testApplyLayoutChoices(self):
+        w = self.widget(False)
+        layout = w.layout()
+        layout["choices"] = [{ "id": 3, "text": "c" }, { "id": 5, "text": "e" }]
+        self.assertTrue(w.applyLayout(layout))
+        self.assertEqual(w.layout(), layout)
+        self.assertEqual(w.choiceIdCounter, 5)
+        layout["choices"].reverse()
+        self.assertFalse(w.applyLayout(layout))
+        self.assertEqual(w.layout(), layout)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -18,12 +18,14 @@ db = psycopg2.connect(**config.DB_CONNECTION)
 cursor = db.cursor()
 
 try:
-    for teacherLogin in sys.argv[2:]:
-        cursor.execute("""
-            INSERT INTO teachers (login)
-                VALUES (%s)
-                ON CONFLICT (login) DO NOTHING;
-            """, [teacherLogin])
+    cursor.execute("""
+        INSERT INTO teachers (login)
+            SELECT DISTINCT unnest(%s::VARCHAR(32)[])
+            ON CONFLICT (login) DO NOTHING;
+        """, [sys.argv[2:]])
+    # Let running servers drop the added logins from their member directory
+    cursor.execute("SELECT pg_notify('quickpoll_directory', %s);",
+        [",".join(sys.argv[2:])])
 except Exception as e:
     db.rollback()
     raise
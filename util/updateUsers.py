@@ -1,10 +1,18 @@
 #!/usr/bin/env python3
 
-import ldap
+import argparse
+import csv
 import importlib.util
+import io
 import sys
 import psycopg2
 
+LDAP_URL = "ldap://ldap.fi.muni.cz"
+LDAP_BASE = "ou=People,dc=fi,dc=muni,dc=cz"
+
+# Payload of NOTIFY is limited to 8000 bytes, notify all logins above this
+NOTIFY_LIMIT = 7000
+
 def getUcoFromDescription(descr):
     for item in descr:
         item = item.decode("utf-8")
@@ -26,41 +34,199 @@ def ldapRecordToTableRow(rec):
         "uco": getUcoFromDescription(rec.get("description", []))
     }
 
-if len(sys.argv) != 2:
-    print("Invalid usage! Use './updateUsers.py <path_to_config_file>")
-    sys.exit(1)
+def ldapPages(url, base, pageSize):
+    """
+    Stream the directory page by page using the paged results control, yield
+    lists of records
+    """
+    import ldap
+    from ldap.controls import SimplePagedResultsControl
+
+    l = ldap.initialize(url)
+    l.simple_bind_s()
+    control = SimplePagedResultsControl(True, size=pageSize, cookie="")
+    while True:
+        msgid = l.search_ext(base, ldap.SCOPE_SUBTREE,
+            attrlist=["uid", "displayName", "description"], serverctrls=[control])
+        _, records, _, serverControls = l.result3(msgid)
+        yield records
+        cookies = [c.cookie for c in serverControls
+            if c.controlType == SimplePagedResultsControl.controlType]
+        if len(cookies) == 0 or not cookies[0]:
+            break
+        control.cookie = cookies[0]
+    l.unbind_s()
+
+def readLdif(path, pageSize, onPage):
+    """
+    Stream records from an LDIF export, call onPage with lists of records.
+    The parser hands over records one by one via handle, so pages are pushed
+    instead of yielded.
+    """
+    import ldif
+
+    class PagingParser(ldif.LDIFParser):
+        def __init__(self, f):
+            super().__init__(f)
+            self.page = []
+
+        def handle(self, dn, entry):
+            self.page.append((dn, entry))
+            if len(self.page) >= pageSize:
+                onPage(self.page)
+                self.page = []
+
+    with open(path, "rb") as f:
+        parser = PagingParser(f)
+        parser.parse_entry_records()
+        onPage(parser.page)
+
+def csvPages(path, pageSize):
+    """
+    Read rows from a CSV file with header login,name,uco, yield lists of rows
+    """
+    with open(path, newline="", encoding="utf-8") as f:
+        page = []
+        for x in csv.DictReader(f):
+            page.append({
+                "login": x["login"],
+                "name": x.get("name") or None,
+                "uco": int(x["uco"]) if x.get("uco") else None
+            })
+            if len(page) >= pageSize:
+                yield page
+                page = []
+        yield page
+
+def copyRows(cursor, rows):
+    """
+    Bulk load rows into the staging table
+    """
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    for row in rows:
+        writer.writerow([row["login"],
+            "\\N" if row["name"] is None else row["name"],
+            "\\N" if row["uco"] is None else row["uco"]])
+    buffer.seek(0)
+    cursor.copy_expert("""
+        COPY people_staging (login, name, uco)
+            FROM STDIN WITH (FORMAT csv, NULL '\\N');""", buffer)
+    return len(rows)
+
+def printDiff(cursor, limit):
+    cursor.execute("""
+        SELECT s.login, p.login IS NULL AS new, p.name, p.uco, s.name, s.uco
+            FROM people_staging AS s
+            LEFT JOIN people AS p ON p.login = s.login
+            WHERE (p.name, p.uco) IS DISTINCT FROM (s.name, s.uco)
+            ORDER BY s.login;""")
+    new = changed = 0
+    for login, isNew, oldName, oldUco, name, uco in cursor:
+        if isNew:
+            new += 1
+        else:
+            changed += 1
+        if new + changed <= limit:
+            if isNew:
+                print("+ {}: {!r}, {}".format(login, name, uco))
+            else:
+                print("~ {}: {!r}, {} -> {!r}, {}".format(login, oldName, oldUco, name, uco))
+    if new + changed > limit:
+        print("... {} more".format(new + changed - limit))
+    cursor.execute("""
+        SELECT count(*) FROM people AS p
+            WHERE NOT EXISTS (SELECT 1 FROM people_staging AS s WHERE s.login = p.login);""")
+    missing = cursor.fetchone()[0]
+    print("{} new, {} changed, {} not in the source (kept)".format(new, changed, missing))
+
+def merge(cursor):
+    """
+    Upsert the staging table into people touching only changed rows, return
+    changed logins
+    """
+    cursor.execute("""
+        INSERT INTO people (login, name, uco)
+            SELECT login, name, uco FROM people_staging
+            ON CONFLICT (login) DO UPDATE
+            SET name = excluded.name,
+                uco = excluded.uco
+            WHERE (people.name, people.uco) IS DISTINCT FROM (excluded.name, excluded.uco)
+            RETURNING login;""")
+    return [x[0] for x in cursor]
+
+parser = argparse.ArgumentParser(description="Synchronize people from LDAP")
+parser.add_argument("config", help="path to the server configuration file")
+source = parser.add_mutually_exclusive_group()
+source.add_argument("--ldif", help="read people from an LDIF file instead of LDAP")
+source.add_argument("--csv", help="read people from a CSV file (login,name,uco) instead of LDAP")
+parser.add_argument("--dry-run", action="store_true",
+    help="only report the differences, do not change the database")
+parser.add_argument("--page-size", type=int, default=1000)
+parser.add_argument("--diff-limit", type=int, default=100,
+    help="maximal number of differences listed in the report")
+args = parser.parse_args()
 
 # Import configuration from python file
-spec = importlib.util.spec_from_file_location("config", sys.argv[1])
+spec = importlib.util.spec_from_file_location("config", args.config)
 config = importlib.util.module_from_spec(spec)
 spec.loader.exec_module(config)
 
-db = psycopg2.connect(**config.DB_CONNECTION)
-
-l = ldap.initialize('ldap://ldap.fi.muni.cz')
-l.simple_bind_s()
-res = l.search_s('ou=People,dc=fi,dc=muni,dc=cz', ldap.SCOPE_SUBTREE)
+if args.ldif is not None:
+    # Pushed page by page by readLdif
+    pages = None
+elif args.csv is not None:
+    pages = csvPages(args.csv, args.page_size)
+else:
+    pages = (map(ldapRecordToTableRow, page)
+        for page in ldapPages(LDAP_URL, LDAP_BASE, args.page_size))
 
+db = psycopg2.connect(**config.DB_CONNECTION)
 cursor = db.cursor()
 
 try:
-    for rec in res:
-        row = ldapRecordToTableRow(rec)
-        if row["login"] is None:
-            continue
-        cursor.execute("""
-            INSERT INTO people (login, name, uco)
-                VALUES (%s, %s, %s)
-                ON CONFLICT (login) DO UPDATE
-                SET name = excluded.name,
-                    uco = excluded.uco;
-            """, [
-                row["login"],
-                row["name"],
-                row["uco"],
-            ])
+    # The staging table is private to this transaction; people is touched
+    # only by the final merge
+    cursor.execute("""
+        CREATE TEMPORARY TABLE people_staging (
+            login VARCHAR(32) NOT NULL PRIMARY KEY,
+            name TEXT,
+            uco INTEGER
+        ) ON COMMIT DROP;""")
+    counts = []
+    seen = set()
+    def loadPage(page):
+        rows = []
+        for row in page:
+            if row["login"] is None or row["login"] in seen:
+                continue
+            seen.add(row["login"])
+            rows.append(row)
+        counts.append(copyRows(cursor, rows))
+    if args.ldif is not None:
+        readLdif(args.ldif, args.page_size,
+            lambda records: loadPage(map(ldapRecordToTableRow, records)))
+    else:
+        for page in pages:
+            loadPage(page)
+    print("{} people read".format(sum(counts)), file=sys.stderr)
+
+    if args.dry_run:
+        printDiff(cursor, args.diff_limit)
+    else:
+        changed = merge(cursor)
+        print("{} people inserted or updated".format(len(changed)), file=sys.stderr)
+        # Let running servers drop changed logins from their member directory
+        payload = ",".join(changed)
+        if len(payload) > NOTIFY_LIMIT:
+            cursor.execute("NOTIFY quickpoll_directory;")
+        elif len(changed) > 0:
+            cursor.execute("SELECT pg_notify('quickpoll_directory', %s);", [payload])
 except Exception as e:
     db.rollback()
     raise
 else:
-    db.commit()
\ No newline at end of file
+    if args.dry_run:
+        db.rollback()
+    else:
+        db.commit()